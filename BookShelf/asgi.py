@@ -9,9 +9,16 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookShelf.settings')
 
 application = get_asgi_application()
 
+# Here rather than in LibraryConfig.ready, so only servers warm up (see library/startup.py).
+# Sync views run in a thread pool, so connections opened here would go unused.
+if settings.STARTUP_WARMUP:
+    from library.startup import warm_up
+    warm_up(databases=False)
+
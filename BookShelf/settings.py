@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Try to load environment variables from .env file
 try:
@@ -66,6 +67,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add WhiteNoise for static files
+    'library.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -115,6 +117,85 @@ else:
         }
     }
 
+# Read replicas: comma-separated URLs, e.g. for local testing with two
+# SQLite files (copy db.sqlite3 to replica.sqlite3 first):
+#   DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+# GET requests read from a replica; a client is pinned to the primary for
+# REPLICA_PIN_SECONDS after each write. Tests mirror replicas to default.
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+DATABASE_REPLICAS = []
+
+for index, url in enumerate(DATABASE_REPLICA_URLS):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+# Book sharding: comma-separated URLs of extra databases for Book rows,
+# e.g. BOOK_SHARD_URLS=sqlite:///books_1.sqlite3,sqlite:///books_2.sqlite3
+# default stays the first shard. Run `manage.py migrate_shards` after adding
+# one, and `manage.py rebalance_shards` to move existing users onto it.
+BOOK_SHARD_URLS = [
+    url.strip() for url in os.environ.get('BOOK_SHARD_URLS', '').split(',') if url.strip()
+]
+BOOK_SHARDS = ['default']
+
+for index, url in enumerate(BOOK_SHARD_URLS, start=1):
+    alias = f'books_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    BOOK_SHARDS.append(alias)
+
+BOOK_SHARD_CACHE_TIMEOUT = int(os.environ.get('BOOK_SHARD_CACHE_TIMEOUT', '60'))
+
+DATABASE_ROUTERS = [
+    'library.routers.BookShardRouter',
+    'library.routers.PrimaryReplicaRouter',
+]
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+
+
+# Authentication backends
+# ProfileModelBackend loads request.user together with its profile
+
+AUTHENTICATION_BACKENDS = [
+    'library.backends.ProfileModelBackend',
+]
+
+
+# Cache
+# Redis when REDIS_URL is set (shared by all workers), per-process memory otherwise
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Auth/session cache: sessions are read from the cache and written through
+# to the database, and request.user is cached for a short TTL. It needs the
+# shared Redis cache: with per-process memory a logout or a changed user
+# would only be seen by the worker that handled it.
+AUTH_CACHE_ENABLED = os.environ.get('AUTH_CACHE_ENABLED', 'False') == 'True'
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', '60'))
+
+if AUTH_CACHE_ENABLED:
+    if not REDIS_URL:
+        raise ImproperlyConfigured('AUTH_CACHE_ENABLED needs REDIS_URL, so every worker shares the cache.')
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -174,3 +255,58 @@ LOGOUT_REDIRECT_URL = 'index'
 # OpenAI API Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+# Seconds the AI views wait for OpenAI; ai_recommend gives up sooner and
+# answers from the local recommender
+AI_TIMEOUT = float(os.getenv('AI_TIMEOUT', '30'))
+AI_RECOMMEND_TIMEOUT = float(os.getenv('AI_RECOMMEND_TIMEOUT', '8'))
+
+# Circuit breaker around OpenAI (see library/ai_client.py): opens for
+# AI_BREAKER_COOLDOWN seconds once, over the last AI_BREAKER_WINDOW seconds,
+# at least AI_BREAKER_MIN_CALLS calls were made and AI_BREAKER_FAILURE_RATE
+# of them failed or took AI_BREAKER_SLOW_CALL_SECONDS or more
+AI_BREAKER_WINDOW = int(os.getenv('AI_BREAKER_WINDOW', '60'))
+AI_BREAKER_MIN_CALLS = int(os.getenv('AI_BREAKER_MIN_CALLS', '10'))
+AI_BREAKER_FAILURE_RATE = float(os.getenv('AI_BREAKER_FAILURE_RATE', '0.5'))
+AI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('AI_BREAKER_SLOW_CALL_SECONDS', '10'))
+AI_BREAKER_COOLDOWN = int(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+
+# Send a hedged second attempt once a call is slower than this percentile
+# of recent latencies (0 disables hedging)
+AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', '0'))
+
+# Successful answers are kept this long and served while OpenAI is unavailable
+AI_RESPONSE_CACHE_TIMEOUT = int(os.getenv('AI_RESPONSE_CACHE_TIMEOUT', '86400'))
+
+# Shelf quizzes (see library/quizzes.py): books are packed into prompts of
+# up to AI_QUIZ_BATCH_TOKENS tokens (answer included), AI_QUIZ_CONCURRENCY
+# prompts at a time
+AI_QUIZ_BATCH_TOKENS = int(os.getenv('AI_QUIZ_BATCH_TOKENS', '3500'))
+AI_QUIZ_CONCURRENCY = int(os.getenv('AI_QUIZ_CONCURRENCY', '4'))
+
+# Live dashboard updates, streamed as server-sent events when served over
+# ASGI (see library/live.py). InProcessBroker is enough for one worker;
+# with several, library.live.DatabaseBroker relays events through the
+# database, polled every LIVE_UPDATES_POLL_SECONDS and kept for
+# LIVE_UPDATES_RETENTION seconds. Streams send a heartbeat every
+# LIVE_UPDATES_HEARTBEAT seconds and end (the browser reconnects) after
+# LIVE_UPDATES_STREAM_SECONDS.
+LIVE_UPDATES_BROKER = os.getenv('LIVE_UPDATES_BROKER', 'library.live.InProcessBroker')
+LIVE_UPDATES_POLL_SECONDS = float(os.getenv('LIVE_UPDATES_POLL_SECONDS', '1'))
+LIVE_UPDATES_RETENTION = int(os.getenv('LIVE_UPDATES_RETENTION', '300'))
+LIVE_UPDATES_HEARTBEAT = float(os.getenv('LIVE_UPDATES_HEARTBEAT', '15'))
+LIVE_UPDATES_STREAM_SECONDS = int(os.getenv('LIVE_UPDATES_STREAM_SECONDS', '300'))
+
+# Compile templates, load the URLconf and (under WSGI) open database
+# connections when a worker boots instead of on its first requests (see
+# library/startup.py)
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'False') == 'True'
+
+# Local recommender index (see library/recommender.py), rebuilt with
+# `manage.py build_recommender`
+RECOMMENDER_INDEX_DIR = Path(os.getenv('RECOMMENDER_INDEX_DIR', BASE_DIR / 'var' / 'recommender'))
+
+# Runs the tests with a throwaway recommender index (see library/test_runner.py)
+TEST_RUNNER = 'library.test_runner.TestRunner'
+
@@ -9,9 +9,15 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookShelf.settings')
 
 application = get_wsgi_application()
 
+# Here rather than in LibraryConfig.ready, so only servers warm up (see library/startup.py)
+if settings.STARTUP_WARMUP:
+    from library.startup import warm_up
+    warm_up()
+
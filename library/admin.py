@@ -1,16 +1,159 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Book, Profile
+from django.db.models import F, Q
+from django.http import QueryDict
+from django.db.models.functions import Upper
+from .live import publish_shelf_changed
+from .models import ArchivedBook, Book, BookQuiz, Profile, record_removed_books
+from .paginators import EstimatedCountPaginator
+from .sharding import is_sharded
+from .trends import record_status_changes
+
+
+class IndexedPrefixSearchMixin:
+    """
+    Search that matches the start of a field through an index instead of
+    scanning the table with ``LIKE '%term%'``.
+
+    ``prefix_search_fields`` maps each field to the indexed expression it is
+    searched on: ``Upper(field)`` (with a matching expression index) for a
+    case-insensitive search, or ``F(field)`` for a case-sensitive one on a
+    plain index. The term becomes a range on that expression, which every
+    database can answer from the index, plus the exact prefix check.
+    """
+    prefix_search_fields = {}
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+    
+        condition = Q()
+        for i, (field, expression) in enumerate(self.prefix_search_fields.items()):
+            case_insensitive = isinstance(expression, Upper)
+            lookup = 'istartswith' if case_insensitive else 'startswith'
+            match = Q(**{f'{field}__{lookup}': term})
+            # SQLite's UPPER() only folds ASCII, so other terms skip the index
+            if term.isascii():
+                low = term.upper() if case_insensitive else term
+                high = low[:-1] + chr(ord(low[-1]) + 1)
+                name = f'_prefix_search_{i}'
+                queryset = queryset.alias(**{name: expression})
+                match &= Q(**{f'{name}__gte': low, f'{name}__lt': high})
+            condition |= match
+        return queryset.filter(condition), False
+
+
+class BigTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows."""
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) behind "N results (M total)"
+    show_full_result_count = False
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Picks the shard a sharded changelist reads; there is no "All"."""
+    title = 'shard'
+    parameter_name = 'shard'
+    
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.BOOK_SHARDS]
+    
+    def queryset(self, request, queryset):
+        # ShardedAdmin.get_queryset() has already switched the database
+        return queryset
+    
+    def choices(self, changelist):
+        current = self.value() or settings.BOOK_SHARDS[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == current,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedAdmin(BigTableAdmin):
+    """
+    Admin for a model whose rows live on their user's shard. The changelist
+    reads one shard at a time, picked with ``ShardFilter``; the change and
+    delete views read the shard kept in the changelist's preserved filters,
+    and saves and deletes go back to the database the object came from.
+    """
+    
+    def get_shard(self, request):
+        alias = request.GET.get(ShardFilter.parameter_name)
+        if alias is None:
+            preserved = QueryDict(request.GET.get('_changelist_filters', ''))
+            alias = preserved.get(ShardFilter.parameter_name)
+        return alias if alias in settings.BOOK_SHARDS else settings.BOOK_SHARDS[0]
+    
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        return (ShardFilter, *list_filter) if is_sharded() else list_filter
+    
+    def get_list_select_related(self, request):
+        # auth_user is only on default, so other shards can't join it
+        if self.get_shard(request) != 'default':
+            return ()
+        return super().get_list_select_related(request)
+    
+    def get_queryset(self, request):
+        alias = self.get_shard(request)
+        queryset = super().get_queryset(request).using(alias)
+        if alias != 'default':
+            queryset = queryset.prefetch_related('user')
+        return queryset
+    
+    def save_model(self, request, obj, form, change):
+        # A new object goes to its user's shard
+        obj.save(using=obj._state.db if change else None)
+    
+    def delete_model(self, request, obj):
+        obj.delete(using=obj._state.db)
 
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(IndexedPrefixSearchMixin, ShardedAdmin):
     list_display = ('title', 'author', 'status', 'user', 'date_added')
     list_filter = ('status', 'date_added')
+    date_hierarchy = 'date_added'
+    search_fields = ('title', 'author')
+    search_help_text = 'Start of the title or author.'
+    prefix_search_fields = {'title': Upper('title'), 'author': Upper('author')}
+    
+    def delete_queryset(self, request, queryset):
+        # Queryset deletes bypass Book.delete(); log them as shelf changes here
+        rows = list(queryset.values_list('pk', 'user_id', 'status', 'title', 'author'))
+        changes = [(user_id, pk, status, None, None) for pk, user_id, status, *_ in rows]
+        super().delete_queryset(request, queryset)
+        record_status_changes(changes, using=queryset.db)
+        publish_shelf_changed((user_id for user_id, *_ in changes), using=queryset.db)
+        record_removed_books(
+            [Book(user_id=user_id, title=title, author=author) for _, user_id, _, title, author in rows],
+            using=queryset.db,
+        )
+
+
+@admin.register(ArchivedBook)
+class ArchivedBookAdmin(ShardedAdmin):
+    list_display = ('title', 'author', 'user', 'date_added', 'archived_at')
+    search_fields = ('title', 'author')
+
+
+@admin.register(BookQuiz)
+class BookQuizAdmin(ShardedAdmin):
+    list_display = ('title', 'author', 'difficulty', 'user', 'created_at')
     search_fields = ('title', 'author')
 
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
+class ProfileAdmin(IndexedPrefixSearchMixin, BigTableAdmin):
     list_display = ('user', 'bio', 'location')
     search_fields = ('user__username',)
-
+    search_help_text = 'Start of the username (case-sensitive).'
+    prefix_search_fields = {'user__username': F('user__username')}
+    raw_id_fields = ()
+    autocomplete_fields = ('user',)
@@ -0,0 +1,284 @@
+"""
+Client for the upstream AI provider's chat completions API.
+
+Every call goes through a circuit breaker whose counters live in the cache.
+With ``REDIS_URL`` set, all workers share one view of the provider's health;
+with the per-process fallback each worker has a breaker of its own, and
+``LibraryConfig.ready()`` logs a warning. Calls are counted
+in ``BUCKET_SECONDS`` buckets together with a latency histogram. Once the
+share of failed or slow calls over the last ``AI_BREAKER_WINDOW`` seconds
+crosses ``AI_BREAKER_FAILURE_RATE``, the breaker opens. While it is open,
+calls fail fast with ``AIUnavailable`` (or are answered from the response
+cache). After ``AI_BREAKER_COOLDOWN`` seconds a single probe call is let
+through, and it decides whether the breaker closes or stays open.
+
+With ``AI_HEDGE_PERCENTILE`` set, a call still running past that
+percentile of recent latencies gets a second, hedged attempt. Whichever
+attempt answers first wins. Hedges are capped at ``HEDGE_BUDGET`` of
+recent calls so a slow provider never gets twice the load.
+"""
+import bisect
+import hashlib
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'library:ai-breaker'
+OPEN_KEY = f'{KEY_PREFIX}:open-until'
+PROBE_KEY = f'{KEY_PREFIX}:probe'
+BUCKET_SECONDS = 10
+# Upper bounds in seconds of the latency histogram buckets, 50ms to ~50s
+LATENCY_BOUNDS = tuple(round(0.05 * 1.5 ** i, 3) for i in range(18))
+COUNTERS = ('calls', 'failures', 'slow', 'hedges') + tuple(f'latency{i}' for i in range(len(LATENCY_BOUNDS)))
+HEDGE_BUDGET = 0.1
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='ai-client')
+
+
+class AIUnavailable(Exception):
+    """The provider timed out, failed or is rate limiting, or the breaker is open."""
+
+
+class AIError(Exception):
+    """The provider rejected the request itself (bad key, bad payload)."""
+
+
+def _incr(key, timeout):
+    if not cache.add(key, 1, timeout):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, timeout)
+
+
+class CircuitBreaker:
+    """Breaker state and statistics for the AI provider, kept in the default cache."""
+
+    def _buckets(self, now):
+        current = int(now // BUCKET_SECONDS)
+        count = max(1, math.ceil(settings.AI_BREAKER_WINDOW / BUCKET_SECONDS))
+        return range(current - count + 1, current + 1)
+
+    def _key(self, bucket, counter):
+        return f'{KEY_PREFIX}:{bucket}:{counter}'
+
+    def snapshot(self, now=None):
+        """Counters over the window plus the open-until time, in one cache round trip."""
+        now = time.time() if now is None else now
+        buckets = self._buckets(now)
+        keys = [self._key(bucket, counter) for bucket in buckets for counter in COUNTERS]
+        values = cache.get_many(keys + [OPEN_KEY])
+        snapshot = dict.fromkeys(COUNTERS, 0)
+        for bucket in buckets:
+            for counter in COUNTERS:
+                snapshot[counter] += values.get(self._key(bucket, counter), 0)
+        snapshot['open_until'] = values.get(OPEN_KEY)
+        snapshot['now'] = now
+        return snapshot
+
+    def state(self, snapshot):
+        open_until = snapshot['open_until']
+        if open_until is None:
+            return CLOSED
+        return OPEN if snapshot['now'] < open_until else HALF_OPEN
+
+    def acquire(self, snapshot, timeout):
+        """
+        Admit a call, or raise AIUnavailable while the breaker is open.
+        Returns True if the call is the half-open probe.
+        """
+        state = self.state(snapshot)
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and cache.add(PROBE_KEY, 1, math.ceil(timeout) + 1):
+            return True
+        raise AIUnavailable('The AI service is temporarily unavailable. Please try again shortly.')
+
+    def latency_percentile(self, snapshot, pct):
+        """Upper bound of the latency bucket holding the ``pct`` percentile, or None without enough calls."""
+        total = sum(snapshot[f'latency{i}'] for i in range(len(LATENCY_BOUNDS)))
+        if total < settings.AI_BREAKER_MIN_CALLS:
+            return None
+        rank = pct / 100 * total
+        seen = 0
+        for i, bound in enumerate(LATENCY_BOUNDS):
+            seen += snapshot[f'latency{i}']
+            if seen >= rank:
+                return bound
+        return LATENCY_BOUNDS[-1]
+
+    def hedge_delay(self, snapshot):
+        """How long to wait before hedging a call, or None to not hedge it."""
+        pct = settings.AI_HEDGE_PERCENTILE
+        if not pct or snapshot['hedges'] >= HEDGE_BUDGET * snapshot['calls']:
+            return None
+        return self.latency_percentile(snapshot, pct)
+
+    def record_hedge(self):
+        bucket = int(time.time() // BUCKET_SECONDS)
+        _incr(self._key(bucket, 'hedges'), settings.AI_BREAKER_WINDOW + BUCKET_SECONDS)
+
+    def record(self, latency, failed, probe=False):
+        """Count a finished call and open or close the breaker accordingly."""
+        now = time.time()
+        if probe:
+            if failed:
+                cache.set(OPEN_KEY, now + settings.AI_BREAKER_COOLDOWN, None)
+            else:
+                self.reset(now)
+            cache.delete(PROBE_KEY)
+            return
+
+        slow = not failed and latency >= settings.AI_BREAKER_SLOW_CALL_SECONDS
+        bucket = int(now // BUCKET_SECONDS)
+        timeout = settings.AI_BREAKER_WINDOW + BUCKET_SECONDS
+        latency_bucket = min(bisect.bisect_left(LATENCY_BOUNDS, latency), len(LATENCY_BOUNDS) - 1)
+        counters = ['calls', f'latency{latency_bucket}']
+        if failed:
+            counters.append('failures')
+        if slow:
+            counters.append('slow')
+        for counter in counters:
+            _incr(self._key(bucket, counter), timeout)
+
+        if failed or slow:
+            snapshot = self.snapshot(now)
+            unhealthy = snapshot['failures'] + snapshot['slow']
+            if (snapshot['open_until'] is None and snapshot['calls'] >= settings.AI_BREAKER_MIN_CALLS
+                    and unhealthy >= settings.AI_BREAKER_FAILURE_RATE * snapshot['calls']):
+                cache.set(OPEN_KEY, now + settings.AI_BREAKER_COOLDOWN, None)
+
+    def reset(self, now=None):
+        """Close the breaker and forget the window's counters."""
+        now = time.time() if now is None else now
+        cache.delete_many(
+            [self._key(bucket, counter) for bucket in self._buckets(now) for counter in COUNTERS]
+            + [OPEN_KEY, PROBE_KEY]
+        )
+
+    def status(self):
+        snapshot = self.snapshot()
+        calls = snapshot['calls']
+        open_until = snapshot['open_until']
+        return {
+            'state': self.state(snapshot),
+            'window_seconds': settings.AI_BREAKER_WINDOW,
+            'calls': calls,
+            'failure_rate': round(snapshot['failures'] / calls, 3) if calls else 0.0,
+            'slow_rate': round(snapshot['slow'] / calls, 3) if calls else 0.0,
+            'hedges': snapshot['hedges'],
+            'latency_p50': self.latency_percentile(snapshot, 50),
+            'latency_p95': self.latency_percentile(snapshot, 95),
+            'retry_after': max(0, math.ceil(open_until - snapshot['now'])) if open_until else None,
+        }
+
+
+breaker = CircuitBreaker()
+
+
+def response_cache_key(payload):
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'library:ai-response:{digest}'
+
+
+def _post(payload, timeout):
+    try:
+        response = requests.post(
+            f"{settings.OPENAI_API_BASE.rstrip('/')}/chat/completions",
+            headers={
+                'Authorization': f'Bearer {settings.OPENAI_API_KEY}',
+                'Content-Type': 'application/json'
+            },
+            json=payload,
+            timeout=timeout
+        )
+    except requests.exceptions.Timeout as e:
+        raise AIUnavailable('Request timeout. Please try again.') from e
+    except requests.exceptions.ConnectionError as e:
+        raise AIUnavailable('Could not reach the AI service. Please try again.') from e
+
+    if response.status_code == 429 or response.status_code >= 500:
+        raise AIUnavailable(f'The AI service is unavailable (HTTP {response.status_code}). Please try again.')
+    if response.status_code != 200:
+        try:
+            message = response.json().get('error', {}).get('message', 'Unknown error')
+        except ValueError:
+            message = 'Unknown error'
+        raise AIError(message)
+    try:
+        return response.json()['choices'][0]['message']['content'].strip()
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        # A 200 without a completion is the provider failing, not the request
+        raise AIUnavailable('The AI service sent an unreadable response. Please try again.') from e
+
+
+def _hedged_post(payload, timeout, delay):
+    first = _executor.submit(_post, payload, timeout)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    breaker.record_hedge()
+    pending = {first, _executor.submit(_post, payload, timeout)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except AIUnavailable as e:
+                error = e
+    raise error
+
+
+def chat(payload, timeout=None):
+    """
+    Content of the provider's first choice for ``payload``.
+
+    Successful answers are cached for ``AI_RESPONSE_CACHE_TIMEOUT`` seconds
+    and served again while the provider is unavailable. Raises AIUnavailable
+    when there is no such answer, and AIError when the provider rejects the
+    request.
+    """
+    timeout = timeout or settings.AI_TIMEOUT
+    cache_key = response_cache_key(payload)
+    try:
+        content = _call(payload, timeout)
+    except AIUnavailable:
+        content = cache.get(cache_key)
+        if content is None:
+            raise
+        return content
+    cache.set(cache_key, content, settings.AI_RESPONSE_CACHE_TIMEOUT)
+    return content
+
+
+def _call(payload, timeout):
+    snapshot = breaker.snapshot()
+    probe = breaker.acquire(snapshot, timeout)
+    delay = None if probe else breaker.hedge_delay(snapshot)
+
+    start = time.monotonic()
+    try:
+        if delay is None:
+            content = _post(payload, timeout)
+        else:
+            content = _hedged_post(payload, timeout, delay)
+    except AIUnavailable:
+        breaker.record(time.monotonic() - start, failed=True, probe=probe)
+        raise
+    except AIError:
+        breaker.record(time.monotonic() - start, failed=False, probe=probe)
+        raise
+    breaker.record(time.monotonic() - start, failed=False, probe=probe)
+    return content
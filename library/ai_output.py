@@ -0,0 +1,358 @@
+"""
+Parsing of structured model output for the AI tools.
+
+The prompts ask for JSON, but models still wrap it in prose or code fences,
+cut it off at ``max_tokens``, or answer with a numbered list instead.
+``ItemParser`` handles all of these in a single pass over the text and can be
+fed streamed chunks, returning each item as soon as it is complete.
+"""
+import json
+import re
+
+_TOKEN = re.compile(r'''
+    [ \t\r\n]*
+    (?:
+        "(?P<string>(?:[^"\\]|\\.)*)"
+      | (?P<punct>[{}\[\]:,])
+      | (?P<scalar>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)(?=[\s,}\]])
+      | (?P<bare>[A-Za-z_]\w*)(?=[ \t]*:)
+    )''', re.VERBOSE | re.DOTALL)
+# What a token cut off at the end of a chunk can look like
+_PARTIAL_TOKEN = re.compile(r'[ \t\r\n]*(?:"|[-\w.+]*$)')
+# An object without nested containers, handed to the C JSON decoder whole
+_FLAT_OBJECT = re.compile(r'[ \t\r\n]*(\{(?:[^{}\[\]"]|"(?:[^"\\]|\\.)*")*\})', re.DOTALL)
+_STRUCTURAL = re.compile(r'["{}\[\]:,]')
+_DECODER = json.JSONDecoder(strict=False)
+# A JSON escape, or (group 1) the character after any other backslash
+_ESCAPE = re.compile(r'\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})|\\(.)', re.DOTALL)
+# Where JSON starts in a line: an object, or an array of objects (opening
+# at the end of the line, or only as far as a chunk has got)
+_JSON_START = re.compile(r'\{|\[\s*(?:\{|$)')
+_JSON_PARTIAL_START = re.compile(r'\{|\[\s*\{')
+
+_LIST_MARKER = re.compile(r'^(?:\d+\s*[.)]|[-*•]|#+)\s+(?P<text>.+)$')
+_TITLE_BY = re.compile(
+    r'^(?:\*\*(?P<bold>.+?)\*\*|["“](?P<quoted>.+?)["”]|(?P<plain>.+?))\s+by\s+(?P<rest>.+)$',
+    re.IGNORECASE,
+)
+_AUTHOR_END = re.compile(r'\s+[-–—]\s+|:\s+')
+_LABEL = re.compile(r'^(?:\*\*)?(?:description|summary|why)(?:\*\*)?\s*:\s*(?:\*\*)?\s*', re.IGNORECASE)
+_QUESTION = re.compile(r'^(?:\*\*)?(?:(?:Q(?:uestion)?\s*)?\d+|Q(?:uestion)?)\s*[.):-]\s*(?:\*\*)?\s*(?P<text>.+)$')
+_ANSWER = re.compile(r'^(?:\*\*)?(?:A\s*\d*\s*:|Answer\s*\d*\s*[.:-])\s*(?:\*\*)?\s*(?P<text>.*)$', re.IGNORECASE)
+
+
+def _unescape(string):
+    """The value of a JSON string body; escapes JSON doesn't allow, like ``\\'``, lose the backslash."""
+    try:
+        return _DECODER.decode(f'"{string}"')
+    except ValueError:
+        return _ESCAPE.sub(lambda m: m.group(1) if m.group(1) is not None else _DECODER.decode(f'"{m.group()}"'),
+                           string)
+
+
+def _clean(text):
+    return text.strip().strip('*_"“”[]').strip()
+
+
+class Schema:
+    """
+    The shape of one kind of item: its fields, the JSON keys accepted for
+    each, defaults, and how to read it from a plain-text list.
+    """
+    # (field, accepted JSON keys, default); the first field is required
+    fields = ()
+    # Appended to the system prompt
+    prompt = ''
+
+    def __init__(self):
+        self._keys = {key: name for name, keys, _ in self.fields for key in keys}
+
+    def from_mapping(self, values):
+        item = {}
+        for key, value in values.items():
+            name = self._keys.get(key.lower())
+            if name is not None and name not in item and value is not None and not isinstance(value, (dict, list)):
+                text = value if isinstance(value, str) else json.dumps(value)
+                item[name] = text.strip()
+        return self.finish(item)
+
+    def finish(self, item):
+        """``item`` with defaults filled in, or None if it lacks the required field."""
+        if not item or not item.get(self.fields[0][0]):
+            return None
+        return {name: item.get(name) or default for name, _, default in self.fields}
+
+    def start_item(self, line):
+        """A new item if ``line`` begins one, else None."""
+        raise NotImplementedError
+
+    def extend_item(self, item, line):
+        """Add a continuation ``line`` to the current item."""
+        raise NotImplementedError
+
+
+class RecommendationSchema(Schema):
+    fields = (
+        ('title', ('title', 'name', 'book'), ''),
+        ('author', ('author', 'authors', 'writer'), 'Various Authors'),
+        ('description', ('description', 'summary', 'why', 'reason'), 'A highly recommended book in this genre.'),
+    )
+    prompt = (
+        'Respond with JSON only, as an object of the form '
+        '{"books": [{"title": "...", "author": "...", "description": "..."}]}.'
+    )
+
+    def start_item(self, line):
+        match = _LIST_MARKER.match(line)
+        if match is None:
+            return None
+        text = match.group('text')
+        match = _TITLE_BY.match(text)
+        if match is None:
+            return {'title': _clean(text)}
+        title = match.group('bold') or match.group('quoted') or match.group('plain')
+        author, *description = _AUTHOR_END.split(match.group('rest'), 1)
+        item = {'title': _clean(title), 'author': _clean(author)}
+        if description:
+            item['description'] = description[0].strip()
+        return item
+
+    def extend_item(self, item, line):
+        if line[:3].lower() == 'by ' and not item.get('author'):
+            item['author'] = _clean(line[3:])
+            return
+        line = _LABEL.sub('', line)
+        item['description'] = f"{item['description']} {line}" if item.get('description') else line
+
+
+class QuizSchema(Schema):
+    fields = (
+        ('question', ('question', 'q', 'prompt'), ''),
+        ('answer', ('answer', 'a', 'solution'), 'Answer not provided.'),
+    )
+    prompt = (
+        'Respond with JSON only, as an object of the form '
+        '{"questions": [{"question": "...", "answer": "..."}]}.'
+    )
+
+    def start_item(self, line):
+        match = _QUESTION.match(line)
+        return {'question': _clean(match.group('text'))} if match else None
+
+    def extend_item(self, item, line):
+        match = _ANSWER.match(line)
+        if match is not None:
+            item['answer'] = _clean(match.group('text'))
+        elif 'answer' in item:
+            item['answer'] = f"{item['answer']} {line}".strip()
+        else:
+            item['question'] = f"{item['question']} {line}"
+
+
+class ShelfQuizSchema(QuizSchema):
+    """Quiz questions for several numbered books at once, tagged with their book's number."""
+    fields = QuizSchema.fields + (
+        ('book', ('book', 'book_id', 'id'), ''),
+    )
+    prompt = (
+        'Respond with JSON only, as an object of the form '
+        '{"questions": [{"book": 1, "question": "...", "answer": "..."}]}, '
+        'where "book" is the number of the book the question is about.'
+    )
+
+    def finish(self, item):
+        item = super().finish(item)
+        return item if item is not None and item['book'] else None
+
+
+RECOMMENDATIONS = RecommendationSchema()
+QUIZ = QuizSchema()
+SHELF_QUIZ = ShelfQuizSchema()
+
+
+class _Frame:
+    __slots__ = ('is_object', 'values', 'key')
+
+    def __init__(self, is_object):
+        self.is_object = is_object
+        self.values = {}
+        self.key = None
+
+
+class ItemParser:
+    """
+    Incremental parser for a list of ``schema`` items.
+
+    From the first line with JSON in it (at its start, or after prose or a
+    code fence on the same line) the output is scanned token by token, handing well-formed spans to the C decoder, and
+    every object carrying the schema's required field becomes an item,
+    whatever wraps it. Anything else is read line by line as a numbered
+    list. Malformed or truncated parts are skipped.
+    """
+
+    def __init__(self, schema, limit=None):
+        self.schema = schema
+        self.limit = limit
+        self.count = 0
+        self._buffer = ''
+        self._json = False
+        self._stack = []
+        self._item = None
+        self._out = []
+
+    @property
+    def done(self):
+        return self.limit is not None and self.count >= self.limit
+
+    def feed(self, chunk):
+        """Consume ``chunk`` and return the items completed by it."""
+        if not self.done:
+            self._buffer += chunk
+            self._parse(final=False)
+        return self._take()
+
+    def close(self, chunk=''):
+        """Consume a last ``chunk``, finish parsing and return the remaining items."""
+        if not self.done:
+            self._buffer += chunk
+            self._parse(final=True)
+            self._flush_text_item()
+        return self._take()
+
+    def _take(self):
+        items, self._out = self._out, []
+        return items
+
+    def _emit(self, item):
+        if item is not None and not self.done:
+            self._out.append(item)
+            self.count += 1
+
+    def _emit_values(self, value):
+        """Emit the items in an already decoded JSON value, innermost first."""
+        if isinstance(value, list):
+            for child in value:
+                self._emit_values(child)
+        elif isinstance(value, dict):
+            for child in value.values():
+                if isinstance(child, (dict, list)):
+                    self._emit_values(child)
+            self._emit(self.schema.from_mapping(value))
+
+    def _parse(self, final):
+        if self._json:
+            self._parse_json(final)
+        else:
+            self._parse_text(final)
+
+    def _flush_text_item(self):
+        if self._item is not None:
+            self._emit(self.schema.finish(self._item))
+            self._item = None
+
+    def _parse_text(self, final):
+        buf = self._buffer
+        start = 0
+        while True:
+            end = buf.find('\n', start)
+            if end < 0:
+                # Switch to JSON without waiting for the end of a one-line answer
+                json_start = _JSON_PARTIAL_START.search(buf, start) or (final and _JSON_START.search(buf, start))
+                if json_start:
+                    start = json_start.start()
+                    break
+                if not final or start >= len(buf):
+                    self._buffer = buf[start:]
+                    return
+                end = len(buf)
+            json_start = _JSON_START.search(buf, start, end)
+            if json_start:
+                start = json_start.start()
+                break
+            line = buf[start:end].strip()
+            if line and not line.startswith('```'):
+                item = self.schema.start_item(line)
+                if item is not None:
+                    self._flush_text_item()
+                    self._item = item
+                elif self._item is not None:
+                    self.schema.extend_item(self._item, line)
+            start = end + 1
+
+        self._flush_text_item()
+        self._json = True
+        self._buffer = buf[start:]
+        self._parse_json(final)
+
+    def _parse_json(self, final):
+        buf, pos, stack = self._buffer, 0, self._stack
+        while pos < len(buf) and not self.done:
+            match = _TOKEN.match(buf, pos)
+            if match is None:
+                if not final and _PARTIAL_TOKEN.match(buf, pos):
+                    break
+                # Skip prose, unquoted values and the like
+                skip = _STRUCTURAL.search(buf, pos + 1)
+                pos = skip.start() if skip else len(buf)
+                continue
+            punct = match.group('punct')
+            # Valid JSON goes through the C decoder: a whole document once the
+            # output is complete, otherwise each flat object as it arrives
+            if final and not stack and (punct == '{' or punct == '['):
+                try:
+                    value, pos = _DECODER.raw_decode(buf, match.end() - 1)
+                except ValueError:
+                    pass
+                else:
+                    self._emit_values(value)
+                    continue
+            if punct == '{':
+                flat = _FLAT_OBJECT.match(buf, pos)
+                if flat is not None:
+                    try:
+                        values = _DECODER.decode(flat.group(1))
+                    except ValueError:
+                        pass
+                    else:
+                        self._emit(self.schema.from_mapping(values))
+                        if stack:
+                            stack[-1].key = None
+                        pos = flat.end()
+                        continue
+            pos = match.end()
+
+            if punct is not None:
+                if punct == '{' or punct == '[':
+                    stack.append(_Frame(punct == '{'))
+                elif punct == '}' or punct == ']':
+                    if stack:
+                        frame = stack.pop()
+                        if frame.is_object:
+                            self._emit(self.schema.from_mapping(frame.values))
+                        if stack:
+                            stack[-1].key = None
+                elif punct == ',' and stack:
+                    stack[-1].key = None
+                continue
+
+            if not stack or not stack[-1].is_object:
+                continue
+            frame = stack[-1]
+            string = match.group('string')
+            if string is not None:
+                value = _unescape(string) if '\\' in string else string
+            elif match.group('bare') is not None:
+                value = match.group('bare')
+            else:
+                value = _DECODER.decode(match.group('scalar'))
+            if frame.key is None:
+                frame.key = value if isinstance(value, str) else None
+            else:
+                frame.values[frame.key] = value
+                frame.key = None
+        self._buffer = buf[pos:]
+
+
+def parse_items(text, schema, limit=None):
+    """All ``schema`` items in ``text`` (up to ``limit``)."""
+    return ItemParser(schema, limit).close(text)
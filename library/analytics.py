@@ -0,0 +1,249 @@
+"""
+Site-wide shelf statistics for capacity planning.
+
+Books are streamed from every shard with ``values_list().iterator()`` in
+fixed-size chunks and folded into a ``ShelfStats``: NumPy arrays for the
+per-user and per-day counts, ``Counter``s for statuses and for the most
+shelved works and authors. Work is split into user-id ranges of at most
+``users_per_task`` ids, so per-user counts never need more than one small
+array, and the ranges can be spread over a process pool. Books never go
+through ORM aggregates, and the default shard is read from a replica when
+one is configured.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Count, Max, Min, Value
+
+from .models import ArchivedBook, Book
+from .routers import active_replicas
+from .text import normalize_text
+
+SECONDS_PER_DAY = 86400
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 3
+
+# Popular titles and authors repeat a lot across shelves
+_normalize = lru_cache(maxsize=1 << 16)(normalize_text)
+
+
+class TopCounter:
+    """
+    A ``Counter`` that keeps at most ``capacity`` keys. When it grows past
+    that, the least common keys are dropped; ``error`` bounds how much any
+    reported count can be too low.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.error = 0
+
+    def update(self, keys):
+        self.counts.update(keys)
+        if len(self.counts) > self.capacity:
+            self._prune()
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.error += other.error
+        if len(self.counts) > self.capacity:
+            self._prune()
+
+    def _prune(self):
+        # Keep half the capacity so pruning stays rare. A dropped key may come
+        # back and be dropped again, so the error bound adds up.
+        ordered = self.counts.most_common()
+        keep = self.capacity // 2
+        self.error += ordered[keep][1]
+        self.counts = Counter(dict(ordered[:keep]))
+
+    def most_common(self, n):
+        return self.counts.most_common(n)
+
+
+class ShelfStats:
+    """Running totals over a stream of ``(user_id, status, date_added, title, author)`` rows."""
+
+    def __init__(self, capacity):
+        self.books = 0
+        # books_per_user[n] is the number of users with exactly n books
+        self.books_per_user = np.zeros(1, dtype=np.int64)
+        self.statuses = Counter()
+        self.days = Counter()
+        self.works = TopCounter(capacity)
+        self.authors = TopCounter(capacity)
+
+    def add_range(self, chunks, lo, hi):
+        """Fold in chunks of rows whose user ids all lie in ``[lo, hi)``."""
+        per_user = np.zeros(hi - lo, dtype=np.int64)
+        for chunk in chunks:
+            user_ids, statuses, dates, titles, authors = zip(*chunk)
+            self.books += len(chunk)
+            per_user += np.bincount(np.asarray(user_ids, dtype=np.int64) - lo, minlength=hi - lo)
+            self.statuses.update(statuses)
+
+            stamps = np.fromiter((d.timestamp() for d in dates), dtype=np.float64, count=len(dates))
+            days, counts = np.unique(np.floor_divide(stamps, SECONDS_PER_DAY).astype(np.int64),
+                                     return_counts=True)
+            self.days.update(dict(zip(days.tolist(), counts.tolist())))
+
+            normalized_authors = [_normalize(author) for author in authors]
+            self.works.update(f'{_normalize(title)}|{author}'
+                              for title, author in zip(titles, normalized_authors))
+            self.authors.update(normalized_authors)
+        self._add_histogram(np.bincount(per_user[per_user > 0]))
+
+    def _add_histogram(self, histogram):
+        if len(histogram) > len(self.books_per_user):
+            histogram, self.books_per_user = self.books_per_user, histogram.copy()
+        self.books_per_user[:len(histogram)] += histogram
+
+    def merge(self, other):
+        self.books += other.books
+        self._add_histogram(other.books_per_user)
+        self.statuses.update(other.statuses)
+        self.days.update(other.days)
+        self.works.merge(other.works)
+        self.authors.merge(other.authors)
+
+    def report(self, top=50, period='month', total_users=None):
+        histogram = self.books_per_user
+        users = int(histogram[1:].sum())
+        sizes = np.arange(len(histogram))
+        cumulative = np.cumsum(histogram[1:])
+
+        def percentile(pct):
+            if not users:
+                return 0
+            return int(np.searchsorted(cumulative, pct / 100 * users) + 1)
+
+        buckets = []
+        low = 1
+        while low < len(histogram):
+            high = low * 2 - 1
+            buckets.append({'books': f'{low}' if low == high else f'{low}-{high}',
+                            'users': int(histogram[low:high + 1].sum())})
+            low *= 2
+
+        return {
+            'books': self.books,
+            'books_per_user': {
+                'users': total_users if total_users is not None else users,
+                'users_with_books': users,
+                'mean': round(float((sizes * histogram).sum()) / users, 2) if users else 0,
+                'p50': percentile(50),
+                'p90': percentile(90),
+                'p99': percentile(99),
+                'max': len(histogram) - 1 if users else 0,
+                'histogram': buckets,
+            },
+            'statuses': dict(self.statuses.most_common()),
+            'added': added_per_period(self.days, period),
+            'top_works': [{'work': key, 'books': n} for key, n in self.works.most_common(top)],
+            'top_authors': [{'author': key, 'books': n} for key, n in self.authors.most_common(top)],
+            # Upper bound on how far the top counts may be undercounted
+            'top_error': max(self.works.error, self.authors.error),
+        }
+
+
+def added_per_period(days, period):
+    """``{days since epoch: count}`` summed per UTC day, week (from Monday) or month."""
+    if not days:
+        return []
+    numbers = np.fromiter(days.keys(), dtype=np.int64, count=len(days))
+    counts = np.fromiter(days.values(), dtype=np.int64, count=len(days))
+    if period == 'week':
+        numbers -= (numbers + EPOCH_WEEKDAY) % 7
+    starts = numbers.astype('datetime64[D]')
+    if period == 'month':
+        starts = starts.astype('datetime64[M]').astype('datetime64[D]')
+    periods, inverse = np.unique(starts, return_inverse=True)
+    totals = np.bincount(inverse, weights=counts).astype(np.int64)
+    return [{'period': str(start), 'books': int(n)} for start, n in zip(periods, totals)]
+
+
+def _chunked(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_alias(shard):
+    """Where to read ``shard`` from: a replica of the default shard if there is one."""
+    if shard == 'default':
+        replicas = active_replicas()
+        if replicas:
+            return replicas[0]
+    return shard
+
+
+def user_ranges(min_id, max_id, users_per_task):
+    """Split ``[min_id, max_id]`` into ``[lo, hi)`` ranges of at most ``users_per_task`` ids."""
+    return [(lo, min(lo + users_per_task, max_id + 1)) for lo in range(min_id, max_id + 1, users_per_task)]
+
+
+def collect_range(alias, lo, hi, chunk_size=10000, capacity=100000):
+    """``ShelfStats`` for the books of users ``lo <= id < hi`` on database ``alias``."""
+    def chunks():
+        books = Book.objects.using(alias).filter(user_id__gte=lo, user_id__lt=hi).order_by()
+        yield from _chunked(books.values_list('user_id', 'status', 'date_added', 'title', 'author')
+                            .iterator(chunk_size=chunk_size), chunk_size)
+        # Archived books are all Completed
+        archived = ArchivedBook.objects.using(alias).filter(user_id__gte=lo, user_id__lt=hi).order_by()
+        yield from _chunked(archived.annotate(archived_status=Value('Completed'))
+                            .values_list('user_id', 'archived_status', 'date_added', 'title', 'author')
+                            .iterator(chunk_size=chunk_size), chunk_size)
+
+    stats = ShelfStats(capacity)
+    stats.add_range(chunks(), lo, hi)
+    return stats
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones already have it
+    django.setup()
+
+
+def _collect_task(task):
+    try:
+        return collect_range(*task)
+    finally:
+        connections.close_all()
+
+
+def collect(users_per_task=100000, chunk_size=10000, capacity=100000, workers=1):
+    """
+    Site-wide ``ShelfStats`` and the total number of users, with the work
+    split per shard and user-id range over ``workers`` processes.
+    """
+    bounds = User.objects.using(read_alias('default')).aggregate(low=Min('id'), high=Max('id'), users=Count('id'))
+    stats = ShelfStats(capacity)
+    if not bounds['users']:
+        return stats, 0
+
+    tasks = [
+        (read_alias(shard), lo, hi, chunk_size, capacity)
+        for shard in settings.BOOK_SHARDS
+        for lo, hi in user_ranges(bounds['low'], bounds['high'], users_per_task)
+    ]
+    if workers <= 1:
+        for task in tasks:
+            stats.merge(collect_range(*task))
+        return stats, bounds['users']
+
+    # Forked workers must not share the parent's open connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for partial in pool.map(_collect_task, tasks):
+            stats.merge(partial)
+    return stats, bounds['users']
@@ -1,7 +1,22 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
 
+    def ready(self):
+        from django.core.cache import caches
+        from django.core.cache.backends.locmem import LocMemCache
+
+        # The AI circuit breaker (ai_client.py) only sees every worker's calls in a shared cache
+        if not settings.DEBUG and settings.OPENAI_API_KEY and isinstance(caches['default'], LocMemCache):
+            logger.warning(
+                'The AI circuit breaker is kept in a per-process cache, so each worker trips and probes '
+                'on its own. Set REDIS_URL to share it.'
+            )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def user_cache_key(user_id):
+    return f'library:auth-user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    """Drop the cached row for ``user_id`` so the next request reloads it."""
+    cache.delete(user_cache_key(user_id))
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's profile in the same query as the user,
+    so views reading ``request.user.profile`` don't pay a second round trip.
+
+    With ``AUTH_CACHE_ENABLED`` the loaded user is also kept in the cache for
+    ``AUTH_USER_CACHE_TIMEOUT`` seconds. The signal receivers in models.py
+    invalidate it on every save (password change, admin edit, last_login),
+    on profile edits and on logout.
+    """
+
+    def get_user(self, user_id):
+        use_cache = settings.AUTH_CACHE_ENABLED
+        if use_cache:
+            user = cache.get(user_cache_key(user_id))
+            if user is not None:
+                return user if self.user_can_authenticate(user) else None
+
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+
+        if use_cache:
+            cache.set(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
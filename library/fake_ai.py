@@ -0,0 +1,99 @@
+"""
+A local stand-in for the AI provider's chat completions API, for tests and
+load tests. Point ``OPENAI_API_BASE`` at ``FakeAIServer.url``, or run it on
+its own with ``manage.py fake_ai``.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeAIServer:
+    """
+    Answers every chat completion with ``content`` after ``delay`` seconds,
+    or with an error when ``status`` isn't 200. ``content`` may also be a
+    function of the request payload. ``delays`` holds per-request delays
+    that are used up, in order, before ``delay``. All of these can be
+    changed while the server runs; ``payloads`` records every request.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, status=200, content='Fake response.'):
+        self.delay = delay
+        self.delays = []
+        self.status = status
+        self.content = content
+        self.requests = 0
+        self.payloads = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def reset(self, delay=0.0, status=200, content='Fake response.'):
+        with self._lock:
+            self.delay = delay
+            self.delays = []
+            self.status = status
+            self.content = content
+            self.requests = 0
+            self.payloads = []
+
+    def _next_response(self, payload):
+        with self._lock:
+            self.requests += 1
+            self.payloads.append(payload)
+            delay = self.delays.pop(0) if self.delays else self.delay
+            content = self.content(payload) if callable(self.content) else self.content
+            return delay, self.status, content
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self.path.endswith('/chat/completions'):
+                    self._send(404, {'error': {'message': 'Not found'}})
+                    return
+                delay, status, content = server._next_response(json.loads(body or b'{}'))
+                if delay:
+                    time.sleep(delay)
+                if status == 200:
+                    self._send(200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+                else:
+                    self._send(status, {'error': {'message': f'Fake upstream error {status}'}})
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout or a hedge won)
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
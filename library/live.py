@@ -0,0 +1,360 @@
+"""
+Live shelf updates for open dashboards.
+
+Write paths call ``publish`` and the event goes out once their transaction
+commits; the ``/events/`` view relays a user's events to the browser as
+server-sent events. Where events travel between the two is up to the
+broker named by ``LIVE_UPDATES_BROKER``:
+
+- ``InProcessBroker`` hands them to the streams of the same process, which
+  is all a single ASGI worker needs.
+- ``DatabaseBroker`` appends them to ``LiveEvent``. One poller per process
+  reads new rows every ``LIVE_UPDATES_POLL_SECONDS`` and hands them to its
+  streams, so a change made on one worker reaches dashboards on all of them.
+
+Every event has an id. A reconnecting ``EventSource`` sends the last one
+back and gets what it missed; when that can't be worked out (the process
+restarted, the events were pruned, too many piled up) it gets a ``resync``
+event and reloads the dashboard instead.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# How long the browser waits before reconnecting a closed stream
+RETRY_MILLISECONDS = 2000
+
+RESYNC = {'type': 'resync'}
+
+
+def book_payload(book):
+    return {
+        'id': book.pk,
+        'title': book.title,
+        'author': book.author,
+        'status': book.status,
+        'date_added': book.date_added.isoformat(),
+    }
+
+
+class Subscription:
+    """The queue of events waiting to go down one open stream."""
+
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, item):
+        """Queue ``(seq, event)``; safe to call from any thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._put(item)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            # The stream's event loop is gone
+            pass
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # A stream this far behind reloads rather than catching up
+            self.overflowed = True
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    """
+    Hands published events to the subscriptions of this process. Subclasses
+    decide how events get from ``publish`` to ``_fan_out`` and number them:
+    ``seq`` is an increasing integer, ``format_id``/``parse_id`` turn it into
+    the id the browser sees and back.
+    """
+    # Events a subscription holds before it overflows; also the most a
+    # reconnecting stream replays
+    queue_size = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def publish(self, user_id, event):
+        raise NotImplementedError
+
+    async def replay(self, user_id, after):
+        """The user's ``(seq, event)`` pairs after ``after``, or None if some may be lost."""
+        raise NotImplementedError
+
+    @property
+    def cursor(self):
+        """The seq of the last event handed out, or None before the first."""
+        raise NotImplementedError
+
+    def format_id(self, seq):
+        return str(seq)
+
+    def parse_id(self, value):
+        return int(value) if value.isdigit() else None
+
+    async def _subscribed(self, subscription):
+        """Called once a subscription is registered."""
+
+    def _fan_out(self, user_id, item):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(item)
+
+    def _has_subscriptions(self):
+        with self._lock:
+            return bool(self._subscriptions)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        try:
+            await self._subscribed(subscription)
+            yield subscription
+        finally:
+            with self._lock:
+                subscriptions = self._subscriptions.get(user_id, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(user_id, None)
+
+
+class InProcessBroker(Broker):
+    """Events go straight to this process's streams; the last ``history`` are kept for replay."""
+    history = 1000
+
+    def __init__(self):
+        super().__init__()
+        # Numbering restarts with the process, so ids carry a token for it
+        self._token = uuid.uuid4().hex[:8]
+        self._seqs = itertools.count(1)
+        self._last_seq = None
+        self._recent = deque(maxlen=self.history)
+
+    @property
+    def cursor(self):
+        return self._last_seq
+
+    def format_id(self, seq):
+        return f'{self._token}-{seq}'
+
+    def parse_id(self, value):
+        token, _, seq = value.partition('-')
+        return int(seq) if token == self._token and seq.isdigit() else None
+
+    def publish(self, user_id, event):
+        with self._lock:
+            seq = self._last_seq = next(self._seqs)
+            self._recent.append((seq, user_id, event))
+        self._fan_out(user_id, (seq, event))
+
+    async def replay(self, user_id, after):
+        with self._lock:
+            recent = list(self._recent)
+        if recent and recent[0][0] > after + 1:
+            return None
+        missed = [(seq, event) for seq, event_user_id, event in recent if event_user_id == user_id and seq > after]
+        return missed if len(missed) <= self.queue_size else None
+
+
+class DatabaseBroker(Broker):
+    """
+    Events are rows of ``LiveEvent``, shared by every worker. Rows older than
+    ``LIVE_UPDATES_RETENTION`` seconds are pruned as new ones come in.
+    """
+    poll_batch = 500
+
+    def __init__(self):
+        super().__init__()
+        self._cursor = None
+        self._poller = None
+        self._pruned_at = time.monotonic()
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    def publish(self, user_id, event):
+        from .models import LiveEvent
+
+        LiveEvent.objects.create(user_id=user_id, payload=event)
+        retention = settings.LIVE_UPDATES_RETENTION
+        if time.monotonic() - self._pruned_at > retention / 2:
+            self._pruned_at = time.monotonic()
+            self._prune(retention)
+
+    def _prune(self, retention):
+        from .models import LiveEvent
+
+        # The newest row stays, so replay can always tell whether rows are missing
+        newest = LiveEvent.objects.order_by('-id').values_list('id', flat=True).first()
+        if newest is not None:
+            LiveEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=retention),
+                                     id__lt=newest).delete()
+
+    async def replay(self, user_id, after):
+        return await sync_to_async(self._replay)(user_id, after)
+
+    def _replay(self, user_id, after):
+        from .models import LiveEvent
+
+        oldest = LiveEvent.objects.order_by('id').values_list('id', flat=True).first()
+        if oldest is not None and oldest > after + 1:
+            return None
+        missed = list(
+            LiveEvent.objects.filter(user_id=user_id, id__gt=after).order_by('id')
+            .values_list('id', 'payload')[:self.queue_size + 1]
+        )
+        return missed if len(missed) <= self.queue_size else None
+
+    async def _subscribed(self, subscription):
+        # One poller per process, running on the loop of the streams; a
+        # fresh loop (a new test, a restarted server) gets a new one
+        poller = self._poller
+        if poller is None or poller.done() or poller.get_loop() is not subscription.loop:
+            if self._cursor is None:
+                self._cursor = await sync_to_async(self._newest)()
+            self._poller = asyncio.create_task(self._poll())
+
+    def _newest(self):
+        from .models import LiveEvent
+
+        return LiveEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def _fetch(self, after):
+        from .models import LiveEvent
+
+        return list(
+            LiveEvent.objects.filter(id__gt=after).order_by('id')
+            .values_list('id', 'user_id', 'payload')[:self.poll_batch]
+        )
+
+    async def _poll(self):
+        while self._has_subscriptions():
+            try:
+                rows = await sync_to_async(self._fetch)(self._cursor)
+            except Exception:
+                logger.exception('Polling live updates failed')
+                rows = []
+            for seq, user_id, payload in rows:
+                self._fan_out(user_id, (seq, payload))
+                self._cursor = seq
+            if len(rows) < self.poll_batch:
+                await asyncio.sleep(settings.LIVE_UPDATES_POLL_SECONDS)
+
+
+_brokers = {}
+
+
+def get_broker():
+    """The process's broker for ``LIVE_UPDATES_BROKER``."""
+    path = settings.LIVE_UPDATES_BROKER
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+def publish(user_id, event, using=None):
+    """Send ``event`` to the user's dashboards once the transaction on ``using`` commits."""
+    def send():
+        try:
+            get_broker().publish(user_id, event)
+        except Exception:
+            # A missed live update only leaves a dashboard stale until reload
+            logger.exception('Could not publish a live update for user %s', user_id)
+
+    transaction.on_commit(send, using=using)
+
+
+def publish_shelf_changed(user_ids, using=None):
+    """For bulk writes: the users' dashboards reload instead of applying each change."""
+    for user_id in set(user_ids):
+        publish(user_id, {'type': 'shelf.changed'}, using=using)
+
+
+def _message(event_id, event=None):
+    message = f'id: {event_id}\n'
+    if event is not None:
+        message += f'data: {json.dumps(event)}\n'
+    return message + '\n'
+
+
+def _resync(broker, delivered=0):
+    # Carries the current position, so the reloaded dashboard's stream
+    # starts from here rather than asking for the lost events again
+    return _message(broker.format_id(max(broker.cursor or 0, delivered)), RESYNC)
+
+
+async def stream(user_id, last_event_id=None):
+    """
+    The server-sent event stream of ``user_id``'s shelf changes, starting
+    after ``last_event_id``. It ends after ``LIVE_UPDATES_STREAM_SECONDS``
+    and the browser reconnects from where it was, so streams whose client
+    went away don't pile up.
+    """
+    broker = get_broker()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LIVE_UPDATES_STREAM_SECONDS
+    yield f'retry: {RETRY_MILLISECONDS}\n\n'
+
+    async with broker.subscribe(user_id) as subscription:
+        delivered = 0
+        if last_event_id:
+            after = broker.parse_id(last_event_id)
+            missed = None if after is None else await broker.replay(user_id, after)
+            if missed is None:
+                yield _resync(broker)
+                return
+            delivered = after
+            for seq, event in missed:
+                delivered = seq
+                yield _message(broker.format_id(seq), event)
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                seq, event = await subscription.get(min(settings.LIVE_UPDATES_HEARTBEAT, remaining))
+            except asyncio.TimeoutError:
+                if subscription.overflowed:
+                    yield _resync(broker, delivered)
+                    return
+                # Keeps proxies from closing an idle stream, and moves the
+                # browser's last id along so a reconnect replays little
+                cursor = broker.cursor
+                yield (_message(broker.format_id(max(cursor, delivered))) if cursor is not None else '') + ': ping\n\n'
+                continue
+            if subscription.overflowed:
+                yield _resync(broker, delivered)
+                return
+            # Replayed events can come round again through the queue
+            if seq > delivered:
+                delivered = seq
+                yield _message(broker.format_id(seq), event)
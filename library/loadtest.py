@@ -0,0 +1,306 @@
+"""
+Mixed-workload load generator behind ``manage.py loadtest``.
+
+Virtual users log in, browse the dashboard (with and without a status
+filter), add, update and delete books and call the AI tools. Each picks
+its next action by weight from the mix and pauses for an exponentially
+distributed think time in between, like a person clicking around.
+Requests go through the Django test client in this process, or over HTTP
+to a running server. Latencies and errors are recorded per endpoint and
+checked against the SLO thresholds in ``testdata/slos.json``.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.db import connections
+from django.test import Client
+
+from .ai_output import QUIZ, RECOMMENDATIONS
+
+SLO_FILE = Path(__file__).resolve().parent / 'testdata' / 'slos.json'
+AI_OUTPUT_CORPUS = Path(__file__).resolve().parent / 'testdata' / 'ai_outputs.json'
+
+DEFAULT_MIX = {
+    'login': 2,
+    'dashboard': 30,
+    'dashboard_filter': 20,
+    'add_book': 12,
+    'update_book': 20,
+    'delete_book': 6,
+    'ai_summarize': 3,
+    'ai_recommend': 4,
+    'ai_quiz': 3,
+}
+
+STATUSES = ('Reading', 'Completed', 'Planned')
+TOPICS = ('space opera', 'victorian novels', 'cozy mysteries', 'stoic philosophy', 'deep sea', 'chess')
+CLASSICS = (('Dune', 'Frank Herbert'), ('Emma', 'Jane Austen'), ('Beloved', 'Toni Morrison'),
+            ('Middlemarch', 'George Eliot'), ('The Hobbit', 'J.R.R. Tolkien'))
+
+# Each book card on the dashboard carries its id
+BOOK_CARD = re.compile(r'data-book-id="(\d+)" data-date-added')
+
+
+def parse_mix(value):
+    """``'dashboard=50,add_book=10'`` as ``{action: weight}``; unlisted actions don't run."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f'unknown action {name!r} (choose from {", ".join(DEFAULT_MIX)})')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f'weight of {name} must be a number') from None
+        if mix[name] < 0:
+            raise ValueError(f'weight of {name} must not be negative')
+    if not any(mix.values()):
+        raise ValueError('the mix needs at least one action with a positive weight')
+    return mix
+
+
+def fake_ai_content():
+    """Answers for ``FakeAIServer``: well-formed recommendations and quizzes, plain text otherwise."""
+    with open(AI_OUTPUT_CORPUS, encoding='utf-8') as f:
+        corpus = {case['name']: case['output'] for case in json.load(f)}
+    recommendations, quiz = corpus['json_object'], corpus['quiz_json_object']
+
+    def content(payload):
+        system = payload['messages'][0]['content']
+        if QUIZ.prompt in system:
+            return quiz
+        if RECOMMENDATIONS.prompt in system:
+            return recommendations
+        return 'A short summary of the passage.'
+
+    return content
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ClientTransport:
+    """Requests through the Django test client, in this process."""
+
+    def __init__(self):
+        # A view that raises counts as a 500, as it would behind a server
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, data=None, json_body=None):
+        if json_body is not None:
+            response = self.client.post(path, json.dumps(json_body), content_type='application/json')
+        elif method == 'POST':
+            response = self.client.post(path, data or {})
+        else:
+            response = self.client.get(path, data)
+        return response.status_code, response.content
+
+    def close(self):
+        # Each virtual user's thread has its own connections
+        connections.close_all()
+
+
+class HttpTransport:
+    """Requests over HTTP to the server at ``base_url``, with its CSRF cookie sent back."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {}
+        if method == 'POST':
+            headers['Referer'] = f'{self.base_url}/'
+            token = self.session.cookies.get('csrftoken')
+            if token:
+                headers['X-CSRFToken'] = token
+        response = self.session.request(
+            method, f'{self.base_url}{path}',
+            params=data if method == 'GET' else None,
+            data=data if method == 'POST' and json_body is None else None,
+            json=json_body, headers=headers, allow_redirects=False, timeout=self.timeout,
+        )
+        return response.status_code, response.content
+
+    def close(self):
+        self.session.close()
+
+
+class Recorder:
+    """Latencies and errors per endpoint, shared by every virtual user."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, endpoint, latency, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + (not ok)
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors[endpoint],
+                'error_rate': round(self.errors[endpoint] / len(latencies), 4),
+                'rps': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            }
+        total = sum(e['requests'] for e in endpoints.values())
+        errors = sum(e['errors'] for e in endpoints.values())
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        overall = {
+            'requests': total,
+            'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0,
+            'rps': round(total / elapsed, 2),
+        }
+        if everything:
+            overall.update({f'p{pct}_ms': round(percentile(everything, pct) * 1000, 1) for pct in (50, 95, 99)})
+        return {'elapsed': round(elapsed, 2), 'overall': overall, 'endpoints': endpoints}
+
+
+class VirtualUser:
+    """One simulated person; each public method is an action of the mix."""
+
+    def __init__(self, username, password, transport, recorder, rng):
+        self.username = username
+        self.password = password
+        self.transport = transport
+        self.recorder = recorder
+        self.rng = rng
+        # Book ids seen on the last dashboard page
+        self.books = []
+
+    def _call(self, endpoint, method, path, expected, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = self.transport.request(method, path, **kwargs)
+        except (requests.RequestException, OSError):
+            status, body = None, b''
+        self.recorder.add(endpoint, time.perf_counter() - start, status in expected)
+        return status, body
+
+    def login(self, first=False):
+        if not first:
+            self._call('GET /auth/logout/', 'GET', '/auth/logout/', {302})
+        self._call('GET /auth/login/', 'GET', '/auth/login/', {200})
+        self._call('POST /auth/login/', 'POST', '/auth/login/', {302},
+                   data={'username': self.username, 'password': self.password})
+
+    def _dashboard(self, endpoint, query):
+        status, body = self._call(endpoint, 'GET', '/dashboard/', {200}, data=query)
+        if status == 200:
+            self.books = BOOK_CARD.findall(body.decode('utf-8', 'replace'))
+
+    def dashboard(self):
+        self._dashboard('GET /dashboard/', {})
+
+    def dashboard_filter(self):
+        self._dashboard('GET /dashboard/?status', {'status': self.rng.choice(STATUSES)})
+
+    def add_book(self):
+        self._call('POST /add/', 'POST', '/add/', {302}, data={
+            'title': f'Load Test {uuid.uuid4().hex[:12]}',
+            'author': self.rng.choice(CLASSICS)[1],
+            'status': self.rng.choice(STATUSES),
+        })
+
+    def update_book(self):
+        if not self.books:
+            self.dashboard()
+            return
+        book_id = self.rng.choice(self.books)
+        self._call('POST /update/<id>/', 'POST', f'/update/{book_id}/', {200},
+                   data={'status': self.rng.choice(STATUSES)})
+
+    def delete_book(self):
+        if not self.books:
+            self.dashboard()
+            return
+        book_id = self.books.pop(self.rng.randrange(len(self.books)))
+        self._call('POST /delete/<id>/', 'POST', f'/delete/{book_id}/', {200})
+
+    def ai_summarize(self):
+        self._call('POST /ai/summarize/', 'POST', '/ai/summarize/', {200},
+                   json_body={'text': ' '.join(self.rng.choice(TOPICS) for _ in range(40))})
+
+    def ai_recommend(self):
+        self._call('POST /ai/recommend/', 'POST', '/ai/recommend/', {200},
+                   json_body={'topic': self.rng.choice(TOPICS)})
+
+    def ai_quiz(self):
+        title, author = self.rng.choice(CLASSICS)
+        self._call('POST /ai/quiz/', 'POST', '/ai/quiz/', {200},
+                   json_body={'title': title, 'author': author, 'difficulty': self.rng.choice(('Easy', 'Medium', 'Hard'))})
+
+
+def run(users, password, transport_factory, mix, duration, think=1.0, ramp_up=0.0, seed=0):
+    """
+    Run one virtual user per username for ``duration`` seconds, starting
+    them evenly over ``ramp_up`` seconds. ``think`` is the mean pause
+    between actions. Returns ``Recorder.report()``.
+    """
+    recorder = Recorder()
+    actions, weights = zip(*((name, weight) for name, weight in mix.items() if weight > 0))
+    start = time.monotonic()
+    deadline = start + duration
+
+    def worker(index, username):
+        rng = random.Random(seed * 1000003 + index)
+        transport = transport_factory()
+        user = VirtualUser(username, password, transport, recorder, rng)
+        try:
+            time.sleep(ramp_up * index / len(users))
+            user.login(first=True)
+            while time.monotonic() < deadline:
+                action = rng.choices(actions, weights)[0]
+                if action == 'login':
+                    user.login()
+                else:
+                    getattr(user, action)()
+                if think > 0:
+                    time.sleep(min(rng.expovariate(1 / think), max(0.0, deadline - time.monotonic())))
+        finally:
+            transport.close()
+
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        list(pool.map(worker, range(len(users)), users))
+    return recorder.report(time.monotonic() - start)
+
+
+def check_slos(report, slos):
+    """
+    Compare a report with SLO thresholds; returns ``(scope, metric, value,
+    limit, ok)`` for every threshold that had requests to judge.
+    ``min_rps`` is a floor; every other metric is a ceiling.
+    """
+    scopes = [('overall', report['overall'], slos.get('overall', {}))]
+    scopes += [(endpoint, report['endpoints'][endpoint], limits)
+               for endpoint, limits in slos.get('endpoints', {}).items() if endpoint in report['endpoints']]
+    results = []
+    for scope, measured, limits in scopes:
+        for metric, limit in limits.items():
+            value = measured['rps'] if metric == 'min_rps' else measured.get(metric)
+            if value is None:
+                continue
+            ok = value >= limit if metric == 'min_rps' else value <= limit
+            results.append((scope, metric, value, limit, ok))
+    return results
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from library.models import ArchivedBook, Book
+
+COPIED_FIELDS = ('title', 'author', 'status', 'date_added', 'user_id')
+
+
+class Command(BaseCommand):
+    help = 'Move Completed books older than a threshold from the hot table into ArchivedBook.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Archive Completed books added more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would move.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days must be non-negative and --batch-size positive.')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        total = 0
+        for alias in settings.BOOK_SHARDS:
+            candidates = Book.objects.using(alias).filter(status='Completed', date_added__lt=cutoff)
+            if options['dry_run']:
+                count = candidates.count()
+            else:
+                count = self._archive(alias, candidates, options['batch_size'])
+            total += count
+            self.stdout.write(f'{alias}: {count} books')
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} books older than {cutoff:%Y-%m-%d}.'))
+
+    def _archive(self, alias, candidates, batch_size):
+        archived = 0
+        while True:
+            # Short transactions so the hot table is never locked for long
+            with transaction.atomic(using=alias):
+                rows = list(
+                    candidates.select_for_update().order_by('pk').values('pk', *COPIED_FIELDS)[:batch_size]
+                )
+                if not rows:
+                    return archived
+                ArchivedBook.objects.using(alias).bulk_create(
+                    [ArchivedBook(**{name: row[name] for name in COPIED_FIELDS}) for row in rows]
+                )
+                Book.objects.using(alias).filter(pk__in=[row['pk'] for row in rows]).delete()
+            archived += len(rows)
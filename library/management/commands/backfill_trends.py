@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library.models import Book, BookStatusEvent
+from library.trends import record_status_changes
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed the status events and daily trend rollups from books shelved before shelf changes were '
+        'logged. Each book without an event counts as added, with its current status, on the day it '
+        'was added. Books that already have events are skipped, so the command can be run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the books that would be seeded.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        total = 0
+        for alias in settings.BOOK_SHARDS:
+            count = self._backfill(alias, options['batch_size'], options['dry_run'])
+            total += count
+            self.stdout.write(f'{alias}: {count} books')
+
+        verb = 'Would seed' if options['dry_run'] else 'Seeded'
+        self.stdout.write(self.style.SUCCESS(f'{verb} trends from {total} books.'))
+
+    def _backfill(self, alias, batch_size, dry_run):
+        seeded, last_pk = 0, 0
+        books = Book.objects.using(alias).order_by('pk').values_list('pk', 'user_id', 'status', 'date_added')
+        while True:
+            rows = list(books.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                return seeded
+            last_pk = rows[-1][0]
+            # Narrowed by user, which the events are indexed on
+            logged = set(
+                BookStatusEvent.objects.using(alias)
+                .filter(user_id__in={user_id for _, user_id, _, _ in rows}, book_id__in=[pk for pk, *_ in rows])
+                .values_list('book_id', flat=True)
+            )
+            changes = [
+                (user_id, pk, None, status, date_added)
+                for pk, user_id, status, date_added in rows if pk not in logged
+            ]
+            if changes and not dry_run:
+                # One bulk insert of events and one rollup update per batch
+                record_status_changes(changes, using=alias)
+            seeded += len(changes)
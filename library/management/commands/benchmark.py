@@ -0,0 +1,294 @@
+"""
+Micro-benchmarks for the hot request paths.
+
+Run against the configured database, e.g.:
+
+    python manage.py benchmark login --users 8 --iterations 50
+    python manage.py benchmark dashboard --auth-cache
+    python manage.py benchmark parse --iterations 200 --chunk-size 16
+    python manage.py benchmark admin --users 2 --iterations 10
+    python manage.py benchmark startup --iterations 10 --imports 20
+
+Seed a large table first (``manage.py seed_books``) for the admin scenario.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from library.ai_output import QUIZ, RECOMMENDATIONS, ItemParser
+from library.loadtest import percentile
+from library.models import Book
+
+BENCH_USER_PREFIX = 'bench-user-'
+BENCH_PASSWORD = 'bench-pass-123'
+
+# Cheap hasher so the numbers reflect database work rather than PBKDF2
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+AI_OUTPUT_CORPUS = Path(__file__).resolve().parents[2] / 'testdata' / 'ai_outputs.json'
+AI_OUTPUT_SCHEMAS = {'recommendations': RECOMMENDATIONS, 'quiz': QUIZ}
+
+# Run in a fresh interpreter per boot: load the WSGI application, then time
+# two requests for argv[1] through it
+BOOT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from BookShelf.wsgi import application
+booted = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+
+def get(path):
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return int(statuses[0].split()[0])
+
+status = get(sys.argv[1])
+first = time.perf_counter()
+get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({'status': status, 'boot': booted - start, 'first': first - booted, 'second': second - first}))
+'''
+
+# A line of ``python -X importtime`` output: self and cumulative microseconds, then the module
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Run micro-benchmarks against the hot request paths.'
+
+    scenarios = ('login', 'dashboard', 'parse', 'admin', 'startup')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--users', type=int, default=4,
+                            help='Number of concurrent virtual users.')
+        parser.add_argument('--iterations', type=int, default=25,
+                            help='Requests issued by each virtual user.')
+        parser.add_argument('--slow-hasher', action='store_true',
+                            help='Keep the configured password hasher instead of MD5.')
+        parser.add_argument('--auth-cache', action='store_true',
+                            help='Enable the cached session store and request.user cache.')
+        parser.add_argument('--chunk-size', type=int, default=0,
+                            help='parse: feed model output in chunks of this many characters (0 = whole).')
+        parser.add_argument('--path', default='/auth/login/',
+                            help='startup: page requested once the application has booted.')
+        parser.add_argument('--imports', type=int, default=15,
+                            help='startup: list the packages that take longest to import (0 = none).')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['iterations'] < 1:
+            raise CommandError('--users and --iterations must be positive.')
+        if options['scenario'] in ('parse', 'startup'):
+            getattr(self, f"bench_{options['scenario']}")(options)
+            return
+
+        overrides = {'ALLOWED_HOSTS': ['*']}
+        if not options['slow_hasher']:
+            overrides['PASSWORD_HASHERS'] = FAST_HASHERS
+        if options['auth_cache']:
+            overrides['AUTH_CACHE_ENABLED'] = True
+            overrides['SESSION_ENGINE'] = 'django.contrib.sessions.backends.cached_db'
+        with override_settings(**overrides):
+            users = self._create_users(options['users'])
+            try:
+                getattr(self, f"bench_{options['scenario']}")(users, options)
+            finally:
+                User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    def _create_users(self, count):
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        return [
+            User.objects.create_user(username=f'{BENCH_USER_PREFIX}{i}', password=BENCH_PASSWORD)
+            for i in range(count)
+        ]
+
+    def _run_concurrently(self, users, iterations, request, setup=None):
+        """
+        Call ``request(client, user)`` ``iterations`` times per user, one
+        thread per user, after an unmeasured ``setup(client, user)``.
+        Returns (latencies, queries per request, wall time).
+        """
+        latencies = []
+        query_counts = []
+        lock = threading.Lock()
+
+        def worker(user):
+            client = Client()
+            if setup is not None:
+                setup(client, user)
+            local_latencies = []
+            local_queries = []
+            try:
+                for _ in range(iterations):
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        request(client, user)
+                        local_latencies.append(time.perf_counter() - start)
+                    local_queries.append(len(ctx.captured_queries))
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                query_counts.extend(local_queries)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            list(pool.map(worker, users))
+        return latencies, query_counts, time.perf_counter() - start
+
+    def _report(self, name, latencies, query_counts, elapsed):
+        self.stdout.write(f'{name}: {len(latencies)} requests in {elapsed:.2f}s '
+                          f'({len(latencies) / elapsed:.1f} req/s)')
+        self.stdout.write(f'  latency mean={statistics.mean(latencies) * 1000:.2f}ms '
+                          f'p50={percentile(latencies, 50) * 1000:.2f}ms '
+                          f'p95={percentile(latencies, 95) * 1000:.2f}ms')
+        self.stdout.write(f'  queries/request mean={statistics.mean(query_counts):.2f} '
+                          f'max={max(query_counts)}')
+
+    def bench_login(self, users, options):
+        def login(client, user):
+            response = client.post('/auth/login/', {
+                'username': user.username,
+                'password': BENCH_PASSWORD,
+            })
+            if response.status_code != 302:
+                raise CommandError(f'Login failed for {user.username}: {response.status_code}')
+            client.cookies.clear()
+
+        self._report('login', *self._run_concurrently(users, options['iterations'], login))
+
+    def bench_dashboard(self, users, options):
+        def login(client, user):
+            client.login(username=user.username, password=BENCH_PASSWORD)
+
+        def dashboard(client, user):
+            response = client.get('/dashboard/')
+            if response.status_code != 200:
+                raise CommandError(f'Dashboard failed for {user.username}: {response.status_code}')
+
+        self._report('dashboard', *self._run_concurrently(
+            users, options['iterations'], dashboard, setup=login,
+        ))
+
+    def bench_admin(self, users, options):
+        """Book and Profile changelists: plain, searched and drilled down by date."""
+        User.objects.filter(pk__in=[u.pk for u in users]).update(is_staff=True, is_superuser=True)
+        latest = Book.objects.order_by('-date_added').values_list('date_added', flat=True).first()
+        if latest is None:
+            raise CommandError('No books to list; run seed_books first.')
+        pages = {
+            'book list': '/admin/library/book/',
+            'book page 100': '/admin/library/book/?p=100',
+            'book search': '/admin/library/book/?q=the+silent',
+            'book year': f'/admin/library/book/?date_added__year={latest.year}',
+            'book month': f'/admin/library/book/?date_added__year={latest.year}&date_added__month={latest.month}',
+            'profile search': f'/admin/library/profile/?q={BENCH_USER_PREFIX}',
+        }
+
+        def login(client, user):
+            client.login(username=user.username, password=BENCH_PASSWORD)
+
+        for name, url in pages.items():
+            def changelist(client, user):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} failed for {user.username}: {response.status_code}')
+
+            self._report(f'admin {name}', *self._run_concurrently(
+                users, options['iterations'], changelist, setup=login,
+            ))
+
+    def bench_parse(self, options):
+        """Throughput of the structured-output parser over the model output corpus."""
+        with open(AI_OUTPUT_CORPUS, encoding='utf-8') as f:
+            corpus = [(AI_OUTPUT_SCHEMAS[case['schema']], case['output']) for case in json.load(f)]
+        chunk_size = options['chunk_size']
+
+        latencies = []
+        items = 0
+        start = time.perf_counter()
+        for _ in range(options['iterations']):
+            for schema, output in corpus:
+                started = time.perf_counter()
+                parser = ItemParser(schema)
+                if chunk_size > 0:
+                    for i in range(0, len(output), chunk_size):
+                        items += len(parser.feed(output[i:i + chunk_size]))
+                    items += len(parser.close())
+                else:
+                    items += len(parser.close(output))
+                latencies.append(time.perf_counter() - started)
+        elapsed = time.perf_counter() - start
+
+        size = options['iterations'] * sum(len(output.encode('utf-8')) for _, output in corpus)
+        self.stdout.write(f'parse: {len(latencies)} outputs, {items} items in {elapsed:.2f}s '
+                          f'({len(latencies) / elapsed:.0f} outputs/s, {size / elapsed / 1e6:.1f} MB/s)')
+        self.stdout.write(f'  latency mean={statistics.mean(latencies) * 1e6:.1f}us '
+                          f'p50={percentile(latencies, 50) * 1e6:.1f}us '
+                          f'p95={percentile(latencies, 95) * 1e6:.1f}us')
+
+    def _boot(self, path, warmup, importtime=False):
+        """Boot the application in a new process; returns its timings and, with ``importtime``, stderr."""
+        env = {**os.environ, 'STARTUP_WARMUP': 'True' if warmup else 'False'}
+        command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', BOOT_SCRIPT, path]
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'Boot failed:\n{result.stderr}')
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        if timings['status'] != 200:
+            raise CommandError(f"{path} answered {timings['status']} after boot")
+        return timings, result.stderr
+
+    def bench_startup(self, options):
+        """Boot-to-first-response time of a fresh worker, without and with the warm-up."""
+        for warmup in (False, True):
+            boots = [self._boot(options['path'], warmup)[0] for _ in range(options['iterations'])]
+            name = 'warmed' if warmup else 'cold'
+            self.stdout.write(f'startup ({name}): {len(boots)} boots, then GET {options["path"]} twice')
+            for phase in ('boot', 'first', 'second'):
+                values = [timings[phase] for timings in boots]
+                label = {'boot': 'boot', 'first': 'first response', 'second': 'second response'}[phase]
+                self.stdout.write(f'  {label} mean={statistics.mean(values) * 1000:.1f}ms '
+                                  f'p50={percentile(values, 50) * 1000:.1f}ms '
+                                  f'p95={percentile(values, 95) * 1000:.1f}ms')
+            totals = [timings['boot'] + timings['first'] for timings in boots]
+            self.stdout.write(f'  boot to first response p50={percentile(totals, 50) * 1000:.1f}ms')
+
+        if options['imports'] > 0:
+            self._report_imports(self._boot(options['path'], False, importtime=True)[1], options['imports'])
+
+    def _report_imports(self, stderr, limit):
+        """Self import time per package (per module for this project's), from ``-X importtime``."""
+        packages = {}
+        for line in stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match is None:
+                continue
+            own, _, _, module = match.groups()
+            top = module.split('.')[0]
+            key = module if top in ('library', 'BookShelf') else top
+            total, count = packages.get(key, (0, 0))
+            packages[key] = (total + int(own), count + 1)
+
+        self.stdout.write(f'imports (cold boot): {sum(n for _, n in packages.values())} modules '
+                          f'in {sum(t for t, _ in packages.values()) / 1000:.1f}ms')
+        for key, (total, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:limit]:
+            self.stdout.write(f'  {key:<40} {total / 1000:8.1f}ms  ({count} modules)')
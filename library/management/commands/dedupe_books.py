@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from library.analytics import user_ranges
+from library.live import publish_shelf_changed
+from library.models import Book
+from library.trends import record_status_changes
+
+# A merged book keeps the furthest status of its copies
+STATUS_RANK = {'Planned': 0, 'Reading': 1, 'Completed': 2}
+
+
+class Command(BaseCommand):
+    help = ('Merge books a user shelved more than once (same title and author up to case, accents '
+            'and punctuation) into the earliest copy, working through users in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users-per-batch', type=int, default=1000,
+                            help='User ids handled per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be merged.')
+
+    def handle(self, *args, **options):
+        if options['users_per_batch'] < 1:
+            raise CommandError('--users-per-batch must be positive.')
+        bounds = User.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write(self.style.SUCCESS('No users.'))
+            return
+
+        total = 0
+        for alias in settings.BOOK_SHARDS:
+            removed = 0
+            for lo, hi in user_ranges(bounds['low'], bounds['high'], options['users_per_batch']):
+                # Answered from the (user, fingerprint) index
+                groups = list(
+                    Book.objects.using(alias).filter(user_id__gte=lo, user_id__lt=hi)
+                    .values('user_id', 'fingerprint').annotate(copies=Count('id')).filter(copies__gt=1)
+                    .order_by()
+                )
+                if not groups:
+                    continue
+                if options['dry_run']:
+                    removed += sum(group['copies'] - 1 for group in groups)
+                else:
+                    removed += self._merge(alias, groups)
+            total += removed
+            self.stdout.write(f'{alias}: {removed} duplicate books')
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} duplicate books.'))
+
+    def _merge(self, alias, groups):
+        """Fold each group's copies into its earliest book; returns the number of copies removed."""
+        keys = {(group['user_id'], group['fingerprint']) for group in groups}
+        with transaction.atomic(using=alias):
+            books = (
+                Book.objects.using(alias).select_for_update()
+                .filter(user_id__in={user_id for user_id, _ in keys},
+                        fingerprint__in={fingerprint for _, fingerprint in keys})
+                .order_by('date_added', 'pk')
+                .values_list('pk', 'user_id', 'fingerprint', 'status')
+            )
+            copies = {}
+            for pk, user_id, fingerprint, status in books:
+                if (user_id, fingerprint) in keys:
+                    copies.setdefault((user_id, fingerprint), []).append((pk, status))
+
+            promoted = {}
+            removed = []
+            changes = []
+            for (user_id, _), group in copies.items():
+                (keeper, status), *extra = group
+                best = max((status for _, status in group), key=lambda s: STATUS_RANK.get(s, -1))
+                if best != status:
+                    promoted.setdefault(best, []).append(keeper)
+                    changes.append((user_id, keeper, status, best, None))
+                for pk, extra_status in extra:
+                    removed.append(pk)
+                    changes.append((user_id, pk, extra_status, None, None))
+
+            for status, pks in promoted.items():
+                Book.objects.using(alias).filter(pk__in=pks).update(status=status)
+            Book.objects.using(alias).filter(pk__in=removed).delete()
+            record_status_changes(changes, using=alias)
+            publish_shelf_changed((user_id for user_id, *_ in changes), using=alias)
+        return len(removed)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from library.fake_ai import FakeAIServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a fake AI provider for local testing (set OPENAI_API_BASE to the printed URL).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help='Seconds to wait before each answer.')
+        parser.add_argument('--status', type=int, default=200,
+                            help='HTTP status to answer with.')
+        parser.add_argument('--content', default='Fake response.',
+                            help='Message content of each answer.')
+
+    def handle(self, *args, **options):
+        server = FakeAIServer(options['host'], options['port'], options['delay'],
+                              options['status'], options['content'])
+        self.stdout.write(f'Fake AI provider at {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
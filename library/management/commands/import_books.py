@@ -0,0 +1,119 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from library.live import publish_shelf_changed
+from library.models import Book
+from library.recommender import record_books
+from library.text import book_fingerprint
+from library.trends import record_status_changes
+
+STATUSES = {choice for choice, _ in Book.STATUS_CHOICES}
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV file with columns username,title,author[,status][,date_added].'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help="Leave out books already on the user's shelf instead of only warning.")
+
+    def handle(self, *args, **options):
+        try:
+            handle = open(options['path'], newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+
+        users = {}
+        batch = []
+        imported = skipped = 0
+        self.duplicates = 0
+        self.skip_duplicates = options['skip_duplicates']
+        with handle:
+            reader = csv.DictReader(handle)
+            missing = {'username', 'title', 'author'} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f'Missing columns: {", ".join(sorted(missing))}')
+
+            for line, row in enumerate(reader, start=2):
+                book, error = self._build_book(row, users)
+                if error:
+                    skipped += 1
+                    self.stderr.write(f'Line {line}: {error}')
+                    continue
+                batch.append((line, book))
+                if len(batch) >= options['batch_size']:
+                    imported += self._save(batch)
+                    batch = []
+        if batch:
+            imported += self._save(batch)
+
+        verb = 'skipped' if self.skip_duplicates else 'imported anyway'
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} books, skipped {skipped} rows; '
+            f'{self.duplicates} duplicates of shelved books {verb}.'
+        ))
+
+    def _duplicates(self, batch):
+        """Lines of ``batch`` whose book is already shelved, one indexed lookup per user."""
+        by_user = {}
+        for line, book in batch:
+            by_user.setdefault(book.user_id, []).append((line, book))
+        duplicates = set()
+        for user_id, rows in by_user.items():
+            shelved = set(Book.objects.for_user(user_id).filter(
+                fingerprint__in={book.fingerprint for _, book in rows},
+            ).values_list('fingerprint', flat=True))
+            for line, book in rows:
+                if book.fingerprint in shelved:
+                    duplicates.add(line)
+                # Repeats within the batch; earlier batches are already in the table
+                shelved.add(book.fingerprint)
+        return duplicates
+
+    def _save(self, batch):
+        duplicates = self._duplicates(batch)
+        for line, book in batch:
+            if line in duplicates:
+                self.stderr.write(f'Line {line}: "{book.title}" by {book.author} is already on the shelf')
+        self.duplicates += len(duplicates)
+        if self.skip_duplicates:
+            batch = [row for row in batch if row[0] not in duplicates]
+        batch = [book for _, book in batch]
+        Book.objects.bulk_create(batch)
+        record_status_changes([(book.user_id, book.pk, None, book.status, book.date_added) for book in batch])
+        record_books(batch)
+        publish_shelf_changed(book.user_id for book in batch)
+        return len(batch)
+
+    def _build_book(self, row, users):
+        username = (row.get('username') or '').strip()
+        if username not in users:
+            users[username] = User.objects.filter(username=username).values_list('id', flat=True).first()
+        if users[username] is None:
+            return None, f'unknown user {username!r}'
+
+        title = (row.get('title') or '').strip()
+        author = (row.get('author') or '').strip()
+        if not title or not author:
+            return None, 'title and author are required'
+
+        status = (row.get('status') or 'Planned').strip()
+        if status not in STATUSES:
+            return None, f'invalid status {status!r}'
+
+        book = Book(user_id=users[username], title=title[:200], author=author[:100], status=status)
+        book.fingerprint = book_fingerprint(book.title, book.author)
+        if row.get('date_added'):
+            date_added = parse_datetime(row['date_added'].strip())
+            if date_added is None:
+                return None, f'invalid date_added {row["date_added"]!r}'
+            if timezone.is_naive(date_added):
+                date_added = timezone.make_aware(date_added)
+            book.date_added = date_added
+        return book, None
@@ -0,0 +1,154 @@
+"""
+End-to-end load test with a mixed workload, e.g.:
+
+    python manage.py loadtest --users 20 --duration 60
+    python manage.py loadtest --mix dashboard=60,update_book=30,ai_recommend=10 --think 0.2
+    python manage.py loadtest --url http://127.0.0.1:8000 --fake-ai-port 8765
+
+Requests run in-process unless ``--url`` names a running server. That
+server must use the same database (the virtual users are created there)
+and have ``OPENAI_API_BASE`` pointing at the fake AI provider this starts.
+In-process runs log the books they add to a throwaway recommender index
+rather than the configured one. Fails when a threshold in the SLO file is missed.
+"""
+import json
+import random
+import tempfile
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from library.fake_ai import FakeAIServer
+from library.loadtest import (
+    CLASSICS, DEFAULT_MIX, SLO_FILE, STATUSES, ClientTransport, HttpTransport, check_slos,
+    fake_ai_content, parse_mix, run,
+)
+from library.models import Book
+
+LOADTEST_USER_PREFIX = 'loadtest-user-'
+LOADTEST_PASSWORD = 'loadtest-pass-123'
+
+# Cheap hasher so logins measure the app rather than PBKDF2 (in-process only)
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class Command(BaseCommand):
+    help = ('Simulate concurrent users with a mix of logins, dashboard views, book changes and AI '
+            'calls, and report throughput, errors and latency percentiles against the SLOs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for.')
+        parser.add_argument('--think', type=float, default=1.0,
+                            help='Mean pause between a user\'s actions in seconds (0 = none).')
+        parser.add_argument('--ramp-up', type=float, default=0,
+                            help='Seconds over which the users start.')
+        parser.add_argument('--mix', default='',
+                            help='Action weights, e.g. dashboard=50,add_book=10 '
+                                 f'(default: {",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items())}).')
+        parser.add_argument('--books', type=int, default=20, help='Books each user starts with.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the users\' choices.')
+        parser.add_argument('--url', default='', help='Base URL of a running server to target.')
+        parser.add_argument('--ai-delay', type=float, default=0.2,
+                            help='Seconds the fake AI provider takes to answer.')
+        parser.add_argument('--fake-ai-port', type=int, default=0,
+                            help='Port of the fake AI provider (0 = any free port).')
+        parser.add_argument('--slo', default=str(SLO_FILE), help='JSON file of SLO thresholds.')
+        parser.add_argument('--output', default='', help='Also write the report as JSON to this file.')
+        parser.add_argument('--slow-hasher', action='store_true',
+                            help='Keep the configured password hasher instead of MD5.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['duration'] <= 0:
+            raise CommandError('--users and --duration must be positive.')
+        if options['think'] < 0 or options['ramp_up'] < 0 or options['books'] < 0:
+            raise CommandError('--think, --ramp-up and --books must not be negative.')
+        try:
+            mix = parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        except ValueError as e:
+            raise CommandError(f'--mix: {e}')
+        try:
+            with open(options['slo'], encoding='utf-8') as f:
+                slos = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read the SLOs: {e}')
+
+        fake_ai = FakeAIServer(port=options['fake_ai_port'], delay=options['ai_delay'],
+                               content=fake_ai_content()).start()
+        overrides = {'OPENAI_API_BASE': fake_ai.url, 'OPENAI_API_KEY': 'loadtest', 'ALLOWED_HOSTS': ['*']}
+        index_dir = None
+        if options['url']:
+            transport_factory = partial(HttpTransport, options['url'])
+            self.stdout.write(f"Targeting {options['url']}; its OPENAI_API_BASE must be {fake_ai.url}")
+        else:
+            transport_factory = ClientTransport
+            if not options['slow_hasher']:
+                overrides['PASSWORD_HASHERS'] = FAST_HASHERS
+            index_dir = tempfile.TemporaryDirectory(prefix='loadtest-recommender-')
+            overrides['RECOMMENDER_INDEX_DIR'] = index_dir.name
+        try:
+            with override_settings(**overrides):
+                usernames = self._create_users(options['users'], options['books'], options['seed'])
+                try:
+                    report = run(usernames, LOADTEST_PASSWORD, transport_factory, mix, options['duration'],
+                                 think=options['think'], ramp_up=options['ramp_up'], seed=options['seed'])
+                finally:
+                    User.objects.filter(username__startswith=LOADTEST_USER_PREFIX).delete()
+        finally:
+            fake_ai.stop()
+            if index_dir is not None:
+                index_dir.cleanup()
+
+        report['config'] = {key: options[key] for key in ('users', 'duration', 'think', 'ramp_up', 'seed', 'url')}
+        report['config']['mix'] = mix
+        results = check_slos(report, slos)
+        report['slos'] = [
+            {'scope': scope, 'metric': metric, 'value': value, 'limit': limit, 'ok': ok}
+            for scope, metric, value, limit, ok in results
+        ]
+        self._print(report, options)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+        failed = [result for result in results if not result[-1]]
+        if failed:
+            raise CommandError(f'{len(failed)} of {len(results)} SLO checks failed.')
+
+    def _create_users(self, count, books, seed):
+        User.objects.filter(username__startswith=LOADTEST_USER_PREFIX).delete()
+        users = [
+            User.objects.create_user(username=f'{LOADTEST_USER_PREFIX}{i}', password=LOADTEST_PASSWORD)
+            for i in range(count)
+        ]
+        rng = random.Random(seed)
+        Book.objects.bulk_create([
+            Book(user=user, title=f'{title} ({n})', author=author, status=rng.choice(STATUSES))
+            for user in users
+            for n, (title, author) in enumerate(rng.choice(CLASSICS) for _ in range(books))
+        ])
+        return [user.username for user in users]
+
+    def _print(self, report, options):
+        overall = report['overall']
+        self.stdout.write(
+            f"loadtest: {options['users']} users for {report['elapsed']:.1f}s, {overall['requests']} requests "
+            f"({overall['rps']:.1f} req/s), {overall['error_rate'] * 100:.2f}% errors"
+        )
+        self.stdout.write(f"  {'endpoint':<24} {'requests':>8} {'errors':>7} {'req/s':>7} "
+                          f"{'p50':>8} {'p95':>8} {'p99':>8}")
+        for endpoint, stats in report['endpoints'].items():
+            self.stdout.write(
+                f"  {endpoint:<24} {stats['requests']:>8} {stats['errors']:>7} {stats['rps']:>7.1f} "
+                f"{stats['p50_ms']:>6.1f}ms {stats['p95_ms']:>6.1f}ms {stats['p99_ms']:>6.1f}ms"
+            )
+        if not report['slos']:
+            return
+        self.stdout.write('SLOs:')
+        for result in report['slos']:
+            verdict = self.style.SUCCESS('PASS') if result['ok'] else self.style.ERROR('FAIL')
+            comparison = '>=' if result['metric'] == 'min_rps' else '<='
+            self.stdout.write(f"  {verdict} {result['scope']} {result['metric']} "
+                              f"{result['value']} (limit {comparison} {result['limit']})")
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Run migrate on every Book shard database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-default', action='store_true',
+                            help='Also migrate the default database.')
+
+    def handle(self, *args, **options):
+        for alias in settings.BOOK_SHARDS:
+            if alias == 'default' and not options['include_default']:
+                continue
+            self.stdout.write(f'Migrating {alias}...')
+            call_command('migrate', database=alias, verbosity=options['verbosity'], interactive=False)
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library.sharding import is_sharded, move_user, plan_rebalance, shard_for_user
+
+
+class Command(BaseCommand):
+    help = 'Move users\' books between Book shards while the site is running.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', default=[],
+                            help='User id to move (repeatable). Requires --to.')
+        parser.add_argument('--to', dest='target', help='Target shard alias for --user.')
+        parser.add_argument('--auto', action='store_true',
+                            help='Plan moves that even out book counts across shards.')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Allowed deviation from the mean shard size for --auto.')
+        parser.add_argument('--settle', type=float, default=None,
+                            help='Seconds to wait after each flip (default: BOOK_SHARD_CACHE_TIMEOUT).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Print the moves only.')
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError('Only one Book shard is configured (see BOOK_SHARD_URLS).')
+
+        if options['auto']:
+            moves = plan_rebalance(options['tolerance'])
+        elif options['users']:
+            target = options['target']
+            if target not in settings.BOOK_SHARDS:
+                raise CommandError(f'--to must be one of: {", ".join(settings.BOOK_SHARDS)}')
+            unknown = set(options['users']) - set(
+                User.objects.filter(pk__in=options['users']).values_list('pk', flat=True)
+            )
+            if unknown:
+                raise CommandError(f'Unknown user ids: {", ".join(map(str, sorted(unknown)))}')
+            moves = [(user_id, shard_for_user(user_id), target) for user_id in options['users']]
+        else:
+            raise CommandError('Pass --user/--to or --auto.')
+
+        if not moves:
+            self.stdout.write('Shards are balanced; nothing to move.')
+            return
+
+        for user_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'Would move user {user_id}: {source} -> {target}')
+                continue
+            moved = move_user(
+                user_id, target,
+                settle_seconds=options['settle'],
+                batch_size=options['batch_size'],
+            )
+            self.stdout.write(f'Moved user {user_id}: {source} -> {target} ({moved} rows)')
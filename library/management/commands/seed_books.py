@@ -0,0 +1,86 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from library.models import Book, Profile
+from library.trends import record_status_changes
+
+ADJECTIVES = ['Silent', 'Hidden', 'Last', 'Broken', 'Golden', 'Distant', 'Forgotten', 'Crimson',
+              'Endless', 'Quiet', 'Burning', 'Winter', 'Little', 'Secret', 'Wild', 'Midnight']
+NOUNS = ['Garden', 'River', 'Kingdom', 'Library', 'Ocean', 'Empire', 'Mountain', 'City',
+         'Forest', 'Harbor', 'Star', 'Machine', 'Letter', 'Island', 'Mirror', 'Road']
+FIRST_NAMES = ['Ada', 'James', 'Maria', 'Chen', 'Amara', 'Leo', 'Sofia', 'Ivan', 'Noor', 'Kenji',
+               'Elena', 'Samuel', 'Priya', 'Tomas', 'Ines', 'Omar']
+LAST_NAMES = ['Okafor', 'Lindqvist', 'Moreau', 'Tanaka', 'Silva', 'Novak', 'Haddad', 'Walsh',
+              'Kowalski', 'Reyes', 'Nakamura', 'Berg', 'Osei', 'Romano', 'Park', 'Dubois']
+STATUS_WEIGHTS = {'Completed': 50, 'Planned': 35, 'Reading': 15}
+
+SEED_PASSWORD = 'seed-pass-123'
+
+
+class Command(BaseCommand):
+    help = 'Create users with generated books for benchmarks and load tests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--books-per-user', type=int, default=50)
+        parser.add_argument('--days', type=int, default=730,
+                            help='Spread date_added over this many past days.')
+        parser.add_argument('--prefix', default='seed-user-', help='Username prefix.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['books_per_user'] < 0:
+            raise CommandError('--users must be positive and --books-per-user non-negative.')
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users starting with {prefix!r} already exist; pick another --prefix.')
+
+        # bulk_create skips the post_save signal, so profiles are made here too
+        password = make_password(SEED_PASSWORD)
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', password=password) for i in range(options['users'])],
+            batch_size=options['batch_size'],
+        )
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id) for user_id in user_ids],
+            batch_size=options['batch_size'],
+        )
+
+        now = timezone.now()
+        statuses = list(STATUS_WEIGHTS)
+        weights = list(STATUS_WEIGHTS.values())
+        max_age = timedelta(days=options['days']).total_seconds()
+        batch = []
+        created = 0
+        for user_id in user_ids:
+            for _ in range(options['books_per_user']):
+                batch.append(Book(
+                    user_id=user_id,
+                    title=f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                    author=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    status=rng.choices(statuses, weights)[0],
+                    date_added=now - timedelta(seconds=rng.uniform(0, max_age)),
+                ))
+                if len(batch) >= options['batch_size']:
+                    created += self._save(batch)
+                    batch = []
+        if batch:
+            created += self._save(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(user_ids)} users (password {SEED_PASSWORD!r}) and {created} books. '
+            'Run build_recommender to index them.'
+        ))
+
+    def _save(self, batch):
+        Book.objects.bulk_create(batch)
+        record_status_changes([(book.user_id, book.pk, None, book.status, book.date_added) for book in batch])
+        return len(batch)
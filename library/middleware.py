@@ -0,0 +1,61 @@
+import re
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .routers import replica_reads
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Present on a client for REPLICA_PIN_SECONDS after it made a write
+PIN_COOKIE = 'bookshelf_primary_pin'
+
+WRITE_SQL = re.compile(r'\s*(?:INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+class WriteObserver:
+    """``execute_wrapper`` that notes whether a statement wrote to the database."""
+
+    def __init__(self):
+        self.wrote = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.wrote and WRITE_SQL.match(sql):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve GET requests from the read replicas. A client whose request wrote
+    to the primary (any POST, and GETs such as logout that delete the
+    session) is pinned to it for ``REPLICA_PIN_SECONDS`` so it always reads
+    its own changes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        request.pinned_to_primary = PIN_COOKIE in request.COOKIES
+        safe = request.method in SAFE_METHODS
+        writes = WriteObserver()
+        with ExitStack() as stack:
+            stack.enter_context(replica_reads(safe and not request.pinned_to_primary))
+            # A write to a book shard pins the client too
+            for alias in settings.BOOK_SHARDS:
+                stack.enter_context(connections[alias].execute_wrapper(writes))
+            response = self.get_response(request)
+
+        if not safe or writes.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
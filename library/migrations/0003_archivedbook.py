@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('library', '0002_book_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('author', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('Reading', 'Reading'), ('Completed', 'Completed'), ('Planned', 'Planned')], default='Completed', max_length=20)),
+                ('date_added', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_books', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date_added'],
+            },
+        ),
+    ]
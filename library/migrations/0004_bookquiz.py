@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('library', '0003_archivedbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookQuiz',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('author', models.CharField(max_length=100)),
+                ('difficulty', models.CharField(max_length=20)),
+                ('questions', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='book_quizzes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bookquiz',
+            constraint=models.UniqueConstraint(fields=('user', 'title', 'author', 'difficulty'), name='unique_book_quiz'),
+        ),
+    ]
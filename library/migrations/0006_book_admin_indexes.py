@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:23
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_book_status_events'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['date_added', 'id'], name='book_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Upper('title'), name='book_title_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Upper('author'), name='book_author_upper_idx'),
+        ),
+    ]
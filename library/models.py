@@ -1,7 +1,56 @@
-from django.db import models
+import logging
+
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.functions import Upper
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
+
+from .backends import invalidate_cached_user
+from .live import book_payload, publish
+from .sharding import is_sharded, shard_for_user
+from .text import book_fingerprint
+from .trends import record_status_changes
+
+logger = logging.getLogger(__name__)
+
+
+class BookQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """The user's books, read from the shard that holds them."""
+        user_id = getattr(user, 'pk', user)
+        books = self.filter(user_id=user_id)
+        if is_sharded():
+            # Reads don't assign a shard: a user without one has no books
+            # outside default (see placement_for_user)
+            books = books.using(shard_for_user(user_id, assign=False) or 'default')
+        return books
+    
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # Let the router pick the shard from the new instance's user
+        book = self.model(**kwargs)
+        book.save(force_insert=True)
+        return book
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        """Insert ``objs`` on their users' shards, one bulk insert per shard."""
+        objs = list(objs)
+        if self.model is Book:
+            # bulk_create skips save(), which keeps the fingerprint otherwise
+            for obj in objs:
+                obj.fingerprint = book_fingerprint(obj.title, obj.author)
+        if self._db is not None or not is_sharded():
+            return super().bulk_create(objs, *args, **kwargs)
+        by_shard = {}
+        for obj in objs:
+            by_shard.setdefault(shard_for_user(obj.user_id), []).append(obj)
+        for alias, shard_objs in by_shard.items():
+            self.using(alias).bulk_create(shard_objs, *args, **kwargs)
+        return objs
 
 
 class Book(models.Model):
@@ -14,14 +63,191 @@ class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Planned')
-    date_added = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='books')
+    date_added = models.DateTimeField(default=timezone.now, editable=False)
+    # No database constraint: with sharding the book and its user can live
+    # in different databases. Deletes still cascade (see delete_sharded_books).
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='books', db_constraint=False)
+    # book_fingerprint(title, author), kept up to date on every write so
+    # "already on the shelf?" is an index lookup (see duplicates_of)
+    fingerprint = models.CharField(max_length=16, editable=False, default='')
+    
+    objects = BookQuerySet.as_manager()
     
     class Meta:
         ordering = ['-date_added']
+        indexes = [
+            models.Index(fields=['user', 'fingerprint'], name='book_user_fingerprint_idx'),
+            # The admin's newest-first changelist and its date hierarchy
+            models.Index(fields=['date_added', 'id'], name='book_date_added_idx'),
+            # The admin's prefix search (see admin.IndexedPrefixSearchMixin)
+            models.Index(Upper('title'), name='book_title_upper_idx'),
+            models.Index(Upper('author'), name='book_author_upper_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} by {self.author}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    @classmethod
+    def duplicates_of(cls, user, title, author):
+        """The user's books that are ``title`` by ``author`` up to case, accents and punctuation."""
+        return cls.objects.for_user(user).filter(fingerprint=book_fingerprint(title, author))
+    
+    def save(self, *args, **kwargs):
+        """
+        Save and, when the shelf changed, log it to the status events in the
+        same transaction. Open dashboards hear about it once it commits.
+        """
+        self.fingerprint = book_fingerprint(self.title, self.author)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'title', 'author'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'fingerprint'}
+        created = self._state.adding
+        old_status = None if created else getattr(self, '_loaded_status', self.status)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        event = {'type': 'book.added' if created else 'book.updated', 'old_status': old_status}
+        if old_status == self.status:
+            super().save(*args, **kwargs)
+            publish(self.user_id, {**event, 'book': book_payload(self)}, using=using)
+            return
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            record_status_changes(
+                [(self.user_id, self.pk, old_status, self.status, self.date_added if created else None)],
+                using=using,
+            )
+            publish(self.user_id, {**event, 'book': book_payload(self)}, using=using)
+        self._loaded_status = self.status
+    
+    def delete(self, *args, **kwargs):
+        # Queryset deletes (archiving, shard moves) aren't shelf changes and
+        # skip this on purpose
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        book_id, old_status = self.pk, getattr(self, '_loaded_status', self.status)
+        with transaction.atomic(using=using):
+            result = super().delete(*args, **kwargs)
+            record_status_changes([(self.user_id, book_id, old_status, None, None)], using=using)
+            publish(self.user_id, {'type': 'book.deleted', 'book': {'id': book_id, 'status': old_status}}, using=using)
+            record_removed_books([self], using=using)
+        return result
+
+
+class ArchivedBook(models.Model):
+    """
+    Cold tier for old Completed books, moved here by ``manage.py
+    archive_books`` so they stop weighing on the hot ``library_book`` table.
+    Lives on the same shard as the user's books.
+    """
+    title = models.CharField(max_length=200)
+    author = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=Book.STATUS_CHOICES, default='Completed')
+    date_added = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_books', db_constraint=False)
+    
+    objects = BookQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['-date_added']
+    
+    def __str__(self):
+        return f"{self.title} by {self.author} (archived)"
+
+
+class BookQuiz(models.Model):
+    """
+    Generated quiz questions for one book on a user's shelf, at one
+    difficulty. Keyed by title/author rather than the Book row so it
+    survives archiving and shard moves; lives on the user's shard.
+    """
+    title = models.CharField(max_length=200)
+    author = models.CharField(max_length=100)
+    difficulty = models.CharField(max_length=20)
+    questions = models.JSONField(default=list)
+    created_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='book_quizzes', db_constraint=False)
+    
+    objects = BookQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'title', 'author', 'difficulty'], name='unique_book_quiz',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.difficulty} quiz for {self.title} by {self.author}"
+
+
+class BookStatusEvent(models.Model):
+    """
+    Append-only log of shelf changes: a book added (no old status), moved
+    between statuses, or deleted (no new status). Written next to the
+    user's books by ``library.trends.record_status_changes``.
+    """
+    # Id of the book when the event was written; not a foreign key, so the
+    # log outlives deleted books
+    book_id = models.BigIntegerField(null=True)
+    old_status = models.CharField(max_length=20, blank=True)
+    new_status = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='book_events', db_constraint=False)
+    
+    objects = BookQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'], name='bookevent_user_created_idx')]
+    
+    def __str__(self):
+        return f"{self.user_id}: book {self.book_id} {self.old_status or '-'} -> {self.new_status or '-'}"
+
+
+class BookStatusDaily(models.Model):
+    """
+    Per-user, per-day rollup of BookStatusEvent: books added and removed,
+    and books that entered each status. Incremented as events are written,
+    so trends never scan the events or the books.
+    """
+    day = models.DateField()
+    added = models.PositiveIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
+    reading = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    planned = models.PositiveIntegerField(default=0)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='book_days', db_constraint=False)
+    
+    objects = BookQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_book_status_day'),
+        ]
+        ordering = ['day']
+    
+    def __str__(self):
+        return f"{self.user_id} on {self.day}"
+
+
+class LiveEvent(models.Model):
+    """
+    A shelf change waiting to reach dashboards served by other workers (see
+    ``library.live.DatabaseBroker``). Pruned after LIVE_UPDATES_RETENTION.
+    """
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    
+    class Meta:
+        indexes = [models.Index(fields=['user', 'id'], name='liveevent_user_id_idx')]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.payload.get('type')}"
 
 
 class Profile(models.Model):
@@ -30,8 +256,42 @@ class Profile(models.Model):
     location = models.CharField(max_length=100, blank=True)
     birth_date = models.DateField(null=True, blank=True)
     
+    # Fields compared against the values loaded from the database
+    TRACKED_FIELDS = ('bio', 'location', 'birth_date')
+    
     def __str__(self):
         return f"{self.user.username}'s profile"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+    
+    def _snapshot(self):
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+    
+    def get_dirty_fields(self):
+        """Return the tracked fields whose value differs from the database."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            # Never loaded from or written to the database
+            return list(self.TRACKED_FIELDS)
+        return [name for name in self.TRACKED_FIELDS if getattr(self, name) != loaded[name]]
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot()
+
+
+class ShardAssignment(models.Model):
+    """Which database in settings.BOOK_SHARDS holds a user's books."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='book_shard')
+    shard = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id} -> {self.shard}"
 
 
 # Automatically create a profile when a new user is created
@@ -42,6 +302,97 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_user_profile(sender, instance, created, **kwargs):
+    # Only touch the profile if it was loaded and edited alongside the user.
+    # Lazy-loading it here would cost a SELECT and an UPDATE on every User
+    # save, including the last_login update made by every login().
+    if created or not User.profile.is_cached(instance):
+        return
+    dirty_fields = instance.profile.get_dirty_fields()
+    if dirty_fields:
+        instance.profile.save(update_fields=dirty_fields)
 
+
+
+# Keep the cached request.user (see backends.ProfileModelBackend) in sync
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_user_cache_on_profile_save(sender, instance, **kwargs):
+    invalidate_cached_user(instance.user_id)
+
+
+@receiver(user_logged_out)
+def invalidate_user_cache_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_cached_user(user.pk)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_books(sender, instance, using, **kwargs):
+    # The deletion collector only cascades within the user's own database
+    if is_sharded():
+        shard = shard_for_user(instance.pk, assign=False)
+        if shard is not None and shard != using:
+            Book.objects.using(shard).filter(user_id=instance.pk).delete()
+            ArchivedBook.objects.using(shard).filter(user_id=instance.pk).delete()
+            BookQuiz.objects.using(shard).filter(user_id=instance.pk).delete()
+            BookStatusEvent.objects.using(shard).filter(user_id=instance.pk).delete()
+            BookStatusDaily.objects.using(shard).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Book)
+def record_book_for_recommender(sender, instance, created, using, **kwargs):
+    if created:
+        transaction.on_commit(lambda: _record_books([instance]), using=using)
+
+
+def record_removed_books(books, using=None):
+    """
+    Take ``books``, just deleted, out of the recommender's answers once the
+    delete commits, unless their user still has another copy of the work,
+    shelved or archived. Without ``using``, each user's copies are looked
+    up on their shard.
+    """
+    by_alias = {}
+    for book in books:
+        alias = using or shard_for_user(book.user_id, assign=False) or 'default'
+        by_alias.setdefault(alias, []).append((book, (book.user_id, book_fingerprint(book.title, book.author))))
+    removed = []
+    for alias, keyed in by_alias.items():
+        user_ids = {user_id for _, (user_id, _) in keyed}
+        left = set(
+            Book.objects.using(alias)
+            .filter(user_id__in=user_ids, fingerprint__in={fingerprint for _, (_, fingerprint) in keyed})
+            .values_list('user_id', 'fingerprint')
+        )
+        left.update(
+            (user_id, book_fingerprint(title, author))
+            for user_id, title, author in ArchivedBook.objects.using(alias).filter(user_id__in=user_ids)
+            .values_list('user_id', 'title', 'author')
+        )
+        removed += [book for book, key in keyed if key not in left]
+    if removed:
+        transaction.on_commit(lambda: _record_books(removed, removed=True), using=using)
+
+
+@receiver(post_delete, sender=User)
+def record_user_for_recommender(sender, instance, using, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: _record_books(removed_users=[user_id]), using=using)
+
+
+def _record_books(books=(), removed=False, removed_users=()):
+    from .recommender import record_books, record_removed_users
+    
+    try:
+        if books:
+            record_books(books, removed=removed)
+        if removed_users:
+            record_removed_users(removed_users)
+    except OSError:
+        logger.warning('Could not append to the recommender delta log', exc_info=True)
@@ -0,0 +1,120 @@
+"""
+Quiz generation for a whole shelf in a few upstream calls.
+
+Books are packed into batches whose prompt plus expected answer fits in
+``AI_QUIZ_BATCH_TOKENS``. Each batch is one chat completion asking for
+questions tagged with the number of the book they are about, and batches
+run ``AI_QUIZ_CONCURRENCY`` at a time.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import ai_client
+from .ai_output import SHELF_QUIZ, parse_items
+
+QUESTIONS_PER_BOOK = 5
+# Typical size of five questions with answers in the requested JSON
+ANSWER_TOKENS_PER_BOOK = 250
+# Usual rule of thumb for English text
+CHARS_PER_TOKEN = 4
+# "2", or "2.0" from a model that writes numbers as floats
+BOOK_NUMBER = re.compile(r'([0-9]{1,6})(?:\.0*)?')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _system_prompt(difficulty):
+    return (
+        f'You are a quiz generator. Create {difficulty.lower()} level quiz questions about books. '
+        f'For each numbered book, provide exactly {QUESTIONS_PER_BOOK} questions with their answers. '
+        + SHELF_QUIZ.prompt
+    )
+
+
+def _user_prompt(difficulty, batch):
+    books = '\n'.join(f'{number}. "{title}" by {author}' for number, (title, author) in enumerate(batch, 1))
+    return f'Generate {QUESTIONS_PER_BOOK} {difficulty.lower()} level quiz questions for each of these books:\n\n{books}'
+
+
+def pack_batches(books, difficulty, budget=None):
+    """
+    Split ``(title, author)`` pairs into batches whose prompt plus expected
+    answer fits in ``budget`` tokens. A book too big for any batch still
+    gets one of its own.
+    """
+    budget = budget or settings.AI_QUIZ_BATCH_TOKENS
+    base = estimate_tokens(_system_prompt(difficulty) + _user_prompt(difficulty, []))
+    batches, batch, used = [], [], base
+    for title, author in books:
+        cost = estimate_tokens(f'{len(batch) + 1}. "{title}" by {author}\n') + ANSWER_TOKENS_PER_BOOK
+        if batch and used + cost > budget:
+            batches.append(batch)
+            batch, used = [], base
+        batch.append((title, author))
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _quiz_batch(batch, difficulty, budget):
+    """Questions for the books of one batch, by ``(title, author)``."""
+    system = _system_prompt(difficulty)
+    user = _user_prompt(difficulty, batch)
+    payload = {
+        'model': 'gpt-3.5-turbo',
+        'messages': [
+            {'role': 'system', 'content': system},
+            {'role': 'user', 'content': user},
+        ],
+        'response_format': {'type': 'json_object'},
+        # Whatever the prompt leaves of the budget, and at least the expected answer
+        'max_tokens': max(budget - estimate_tokens(system + user), len(batch) * ANSWER_TOKENS_PER_BOOK),
+        'temperature': 0.7
+    }
+    quizzes = {}
+    for item in parse_items(ai_client.chat(payload), SHELF_QUIZ):
+        match = BOOK_NUMBER.fullmatch(str(item['book']).strip())
+        number = int(match.group(1)) if match else 0
+        if 1 <= number <= len(batch):
+            questions = quizzes.setdefault(batch[number - 1], [])
+            if len(questions) < QUESTIONS_PER_BOOK:
+                questions.append({'question': item['question'], 'answer': item['answer']})
+    return quizzes
+
+
+def generate_quizzes(books, difficulty, budget=None):
+    """
+    Quiz questions for ``(title, author)`` pairs.
+
+    Returns ``(quizzes, calls, error)``: questions by book, the number of
+    upstream calls made, and the last AIUnavailable/AIError raised by a
+    batch (its books are left out). Books a successful batch skipped get
+    one more try in a second round.
+    """
+    budget = budget or settings.AI_QUIZ_BATCH_TOKENS
+    quizzes, calls, error = {}, 0, None
+    pending = list(books)
+    for _ in range(2):
+        batches = pack_batches(pending, difficulty, budget)
+        if not batches:
+            break
+        workers = max(1, min(settings.AI_QUIZ_CONCURRENCY, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_quiz_batch, batch, difficulty, budget) for batch in batches]
+        calls += len(batches)
+
+        pending = []
+        for batch, future in zip(batches, futures):
+            try:
+                answered = future.result()
+            except (ai_client.AIUnavailable, ai_client.AIError) as e:
+                error = e
+                continue
+            quizzes.update(answered)
+            pending.extend(book for book in batch if book not in answered)
+    return quizzes, calls, error
@@ -0,0 +1,462 @@
+"""
+Local "books like this" recommender, served without calling the AI provider.
+
+Every distinct work (normalized title + author) across all shelves is a
+document. Documents are vectorized as TF-IDF over hashed character n-grams
+and stored as an inverted index (feature -> postings), so a query only
+touches the postings of its own n-grams. Who-shelved-what is kept as two
+CSR arrays (user -> works, work -> users) for "readers who shelved X also
+shelved Y".
+
+The index lives in ``settings.RECOMMENDER_INDEX_DIR`` as ``.npy`` files that
+are memory-mapped on load. ``manage.py build_recommender`` writes a new
+version from the database; books added afterwards are appended to a small
+delta log (see ``record_books``) that every process folds in on its next
+query. Books taken off a shelf, and deleted users, are logged the same way
+and filtered out of the answers until the next build drops them for good.
+Picking up changes builds a new ``Recommender`` that replaces the process's
+one, so a query running in another thread never sees half of an update.
+"""
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .text import normalize_text, work_key
+
+NGRAM = 3
+DIM = 1 << 18
+# In a large corpus, n-grams found in more than this share of works carry
+# almost no signal and have the longest postings, so queries skip them
+MAX_DF_RATIO = 0.2
+MIN_DOCS_FOR_DF_CUTOFF = 1000
+# Bound the work behind one "also shelved" query
+MAX_READERS = 5000
+
+CURRENT_FILE = 'CURRENT'
+DELTA_LOG = 'delta.jsonl'
+ARRAYS = (
+    'df', 'feat_indptr', 'post_docs', 'post_weights',
+    'user_ids', 'user_indptr', 'user_docs', 'doc_indptr', 'doc_users',
+)
+
+
+def ngram_counts(text):
+    """Hashed character n-gram counts of ``text``."""
+    padded = f' {normalize_text(text)} '
+    counts = {}
+    for i in range(max(1, len(padded) - NGRAM + 1)):
+        feature = zlib.crc32(padded[i:i + NGRAM].encode()) & (DIM - 1)
+        counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+
+def _idf(df, n_docs):
+    return np.log((1 + n_docs) / (1 + df.astype(np.float64))) + 1
+
+
+def _tfidf_postings(doc_counts, first_doc, idf):
+    """
+    Inverted index over ``doc_counts`` (one n-gram count dict per document,
+    numbered from ``first_doc``) with L2-normalized TF-IDF weights.
+    """
+    lengths = [len(counts) for counts in doc_counts]
+    rows = np.repeat(np.arange(first_doc, first_doc + len(doc_counts), dtype=np.int32), lengths)
+    cols = np.fromiter((f for counts in doc_counts for f in counts), dtype=np.int32, count=sum(lengths))
+    tf = np.fromiter((c for counts in doc_counts for c in counts.values()), dtype=np.float32,
+                     count=sum(lengths))
+
+    weights = (1 + np.log(tf)) * idf[cols].astype(np.float32)
+    norms = np.sqrt(np.bincount(rows - first_doc, weights=weights * weights, minlength=len(doc_counts)))
+    weights /= norms[rows - first_doc].astype(np.float32)
+
+    order = np.argsort(cols, kind='stable')
+    feat_indptr = np.zeros(DIM + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cols, minlength=DIM), out=feat_indptr[1:])
+    return feat_indptr, rows[order], weights[order]
+
+
+def _csr(keys, values, n_keys):
+    """Group ``values`` by ``keys`` (0..n_keys-1) into (indptr, values)."""
+    order = np.argsort(keys, kind='stable')
+    indptr = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=indptr[1:])
+    return indptr, values[order]
+
+
+def _gather(indptr, values, keys):
+    """Concatenate ``values[indptr[k]:indptr[k + 1]]`` for every k in ``keys``, vectorized."""
+    starts = indptr[keys]
+    lengths = indptr[keys + 1] - starts
+    if not len(keys) or not lengths.sum():
+        return values[:0]
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return values[offsets + np.arange(lengths.sum())]
+
+
+class IndexBuilder:
+    """Collects (title, author, user) rows and writes a new index version."""
+
+    def __init__(self):
+        self.titles = []
+        self.authors = []
+        self.doc_of = {}
+        self.pair_docs = []
+        self.pair_users = []
+
+    def add(self, title, author, user_id):
+        key = work_key(title, author)
+        doc = self.doc_of.get(key)
+        if doc is None:
+            doc = self.doc_of[key] = len(self.titles)
+            self.titles.append(title)
+            self.authors.append(author)
+        self.pair_docs.append(doc)
+        self.pair_users.append(user_id)
+
+    def arrays(self):
+        n_docs = len(self.titles)
+        doc_counts = [ngram_counts(f'{t} {a}') for t, a in zip(self.titles, self.authors)]
+        df = np.zeros(DIM, dtype=np.int32)
+        for counts in doc_counts:
+            df[list(counts)] += 1
+        feat_indptr, post_docs, post_weights = _tfidf_postings(doc_counts, 0, _idf(df, n_docs))
+
+        # Unique (user, work) pairs as CSR in both directions
+        pairs = np.array([self.pair_users, self.pair_docs], dtype=np.int64).reshape(2, -1)
+        if pairs.shape[1]:
+            pairs = np.unique(pairs, axis=1)
+        user_ids, user_index = np.unique(pairs[0], return_inverse=True)
+        pair_docs = pairs[1].astype(np.int32)
+        user_index = user_index.astype(np.int32)
+        user_indptr, user_docs = _csr(user_index, pair_docs, len(user_ids))
+        doc_indptr, doc_users = _csr(pair_docs, user_index, n_docs)
+        return {
+            'df': df, 'feat_indptr': feat_indptr, 'post_docs': post_docs, 'post_weights': post_weights,
+            'user_ids': user_ids, 'user_indptr': user_indptr, 'user_docs': user_docs,
+            'doc_indptr': doc_indptr, 'doc_users': doc_users,
+        }
+
+    def save(self, index_dir, log_offset=0):
+        """Write a new version and point CURRENT at it. Returns its path."""
+        index_dir = Path(index_dir)
+        version = index_dir / f'v{time.time_ns()}'
+        version.mkdir(parents=True)
+        for name, array in self.arrays().items():
+            np.save(version / f'{name}.npy', array)
+        with open(version / 'docs.json', 'w', encoding='utf-8') as f:
+            json.dump({'titles': self.titles, 'authors': self.authors, 'log_offset': log_offset}, f)
+
+        tmp = index_dir / f'{CURRENT_FILE}.tmp'
+        tmp.write_text(version.name)
+        os.replace(tmp, index_dir / CURRENT_FILE)
+
+        # Keep the previous version for processes still mapping it
+        versions = sorted(p for p in index_dir.iterdir() if p.is_dir() and p.name.startswith('v'))
+        for old in versions[:-2]:
+            shutil.rmtree(old, ignore_errors=True)
+        return version
+
+
+class Recommender:
+    """A loaded index version plus the books logged since it was built."""
+
+    def __init__(self, index_dir):
+        self.index_dir = Path(index_dir)
+        self.version = None
+        self.log_position = 0
+        self._load_base()
+
+    def _load_base(self):
+        current = self.index_dir / CURRENT_FILE
+        self.version = current.read_text().strip() if current.exists() else None
+        if self.version:
+            path = self.index_dir / self.version
+            base = {name: np.load(path / f'{name}.npy', mmap_mode='r') for name in ARRAYS}
+            with open(path / 'docs.json', encoding='utf-8') as f:
+                docs = json.load(f)
+        else:
+            builder = IndexBuilder()
+            base = builder.arrays()
+            docs = {'titles': [], 'authors': [], 'log_offset': 0}
+        self.base = base
+        self.titles = list(docs['titles'])
+        self.authors = list(docs['authors'])
+        self.n_base = self.n_docs = len(self.titles)
+        self.doc_of = {work_key(t, a): i for i, (t, a) in enumerate(zip(self.titles, self.authors))}
+        self.log_position = docs['log_offset']
+        self._reset_delta()
+        self._read_log()
+
+    def _reset_delta(self):
+        self.delta_counts = []
+        self.delta_df = np.zeros(DIM, dtype=np.int32)
+        self.delta_pair_docs = np.zeros(0, dtype=np.int32)
+        self.delta_pair_users = np.zeros(0, dtype=np.int64)
+        self.delta_postings = None
+        # Logged since the build: (user, work) pairs taken off a shelf,
+        # deleted users, and works nobody shelves any more
+        self.removed_pairs = set()
+        self.removed_users = set()
+        self.hidden = set()
+
+    def _read_log(self):
+        log = self.index_dir / DELTA_LOG
+        try:
+            with open(log, encoding='utf-8') as f:
+                f.seek(self.log_position)
+                lines = f.readlines()
+                # Leave a partially written last line for the next read
+                if lines and not lines[-1].endswith('\n'):
+                    lines.pop()
+                self.log_position += sum(len(line.encode('utf-8')) for line in lines)
+        except FileNotFoundError:
+            return
+
+        pair_docs, pair_users, touched, removed_users = [], [], set(), []
+        for line in lines:
+            row = json.loads(line)
+            if row.get('removed') and 'title' not in row:
+                self.removed_users.add(row['user'])
+                removed_users.append(row['user'])
+                continue
+            if row.get('removed'):
+                doc = self.doc_of.get(work_key(row['title'], row['author']))
+                if doc is not None:
+                    self.removed_pairs.add((row['user'], doc))
+                    touched.add(doc)
+                continue
+            key = work_key(row['title'], row['author'])
+            doc = self.doc_of.get(key)
+            if doc is None:
+                doc = self.doc_of[key] = len(self.titles)
+                self.titles.append(row['title'])
+                self.authors.append(row['author'])
+                counts = ngram_counts(f"{row['title']} {row['author']}")
+                self.delta_counts.append(counts)
+                self.delta_df[list(counts)] += 1
+            pair_docs.append(doc)
+            pair_users.append(row['user'])
+            self.removed_pairs.discard((row['user'], doc))
+            touched.add(doc)
+
+        if pair_docs:
+            self.delta_pair_docs = np.concatenate([self.delta_pair_docs, np.array(pair_docs, dtype=np.int32)])
+            self.delta_pair_users = np.concatenate([self.delta_pair_users, np.array(pair_users, dtype=np.int64)])
+            self.delta_postings = None
+        self.n_docs = len(self.titles)
+        for user_id in removed_users:
+            touched.update(int(doc) for doc in self._shelf(user_id))
+        for doc in touched:
+            if len(self._readers(doc)):
+                self.hidden.discard(doc)
+            else:
+                self.hidden.add(doc)
+
+    def _shelf(self, user_id):
+        """Works of ``user_id`` in the base index and the delta log, removals included."""
+        user_ids, user_indptr = self.base['user_ids'], self.base['user_indptr']
+        position = np.searchsorted(user_ids, user_id)
+        base = np.zeros(0, dtype=np.int32)
+        if position < len(user_ids) and user_ids[position] == user_id:
+            base = np.asarray(self.base['user_docs'][user_indptr[position]:user_indptr[position + 1]])
+        return np.union1d(base, self.delta_pair_docs[self.delta_pair_users == user_id])
+
+    def _kept(self, users, docs):
+        """Mask of the ``(users[i], docs[i])`` pairs still on a shelf."""
+        kept = np.ones(len(users), dtype=bool)
+        if self.removed_users:
+            kept &= ~np.isin(users, list(self.removed_users))
+        if self.removed_pairs:
+            removed = np.array([user << 32 | doc for user, doc in self.removed_pairs], dtype=np.int64)
+            kept &= ~np.isin(np.asarray(users, dtype=np.int64) << 32 | docs, removed)
+        return kept
+
+    def _readers(self, doc):
+        """Users who shelve work ``doc``."""
+        base = self.base
+        readers = np.zeros(0, dtype=np.int64)
+        if doc < self.n_base:
+            start, end = base['doc_indptr'][doc], base['doc_indptr'][doc + 1]
+            readers = np.asarray(base['user_ids'][np.asarray(base['doc_users'][start:end])])
+        readers = np.union1d(readers, self.delta_pair_users[self.delta_pair_docs == doc])
+        return readers[self._kept(readers, doc)]
+
+    def refreshed(self):
+        """
+        This recommender if it is up to date, else a new one with the newly
+        built version or delta log lines. ``self`` is left as it was, since
+        other threads may be querying it.
+        """
+        current = self.index_dir / CURRENT_FILE
+        version = current.read_text().strip() if current.exists() else None
+        if version != self.version:
+            return Recommender(self.index_dir)
+        log = self.index_dir / DELTA_LOG
+        if not log.exists() or log.stat().st_size <= self.log_position:
+            return self
+        fresh = copy.copy(self)
+        # Works are only ever appended to titles, authors and doc_of, and each
+        # recommender stops at its own n_docs, so those are shared, not copied
+        fresh.delta_counts = list(self.delta_counts)
+        fresh.delta_df = self.delta_df.copy()
+        fresh.removed_pairs = set(self.removed_pairs)
+        fresh.removed_users = set(self.removed_users)
+        fresh.hidden = set(self.hidden)
+        fresh._read_log()
+        return fresh
+
+    def _delta_index(self):
+        if self.delta_postings is None and self.delta_counts:
+            self.delta_postings = _tfidf_postings(
+                self.delta_counts, self.n_base, _idf(self.base['df'] + self.delta_df, self.n_docs),
+            )
+        return self.delta_postings
+
+    def _doc(self, index, score_name, score):
+        return {'title': self.titles[index], 'author': self.authors[index], score_name: score}
+
+    def lookup(self, title, author):
+        doc = self.doc_of.get(work_key(title, author))
+        # Ignore works appended by a newer recommender
+        return doc if doc is not None and doc < self.n_docs else None
+
+    def similar(self, text, k=10, exclude=None):
+        """The ``k`` works whose title/author text is closest to ``text`` by cosine similarity."""
+        counts = ngram_counts(text)
+        features = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        df = self.base['df'][features] + self.delta_df[features]
+        weights = 1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        weights *= _idf(df, self.n_docs)
+        weights /= np.linalg.norm(weights) or 1
+        if self.n_docs >= MIN_DOCS_FOR_DF_CUTOFF:
+            rare = df <= MAX_DF_RATIO * self.n_docs
+            if rare.any():
+                features, weights = features[rare], weights[rare]
+
+        docs, scores = [], []
+        for feat_indptr, post_docs, post_weights in filter(None, [
+            (self.base['feat_indptr'], self.base['post_docs'], self.base['post_weights']),
+            self._delta_index(),
+        ]):
+            lengths = feat_indptr[features + 1] - feat_indptr[features]
+            docs.append(_gather(feat_indptr, post_docs, features))
+            scores.append(_gather(feat_indptr, post_weights, features) * np.repeat(weights, lengths))
+        docs = np.concatenate(docs)
+        if not len(docs) or k <= 0:
+            return []
+
+        # Dense accumulation once the postings cover a good share of the corpus
+        if len(docs) * 8 > self.n_docs:
+            doc_ids = None
+            totals = np.bincount(docs, weights=np.concatenate(scores), minlength=self.n_docs)
+        else:
+            doc_ids, inverse = np.unique(docs, return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+        hidden = list(self.hidden) if exclude is None else [*self.hidden, exclude]
+        if hidden:
+            if doc_ids is None:
+                totals[hidden] = 0
+            else:
+                totals[np.isin(doc_ids, hidden)] = 0
+
+        k = min(k, len(totals))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top], kind='stable')]
+        return [
+            self._doc(int(i if doc_ids is None else doc_ids[i]), 'score', round(float(totals[i]), 4))
+            for i in top if totals[i] > 0
+        ]
+
+    def similar_many(self, texts, k=10):
+        return [self.similar(text, k) for text in texts]
+
+    def also_shelved(self, doc, k=10):
+        """Works most often shelved by the readers of work ``doc``."""
+        base = self.base
+        readers = self._readers(doc)[:MAX_READERS]
+        if not len(readers):
+            return []
+
+        # Base shelves of those readers, then their delta shelves
+        user_ids = np.asarray(base['user_ids'])
+        positions = np.searchsorted(user_ids, readers)
+        known = positions < len(user_ids)
+        known[known] = user_ids[positions[known]] == readers[known]
+        user_indptr = base['user_indptr']
+        in_delta = np.isin(self.delta_pair_users, readers)
+        shelved = np.concatenate([
+            _gather(user_indptr, base['user_docs'], positions[known]),
+            self.delta_pair_docs[in_delta],
+        ])
+        shelved_by = np.concatenate([
+            np.repeat(readers[known], user_indptr[positions[known] + 1] - user_indptr[positions[known]]),
+            self.delta_pair_users[in_delta],
+        ])
+        kept = (shelved != doc) & self._kept(shelved_by, shelved)
+        if not kept.any():
+            return []
+        # A work logged again after it was removed counts its reader once
+        pairs = np.unique(shelved_by[kept].astype(np.int64) << 32 | shelved[kept])
+        shelved = (pairs & 0xFFFFFFFF).astype(np.int32)
+        works, counts = np.unique(shelved, return_counts=True)
+        top = np.argsort(-counts, kind='stable')[:k]
+        return [self._doc(int(works[i]), 'readers', int(counts[i])) for i in top]
+
+
+_recommender = None
+_lock = threading.Lock()
+
+
+def get_recommender():
+    """This process's recommender, refreshed from disk."""
+    global _recommender
+    with _lock:
+        index_dir = Path(settings.RECOMMENDER_INDEX_DIR)
+        if _recommender is None or _recommender.index_dir != index_dir:
+            _recommender = Recommender(index_dir)
+        else:
+            _recommender = _recommender.refreshed()
+        return _recommender
+
+
+def record_books(books, removed=False):
+    """Append newly shelved (or with ``removed``, unshelved) books to the delta log read by every process."""
+    extra = {'removed': True} if removed else {}
+    _append_log({'title': book.title, 'author': book.author, 'user': book.user_id, **extra} for book in books)
+
+
+def record_removed_users(user_ids):
+    """Log deleted users, so their shelves stop counting before the next build."""
+    _append_log({'user': user_id, 'removed': True} for user_id in user_ids)
+
+
+def _append_log(rows):
+    index_dir = Path(settings.RECOMMENDER_INDEX_DIR)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    lines = ''.join(json.dumps(row) + '\n' for row in rows)
+    # One append per call keeps concurrent writers' lines whole
+    with open(index_dir / DELTA_LOG, 'a', encoding='utf-8') as f:
+        f.write(lines)
+
+
+def build_index(rows, index_dir=None):
+    """Build and save a full index from ``(title, author, user_id)`` rows."""
+    index_dir = Path(index_dir or settings.RECOMMENDER_INDEX_DIR)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    log = index_dir / DELTA_LOG
+    # Books logged after this point may be missing from ``rows``; they are
+    # replayed from the log on top of the new version.
+    log_offset = log.stat().st_size if log.exists() else 0
+    builder = IndexBuilder()
+    for title, author, user_id in rows:
+        builder.add(title, author, user_id)
+    builder.save(index_dir, log_offset)
+    return builder
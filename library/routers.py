@@ -0,0 +1,106 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from .sharding import SHARDED_MODELS, is_sharded, shard_for_user
+
+# Set per request by middleware.ReplicaRoutingMiddleware
+_replica_reads = ContextVar('library_replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Route ORM reads inside the block to a read replica, if any are configured."""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _same_database(a, b):
+    return all(a.get(key) == b.get(key) for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+def active_replicas():
+    """
+    The configured replicas, minus any that point at the primary's own
+    database (as test mirrors do): reading through those only opens a second
+    connection, which can't see the primary connection's uncommitted rows.
+    """
+    primary = connections['default'].settings_dict
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if alias not in connections.settings
+        or not _same_database(connections[alias].settings_dict, primary)
+    ]
+
+
+class PrimaryReplicaRouter:
+    """
+    Send writes to ``default`` and, inside ``replica_reads()``, reads to one
+    of ``settings.DATABASE_REPLICAS``. Replicas are populated by the
+    database's own replication, so nothing is migrated on them.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            replicas = active_replicas()
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primary and replicas hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class BookShardRouter:
+    """
+    Route sharded models to their user's shard. Needs a hint: a model
+    instance (``save()``/``delete()``) or the user behind a related manager
+    (``user.books``). Unhinted queries should use ``Book.objects.for_user()``.
+    With a single shard this router stays out of the way.
+    """
+
+    def _user_id(self, model, hints):
+        if not is_sharded() or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, model):
+            return instance.user_id
+        if instance is not None and instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+            return instance.pk
+        return None
+
+    def db_for_read(self, model, **hints):
+        user_id = self._user_id(model, hints)
+        if user_id is None:
+            return None
+        # Only writes assign a shard; see BookQuerySet.for_user()
+        return shard_for_user(user_id, assign=False) or 'default'
+
+    def db_for_write(self, model, **hints):
+        user_id = self._user_id(model, hints)
+        return shard_for_user(user_id) if user_id is not None else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels & SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in settings.BOOK_SHARDS:
+            return None
+        # Shard-only databases hold nothing but the sharded tables
+        return f'{app_label}.{model_name}' in SHARDED_MODELS
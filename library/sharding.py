@@ -0,0 +1,229 @@
+"""
+Horizontal sharding of per-user book data across ``settings.BOOK_SHARDS``.
+
+A user's shard is picked once with a jump consistent hash of the user id and
+recorded in ``ShardAssignment`` on the default database, so adding shards
+never silently moves existing users; ``manage.py rebalance_shards`` moves
+them explicitly. Lookups are cached for ``BOOK_SHARD_CACHE_TIMEOUT`` seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+# Models whose rows live on the shard of their ``user``
+SHARDED_MODELS = {
+    'library.book', 'library.archivedbook', 'library.bookquiz',
+    'library.bookstatusevent', 'library.bookstatusdaily',
+}
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach) of an integer key into ``buckets``."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def is_sharded():
+    return len(settings.BOOK_SHARDS) > 1
+
+
+def placement_for_user(user_id):
+    """The shard a new user is placed on, before any rebalancing."""
+    from .models import Book
+
+    # Users from before sharding was enabled keep their books where they are
+    if Book.objects.using('default').filter(user_id=user_id).exists():
+        return 'default'
+    shards = settings.BOOK_SHARDS
+    return shards[jump_hash(int(user_id), len(shards))]
+
+
+def shard_cache_key(user_id):
+    return f'library:book-shard:{user_id}'
+
+
+def shard_for_user(user_id, assign=True):
+    """
+    Database alias holding ``user_id``'s books. Users without a recorded
+    shard are assigned one, or get None when ``assign`` is False.
+    """
+    shards = settings.BOOK_SHARDS
+    if len(shards) == 1:
+        return shards[0]
+
+    key = shard_cache_key(user_id)
+    alias = cache.get(key)
+    if alias is None:
+        from .models import ShardAssignment
+
+        alias = ShardAssignment.objects.using('default').filter(
+            user_id=user_id,
+        ).values_list('shard', flat=True).first()
+        if alias is None:
+            if not assign:
+                return None
+            alias = ShardAssignment.objects.using('default').get_or_create(
+                user_id=user_id, defaults={'shard': placement_for_user(user_id)},
+            )[0].shard
+        cache.set(key, alias, settings.BOOK_SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def set_shard_for_user(user_id, alias):
+    """Point ``user_id`` at ``alias``. Other processes see it within the cache timeout."""
+    from .models import ShardAssignment
+
+    ShardAssignment.objects.using('default').update_or_create(
+        user_id=user_id, defaults={'shard': alias},
+    )
+    cache.delete(shard_cache_key(user_id))
+
+
+
+class _UserRowMover:
+    """Copies one sharded model's rows for a user between two shards."""
+
+    def __init__(self, model, user_id, source, target, batch_size):
+        self.model = model
+        self.user_id = user_id
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key]
+        self.copied = {}
+        self.id_map = {}
+        # Columns holding ids of another mover's rows, mapped through its id_map
+        self.remap = {}
+
+    def _source_rows(self):
+        rows = self.model.objects.using(self.source).filter(user_id=self.user_id)
+        return {row['id']: row for row in rows.values('id', *self.fields).iterator()}
+
+    def _values(self, row):
+        values = {name: row[name] for name in self.fields}
+        for name, id_map in self.remap.items():
+            values[name] = id_map.get(values[name])
+        return values
+
+    def _insert(self, rows):
+        rows = list(rows)
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            created = self.model.objects.using(self.target).bulk_create(
+                [self.model(**self._values(row)) for row in batch]
+            )
+            self.id_map.update(zip((row['id'] for row in batch), (obj.pk for obj in created)))
+
+    def copy(self):
+        self.copied = self._source_rows()
+        self._insert(self.copied.values())
+
+    def replay(self):
+        """Apply source writes made since copy(); returns the final row count."""
+        current = self._source_rows()
+        self._insert(row for row_id, row in current.items() if row_id not in self.id_map)
+        target_rows = self.model.objects.using(self.target)
+        for row_id, row in current.items():
+            if row_id in self.copied and row != self.copied[row_id]:
+                target_rows.filter(pk=self.id_map[row_id]).update(**self._values(row))
+        removed = [self.id_map[row_id] for row_id in self.copied if row_id not in current]
+        target_rows.filter(pk__in=removed).delete()
+        return len(current)
+
+    def delete_source(self):
+        self.model.objects.using(self.source).filter(user_id=self.user_id).delete()
+
+
+def move_user(user_id, target, settle_seconds=None, batch_size=1000):
+    """
+    Move ``user_id``'s rows of every sharded model to the ``target`` shard
+    while the site is live.
+
+    Rows are copied, the user's assignment is flipped, and after
+    ``settle_seconds`` (long enough for cached assignments in other
+    processes to expire) any writes that still landed on the old shard are
+    replayed onto the new one before the old rows are deleted. Moved rows
+    get new ids on the target shard, and status events follow their books'
+    ids (events of books deleted before the move lose theirs). Returns the
+    number of rows moved.
+    """
+    import time
+
+    from django.apps import apps
+    from django.db import transaction
+
+    if target not in settings.BOOK_SHARDS:
+        raise ValueError(f'Unknown shard {target!r}')
+    source = shard_for_user(user_id)
+    if source == target:
+        return 0
+    if settle_seconds is None:
+        settle_seconds = settings.BOOK_SHARD_CACHE_TIMEOUT
+
+    movers = {
+        label: _UserRowMover(apps.get_model(label), user_id, source, target, batch_size)
+        for label in sorted(SHARDED_MODELS)
+    }
+    # Status events refer to books by id; books are copied first (sorted
+    # order), so the events can take their new ids
+    movers['library.bookstatusevent'].remap['book_id'] = movers['library.book'].id_map
+    movers = list(movers.values())
+    with transaction.atomic(using=target):
+        for mover in movers:
+            mover.copy()
+
+    set_shard_for_user(user_id, target)
+    if settle_seconds:
+        time.sleep(settle_seconds)
+
+    # Replay what stale processes wrote to the source since the copy
+    with transaction.atomic(using=target):
+        moved = sum(mover.replay() for mover in movers)
+    with transaction.atomic(using=source):
+        for mover in movers:
+            mover.delete_source()
+    return moved
+
+
+def plan_rebalance(tolerance=0.1):
+    """
+    Greedy list of ``(user_id, source, target)`` moves that bring every
+    shard's book count within ``tolerance`` of the mean.
+    """
+    from django.db.models import Count
+
+    from .models import Book, ShardAssignment
+
+    assigned = dict(ShardAssignment.objects.using('default').values_list('user_id', 'shard'))
+    users = {alias: {} for alias in settings.BOOK_SHARDS}
+    for alias in settings.BOOK_SHARDS:
+        counts = Book.objects.using(alias).values('user_id').annotate(n=Count('id'))
+        for row in counts.values_list('user_id', 'n'):
+            # Only move users whose assignment matches where their books are
+            if assigned.get(row[0], 'default') == alias:
+                users[alias][row[0]] = row[1]
+
+    totals = {alias: sum(counts.values()) for alias, counts in users.items()}
+    mean = sum(totals.values()) / len(totals)
+    moves = []
+    while True:
+        source = max(totals, key=totals.get)
+        target = min(totals, key=totals.get)
+        gap = totals[source] - totals[target]
+        if gap <= max(1, tolerance * mean):
+            break
+        # Biggest user that doesn't overshoot the midpoint
+        candidates = [(n, uid) for uid, n in users[source].items() if n <= gap / 2]
+        if not candidates:
+            break
+        n, user_id = max(candidates)
+        moves.append((user_id, source, target))
+        del users[source][user_id]
+        users[target][user_id] = n
+        totals[source] -= n
+        totals[target] += n
+    return moves
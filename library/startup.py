@@ -0,0 +1,83 @@
+"""
+Per-process warm-up, so a fresh worker's first requests don't pay for it.
+
+With ``STARTUP_WARMUP`` on, the WSGI/ASGI entry points call ``warm_up``
+once the apps are loaded, so management commands (migrate, collectstatic)
+don't pay for it. It compiles the project's templates into the cached
+template loader and loads the URLconf, and with it the views. Under WSGI
+it also opens the database connections; an ASGI server runs sync views
+in other threads, which would never use them.
+
+``manage.py benchmark startup`` measures the effect.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.template import TemplateSyntaxError, engines
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def project_templates():
+    """``(engine, template names)`` for the templates of this project, not of installed packages."""
+    base = Path(settings.BASE_DIR).resolve()
+    for engine in engines.all():
+        names = set()
+        for directory in engine.template_dirs:
+            directory = Path(directory).resolve()
+            if not directory.is_relative_to(base) or 'site-packages' in directory.parts:
+                continue
+            names.update(path.relative_to(directory).as_posix() for path in directory.rglob('*.html'))
+        yield engine, sorted(names)
+
+
+def warm_templates():
+    """Compile the project's templates; returns how many were compiled."""
+    compiled = 0
+    for engine, names in project_templates():
+        for name in names:
+            try:
+                # The cached loader keeps the compiled template for the process
+                engine.get_template(name)
+            except TemplateSyntaxError:
+                logger.exception('Template %s does not compile', name)
+            else:
+                compiled += 1
+    return compiled
+
+
+def open_connections():
+    """
+    Connect to every configured database; returns the aliases connected.
+    Only a worker that serves requests from the thread that ran this (a
+    sync WSGI worker) reuses them, for up to CONN_MAX_AGE.
+    """
+    opened = []
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning('Could not connect to database %r at startup', alias, exc_info=True)
+        else:
+            opened.append(alias)
+    return opened
+
+
+def warm_urls():
+    """Import the URLconf and its views and build the URL lookup tables."""
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+
+
+def warm_up(databases=True):
+    start = time.perf_counter()
+    templates = warm_templates()
+    warm_urls()
+    opened = open_connections() if databases else []
+    logger.info('Compiled %d templates, loaded the URLconf and opened %d database connections in %.0fms',
+                templates, len(opened), (time.perf_counter() - start) * 1000)
@@ -1,4 +1,5 @@
-// AJAX functionality for updating book status and deleting books
+// AJAX functionality for updating book status and deleting books, and
+// live updates of the dashboard as the shelf changes
 
 document.addEventListener('DOMContentLoaded', function() {
     
@@ -20,104 +21,252 @@ document.addEventListener('DOMContentLoaded', function() {
     
     const csrftoken = getCookie('csrftoken');
     
-    // Update book status
-    const statusLinks = document.querySelectorAll('.update-status');
-    statusLinks.forEach(link => {
-        link.addEventListener('click', function(e) {
-            e.preventDefault();
-            
-            const bookId = this.dataset.bookId;
-            const newStatus = this.dataset.status;
-            const card = this.closest('.book-card');
-            
+    const bookList = document.getElementById('book-list');
+    
+    function badgeClass(status) {
+        if (status === 'Reading') {
+            return 'bg-warning';
+        } else if (status === 'Completed') {
+            return 'bg-success';
+        }
+        return 'bg-info';
+    }
+    
+    function setBadge(card, status) {
+        const badge = card.querySelector('.badge');
+        badge.textContent = status;
+        badge.className = 'badge';
+        badge.classList.add(badgeClass(status));
+    }
+    
+    // Live updates: the server streams this user's shelf changes, applied
+    // below without reloading. Without a stream (e.g. not served over ASGI)
+    // the page reloads after each change instead.
+    let liveUpdates = null;
+    let lastEventToken = null;
+    let lastEventSeq = 0;
+    
+    function streamOpen() {
+        return liveUpdates !== null && liveUpdates.readyState === EventSource.OPEN;
+    }
+    
+    function reloadSoon() {
+        if (!streamOpen()) {
+            setTimeout(() => {
+                location.reload();
+            }, 1000);
+        }
+    }
+    
+    function adjustStat(name, delta) {
+        document.querySelectorAll(`[data-stat="${name}"]`).forEach(element => {
+            element.textContent = parseInt(element.textContent, 10) + delta;
+        });
+    }
+    
+    function adjustStats(status, delta) {
+        adjustStat('total', delta);
+        adjustStat(status.toLowerCase(), delta);
+        updateProgress();
+    }
+    
+    function updateProgress() {
+        const total = parseInt(document.querySelector('[data-stat="total"]').textContent, 10);
+        const completed = parseInt(document.querySelector('[data-stat="completed"]').textContent, 10);
+        const percentage = total > 0 ? Math.round(completed / total * 1000) / 10 : 0;
+        const bar = document.getElementById('completion-bar');
+        bar.style.width = `${percentage}%`;
+        bar.setAttribute('aria-valuenow', percentage);
+        bar.textContent = `${percentage}% Complete`;
+    }
+    
+    function findCard(bookId) {
+        return bookList.querySelector(`:scope > [data-book-id="${bookId}"]`);
+    }
+    
+    function shownHere(status) {
+        if (bookList.dataset.archived) {
+            return false;
+        }
+        return !bookList.dataset.statusFilter || bookList.dataset.statusFilter === status;
+    }
+    
+    function showEmptyState() {
+        document.getElementById('no-books').classList.toggle('d-none', bookList.children.length > 0);
+    }
+    
+    function insertCard(book) {
+        const column = document.getElementById('book-card-template').content.firstElementChild.cloneNode(true);
+        column.dataset.bookId = book.id;
+        column.dataset.dateAdded = book.date_added;
+        column.querySelector('.card-title').textContent = book.title;
+        column.querySelector('.book-author').textContent = book.author;
+        column.querySelector('.book-date-added').textContent = new Date(book.date_added).toLocaleDateString(
+            'en-US', {month: 'short', day: '2-digit', year: 'numeric'});
+        column.querySelectorAll('[data-status], .delete-book').forEach(element => {
+            element.dataset.bookId = book.id;
+        });
+        setBadge(column, book.status);
+        
+        // Newest first, as the dashboard lists them
+        const added = Date.parse(book.date_added);
+        const next = Array.from(bookList.children).find(other => Date.parse(other.dataset.dateAdded) < added);
+        bookList.insertBefore(column, next || null);
+        showEmptyState();
+    }
+    
+    function removeCard(bookId) {
+        const column = findCard(bookId);
+        if (column) {
+            column.remove();
+            showEmptyState();
+        }
+    }
+    
+    function applyEvent(event) {
+        const book = event.book;
+        if (event.type === 'book.added') {
+            adjustStats(book.status, 1);
+            if (shownHere(book.status) && !findCard(book.id)) {
+                insertCard(book);
+            }
+        } else if (event.type === 'book.updated') {
+            if (event.old_status !== book.status) {
+                adjustStat(event.old_status.toLowerCase(), -1);
+                adjustStat(book.status.toLowerCase(), 1);
+                updateProgress();
+            }
+            const column = findCard(book.id);
+            if (!shownHere(book.status)) {
+                removeCard(book.id);
+            } else if (column) {
+                column.querySelector('.card-title').textContent = book.title;
+                column.querySelector('.card-subtitle').textContent = `by ${book.author}`;
+                setBadge(column, book.status);
+            } else {
+                insertCard(book);
+            }
+        } else if (event.type === 'book.deleted') {
+            adjustStats(book.status, -1);
+            removeCard(book.id);
+        } else {
+            // shelf.changed after a bulk import, or resync when changes were missed
+            liveUpdates.close();
+            location.reload();
+        }
+    }
+    
+    if (bookList && window.EventSource) {
+        liveUpdates = new EventSource(bookList.dataset.eventsUrl);
+        liveUpdates.onmessage = function(message) {
+            const event = JSON.parse(message.data);
+            if (event.type === 'resync' || event.type === 'shelf.changed') {
+                applyEvent(event);
+                return;
+            }
+            // Ids are "<token>-<number>" (or just the number): the number
+            // increases, and restarts when the server's token changes. A
+            // replay can repeat events, so older ones are skipped.
+            const id = message.lastEventId;
+            const dash = id.lastIndexOf('-');
+            const token = dash === -1 ? '' : id.slice(0, dash);
+            const seq = parseInt(id.slice(dash + 1), 10);
+            if (token !== lastEventToken) {
+                lastEventToken = token;
+                lastEventSeq = 0;
+            }
+            if (seq <= lastEventSeq) {
+                return;
+            }
+            lastEventSeq = seq;
+            applyEvent(event);
+        };
+    }
+    
+    // Update book status (delegated, so cards added live work too)
+    document.addEventListener('click', function(e) {
+        const link = e.target.closest('.update-status');
+        if (!link) {
+            return;
+        }
+        e.preventDefault();
+        
+        const bookId = link.dataset.bookId;
+        const newStatus = link.dataset.status;
+        const card = link.closest('.book-card');
+        
+        // Send AJAX request
+        fetch(`/update/${bookId}/`, {
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': csrftoken,
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+            body: `status=${newStatus}`
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                setBadge(card, newStatus);
+                
+                // Show success message
+                showAlert('success', data.message);
+                
+                // The live update fixes the statistics; otherwise reload
+                reloadSoon();
+            } else {
+                showAlert('danger', 'Failed to update book status.');
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showAlert('danger', 'An error occurred while updating the book.');
+        });
+    });
+    
+    // Delete book
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('.delete-book');
+        if (!button) {
+            return;
+        }
+        const bookId = button.dataset.bookId;
+        const card = button.closest('.book-card');
+        const bookTitle = card.querySelector('.card-title').textContent;
+        
+        // Confirm deletion
+        if (confirm(`Are you sure you want to delete "${bookTitle}"?`)) {
             // Send AJAX request
-            fetch(`/update/${bookId}/`, {
+            fetch(`/delete/${bookId}/`, {
                 method: 'POST',
                 headers: {
                     'X-CSRFToken': csrftoken,
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                },
-                body: `status=${newStatus}`
+                }
             })
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    // Update the badge
-                    const badge = card.querySelector('.badge');
-                    badge.textContent = newStatus;
-                    
-                    // Update badge color
-                    badge.className = 'badge';
-                    if (newStatus === 'Reading') {
-                        badge.classList.add('bg-warning');
-                    } else if (newStatus === 'Completed') {
-                        badge.classList.add('bg-success');
-                    } else {
-                        badge.classList.add('bg-info');
-                    }
+                    // Remove the card with animation
+                    card.style.transition = 'opacity 0.3s, transform 0.3s';
+                    card.style.opacity = '0';
+                    card.style.transform = 'scale(0.8)';
                     
-                    // Show success message
-                    showAlert('success', data.message);
-                    
-                    // Reload page after 1 second to update statistics
                     setTimeout(() => {
-                        location.reload();
-                    }, 1000);
+                        removeCard(bookId);
+                        showAlert('success', data.message);
+                        
+                        // The live update fixes the statistics; otherwise reload
+                        reloadSoon();
+                    }, 300);
                 } else {
-                    showAlert('danger', 'Failed to update book status.');
+                    showAlert('danger', 'Failed to delete book.');
                 }
             })
             .catch(error => {
                 console.error('Error:', error);
-                showAlert('danger', 'An error occurred while updating the book.');
+                showAlert('danger', 'An error occurred while deleting the book.');
             });
-        });
-    });
-    
-    // Delete book
-    const deleteButtons = document.querySelectorAll('.delete-book');
-    deleteButtons.forEach(button => {
-        button.addEventListener('click', function() {
-            const bookId = this.dataset.bookId;
-            const card = this.closest('.book-card');
-            const bookTitle = card.querySelector('.card-title').textContent;
-            
-            // Confirm deletion
-            if (confirm(`Are you sure you want to delete "${bookTitle}"?`)) {
-                // Send AJAX request
-                fetch(`/delete/${bookId}/`, {
-                    method: 'POST',
-                    headers: {
-                        'X-CSRFToken': csrftoken,
-                    }
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        // Remove the card with animation
-                        card.style.transition = 'opacity 0.3s, transform 0.3s';
-                        card.style.opacity = '0';
-                        card.style.transform = 'scale(0.8)';
-                        
-                        setTimeout(() => {
-                            card.closest('.col-md-6').remove();
-                            showAlert('success', data.message);
-                            
-                            // Reload page to update statistics
-                            setTimeout(() => {
-                                location.reload();
-                            }, 1000);
-                        }, 300);
-                    } else {
-                        showAlert('danger', 'Failed to delete book.');
-                    }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    showAlert('danger', 'An error occurred while deleting the book.');
-                });
-            }
-        });
+        }
     });
     
     // Helper function to show alerts
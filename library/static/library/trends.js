@@ -0,0 +1,39 @@
+// Monthly reading trends chart on the dashboard
+
+document.addEventListener('DOMContentLoaded', function() {
+    
+    const chart = document.getElementById('reading-trends');
+    if (!chart) {
+        return;
+    }
+    
+    function bar(value, max, color, label) {
+        const div = document.createElement('div');
+        div.className = color;
+        div.style.width = '45%';
+        div.style.height = `${max ? (value / max) * 100 : 0}%`;
+        div.title = `${value} ${label}`;
+        return div;
+    }
+    
+    fetch(chart.dataset.url)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                return;
+            }
+            
+            const max = Math.max(1, ...data.periods.map(p => Math.max(p.added, p.completed)));
+            data.periods.forEach(period => {
+                const column = document.createElement('div');
+                column.className = 'd-flex align-items-end justify-content-center flex-fill h-100';
+                column.title = period.period.slice(0, 7);
+                column.appendChild(bar(period.added, max, 'bg-primary', 'added'));
+                column.appendChild(bar(period.completed, max, 'bg-success', 'completed'));
+                chart.appendChild(column);
+            });
+        })
+        .catch(error => {
+            console.error('Error:', error);
+        });
+});
@@ -0,0 +1,24 @@
+"""
+Test runner that keeps test runs from writing into the working tree.
+
+Books created by the tests are appended to the recommender's delta log, so
+``RECOMMENDER_INDEX_DIR`` points at a temporary directory for the run.
+"""
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._index_dir = tempfile.mkdtemp(prefix='recommender-')
+        self._settings = override_settings(RECOMMENDER_INDEX_DIR=self._index_dir)
+        self._settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings.disable()
+        shutil.rmtree(self._index_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
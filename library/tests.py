@@ -1,6 +1,53 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from urllib.parse import urlencode
+from unittest import mock, skipUnless
+
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.apps import apps
+from django.conf import settings
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
-from .models import Book, Profile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.utils import timezone
+from .ai_client import PROBE_KEY, AIError
+from .ai_output import QUIZ, RECOMMENDATIONS, ItemParser, parse_items
+from .analytics import TopCounter
+from .backends import user_cache_key
+from .fake_ai import FakeAIServer
+from .live import DatabaseBroker, InProcessBroker, get_broker
+from .loadtest import check_slos, parse_mix
+from .middleware import PIN_COOKIE, ReplicaRoutingMiddleware
+from .models import (
+    ArchivedBook, Book, BookQuiz, BookStatusDaily, BookStatusEvent, LiveEvent, Profile, ShardAssignment,
+)
+from .paginators import EstimatedCountPaginator
+from .quizzes import generate_quizzes, pack_batches
+from .recommender import build_index, get_recommender, record_books, record_removed_users
+from .routers import BookShardRouter, PrimaryReplicaRouter, replica_reads
+from .sharding import is_sharded, jump_hash, move_user, shard_for_user
+from .startup import open_connections, project_templates, warm_templates
+from .text import book_fingerprint
+from .trends import reading_trends
+
+# The databases that hold books; not '__all__', which takes in the replicas,
+# test mirrors of default whose extra connection deadlocks on its tables
+BOOK_DATABASES = {'default', *settings.BOOK_SHARDS}
 
 
 class BookModelTest(TestCase):
@@ -55,3 +102,1265 @@ class ViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'library/dashboard.html')
 
+
+
+class LoginQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+    
+    def test_login_query_count(self):
+        # One user lookup, the session create/cycle writes and the
+        # last_login update; no profile SELECT/UPDATE, no second lookup.
+        with self.assertNumQueries(9):
+            response = self.client.post('/auth/login/', {
+                'username': 'testuser',
+                'password': 'testpass123',
+            })
+        self.assertEqual(response.status_code, 302)
+    
+    def test_login_does_not_write_profile(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/auth/login/', {'username': 'testuser', 'password': 'testpass123'})
+        self.assertFalse([q for q in ctx.captured_queries if 'library_profile' in q['sql']])
+    
+    def test_profile_view_loads_profile_with_user(self):
+        self.client.login(username='testuser', password='testpass123')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/profile/')
+        self.assertEqual(response.status_code, 200)
+        profile_queries = [q for q in ctx.captured_queries if 'library_profile' in q['sql']]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertIn('auth_user', profile_queries[0]['sql'])
+
+
+class ProfileDirtyTrackingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+    
+    def test_unchanged_profile_is_clean(self):
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.get_dirty_fields(), [])
+    
+    def test_changed_field_is_dirty(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.location = 'Lisbon'
+        self.assertEqual(profile.get_dirty_fields(), ['location'])
+        profile.save()
+        self.assertEqual(profile.get_dirty_fields(), [])
+    
+    def test_user_save_persists_edited_profile_only(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+        user.profile.bio = 'Reader'
+        user.save()
+        self.assertEqual(Profile.objects.get(user=self.user).bio, 'Reader')
+
+
+@override_settings(
+    AUTH_CACHE_ENABLED=True,
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+)
+class AuthCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+    
+    def _auth_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return [q for q in ctx.captured_queries
+                if 'django_session' in q['sql'] or 'auth_user' in q['sql']]
+    
+    def test_cached_request_skips_session_and_user_queries(self):
+        self._auth_queries()
+        self.assertEqual(self._auth_queries(), [])
+    
+    def test_password_change_invalidates_cached_user(self):
+        self._auth_queries()
+        self.user.set_password('newpass456')
+        self.user.save()
+        response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 302)
+    
+    def test_admin_edit_invalidates_cached_user(self):
+        self._auth_queries()
+        User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(len(self._auth_queries()), 1)
+    
+    def test_logout_invalidates_cached_user(self):
+        self._auth_queries()
+        self.client.get('/auth/logout/')
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get('/dashboard/').status_code, 302)
+    
+    def test_requires_shared_cache(self):
+        env = {**os.environ, 'AUTH_CACHE_ENABLED': 'True', 'DJANGO_SETTINGS_MODULE': 'BookShelf.settings'}
+        env.pop('REDIS_URL', None)
+        result = subprocess.run([sys.executable, '-c', 'import django; django.setup()'], cwd=settings.BASE_DIR,
+                                env=env, capture_output=True, text=True)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured: AUTH_CACHE_ENABLED needs REDIS_URL', result.stderr)
+    
+    def test_redis_cache_backend_resolves(self):
+        env = {**os.environ, 'AUTH_CACHE_ENABLED': 'True', 'REDIS_URL': 'redis://127.0.0.1:6379/0',
+               'DJANGO_SETTINGS_MODULE': 'BookShelf.settings'}
+        # Builds the client, which imports redis, without connecting
+        script = ('import django; django.setup(); from django.core.cache import caches; '
+                  'cache = caches["default"]; print(type(cache).__name__, cache._cache._lib.__name__)')
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR,
+                                env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), 'RedisCache redis')
+
+
+class ReplicaRoutingTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+    
+    def _route_through_middleware(self, request, write_to=None):
+        seen = {}
+        
+        def get_response(request):
+            seen['db'] = self.router.db_for_read(Book)
+            if write_to:
+                Book.objects.using(write_to).filter(pk=0).update(title='x')
+            return HttpResponse()
+        
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return seen['db'], response
+    
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Book), 'replica_test')
+            self.assertEqual(self.router.db_for_write(Book), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_test', 'library'))
+    
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_router_without_replicas(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+    
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_get_reads_from_replica(self):
+        db, response = self._route_through_middleware(self.factory.get('/dashboard/'))
+        self.assertEqual(db, 'replica_test')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+    
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_write_pins_client_to_primary(self):
+        db, response = self._route_through_middleware(self.factory.post('/add/'))
+        self.assertEqual(db, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        
+        request = self.factory.get('/dashboard/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        db, _ = self._route_through_middleware(request)
+        self.assertEqual(db, 'default')
+    
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_get_that_writes_pins_client_to_primary(self):
+        # e.g. GET /auth/logout/ deleting the session
+        db, response = self._route_through_middleware(self.factory.get('/auth/logout/'), write_to='default')
+        self.assertEqual(db, 'replica_test')
+        self.assertIn(PIN_COOKIE, response.cookies)
+    
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_shard_write_pins_client_to_primary(self):
+        _, response = self._route_through_middleware(self.factory.get('/dashboard/'), write_to=settings.BOOK_SHARDS[-1])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+
+class ShardMapTest(TestCase):
+    def test_jump_hash_is_deterministic_and_in_range(self):
+        placements = [jump_hash(user_id, 4) for user_id in range(1000)]
+        self.assertEqual(placements, [jump_hash(user_id, 4) for user_id in range(1000)])
+        self.assertEqual(set(placements), {0, 1, 2, 3})
+    
+    def test_jump_hash_moves_few_keys_when_a_bucket_is_added(self):
+        moved = sum(jump_hash(key, 4) != jump_hash(key, 5) for key in range(10000))
+        # Ideally 1/5 of the keys move, all of them to the new bucket
+        self.assertLess(moved, 2500)
+        self.assertTrue(all(jump_hash(key, 5) == 4 for key in range(10000)
+                            if jump_hash(key, 4) != jump_hash(key, 5)))
+    
+    @override_settings(BOOK_SHARDS=['default'])
+    def test_single_shard_defers_to_other_routers(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        book = Book.objects.create(title='T', author='A', user=user)
+        self.assertIsNone(BookShardRouter().db_for_write(Book, instance=book))
+        self.assertFalse(ShardAssignment.objects.exists())
+    
+    @override_settings(BOOK_SHARDS=['default', 'books_test'])
+    def test_assignment_is_recorded_and_routed(self):
+        cache.clear()
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        shard = shard_for_user(user.pk)
+        self.assertEqual(ShardAssignment.objects.get(user=user).shard, shard)
+        router = BookShardRouter()
+        self.assertEqual(router.db_for_read(Book, instance=user), shard)
+        self.assertEqual(router.db_for_write(Book, instance=Book(user=user)), shard)
+        self.assertIsNone(router.db_for_read(Book))
+        self.assertFalse(router.allow_migrate('books_test', 'library', 'profile'))
+        self.assertTrue(router.allow_migrate('books_test', 'library', 'book'))
+    
+    @override_settings(BOOK_SHARDS=['default', 'books_test'])
+    def test_reads_do_not_assign_a_shard(self):
+        cache.clear()
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        router = BookShardRouter()
+        self.assertEqual(Book.objects.for_user(user).db, 'default')
+        self.assertEqual(router.db_for_read(Book, instance=user), 'default')
+        self.assertFalse(ShardAssignment.objects.exists())
+        shard = router.db_for_write(Book, instance=Book(user=user))
+        self.assertEqual(ShardAssignment.objects.get(user=user).shard, shard)
+        self.assertEqual(Book.objects.for_user(user).db, shard)
+    
+    @override_settings(BOOK_SHARDS=['default'])
+    def test_existing_users_stay_on_default(self):
+        cache.clear()
+        users = [User.objects.create_user(username=f'user{i}') for i in range(20)]
+        Book.objects.bulk_create([Book(title='T', author='A', user=u) for u in users])
+        with self.settings(BOOK_SHARDS=['default', 'books_test']):
+            self.assertEqual({shard_for_user(u.pk) for u in users}, {'default'})
+
+
+@skipUnless(len(settings.BOOK_SHARDS) > 1, 'needs BOOK_SHARD_URLS')
+class ShardedBooksTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.shard = shard_for_user(self.user.pk)
+    
+    def test_views_use_the_users_shard(self):
+        self.client.post('/add/', {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'Planned'})
+        book = Book.objects.using(self.shard).get(user=self.user)
+        self.assertEqual(self.client.post(f'/update/{book.id}/', {'status': 'Reading'}).status_code, 200)
+        self.assertEqual(self.user.books.get().status, 'Reading')
+        self.assertEqual(self.client.get('/dashboard/').context['total_books'], 1)
+        self.assertEqual(self.client.post(f'/delete/{book.id}/').status_code, 200)
+        self.assertFalse(Book.objects.for_user(self.user).exists())
+    
+    def test_move_user(self):
+        Book.objects.bulk_create([Book(title=f'B{i}', author='A', user=self.user) for i in range(5)])
+        target = next(alias for alias in settings.BOOK_SHARDS if alias != self.shard)
+        self.assertEqual(move_user(self.user.pk, target, settle_seconds=0), 5)
+        self.assertEqual(shard_for_user(self.user.pk), target)
+        self.assertEqual(Book.objects.using(target).filter(user=self.user).count(), 5)
+        self.assertFalse(Book.objects.using(self.shard).filter(user=self.user).exists())
+    
+    def test_move_user_keeps_events_on_their_books(self):
+        Book.objects.create(title='Kept', author='A', user=self.user)
+        Book.objects.create(title='Deleted', author='A', user=self.user).delete()
+        target = next(alias for alias in settings.BOOK_SHARDS if alias != self.shard)
+        move_user(self.user.pk, target, settle_seconds=0)
+        
+        moved = Book.objects.using(target).get(user=self.user)
+        events = BookStatusEvent.objects.using(target).filter(user=self.user).order_by('created_at', 'id')
+        self.assertEqual(
+            [(event.book_id, event.old_status, event.new_status) for event in events],
+            [(moved.pk, '', 'Planned'), (None, '', 'Planned'), (None, 'Planned', '')],
+        )
+    
+    def test_user_delete_cascades_to_shard(self):
+        Book.objects.create(title='T', author='A', user=self.user)
+        self.user.delete()
+        self.assertFalse(Book.objects.using(self.shard).exists())
+
+
+class ArchiveBooksTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        old = timezone.now() - timedelta(days=400)
+        Book.objects.bulk_create([
+            Book(title='Old done', author='A', status='Completed', date_added=old, user=self.user),
+            Book(title='Old reading', author='A', status='Reading', date_added=old, user=self.user),
+            Book(title='New done', author='A', status='Completed', user=self.user),
+        ])
+    
+    def test_archive_moves_only_old_completed_books(self):
+        call_command('archive_books', days=365, batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(Book.objects.values_list('title', flat=True)), ['New done', 'Old reading'],
+        )
+        archived = ArchivedBook.objects.get()
+        self.assertEqual((archived.title, archived.user), ('Old done', self.user))
+    
+    def test_dashboard_stats_span_both_tiers(self):
+        call_command('archive_books', days=365, stdout=StringIO())
+        self.client.login(username='testuser', password='testpass123')
+        
+        response = self.client.get('/dashboard/')
+        self.assertEqual(response.context['total_books'], 3)
+        self.assertEqual(response.context['completed_books'], 2)
+        self.assertEqual(len(response.context['books']), 2)
+        
+        response = self.client.get('/dashboard/?archived=1')
+        self.assertEqual([b.title for b in response.context['books']], ['Old done'])
+
+
+class RecommenderTest(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_dir.cleanup)
+        settings_override = override_settings(RECOMMENDER_INDEX_DIR=self.index_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        build_index([
+            ('Dune', 'Frank Herbert', 1),
+            ('Dune Messiah', 'Frank Herbert', 1),
+            ('Foundation', 'Isaac Asimov', 1),
+            ('Dune', 'Frank Herbert', 2),
+            ('Foundation', 'Isaac Asimov', 2),
+            ('Emma', 'Jane Austen', 3),
+        ])
+    
+    def test_similar_ranks_by_title_and_author(self):
+        titles = [match['title'] for match in get_recommender().similar('dune frank herbert', k=2)]
+        self.assertEqual(titles, ['Dune', 'Dune Messiah'])
+    
+    def test_also_shelved_counts_readers(self):
+        recommender = get_recommender()
+        also = recommender.also_shelved(recommender.lookup('DUNE', 'Frank  Herbert'))
+        self.assertEqual(
+            [(match['title'], match['readers']) for match in also],
+            [('Foundation', 2), ('Dune Messiah', 1)],
+        )
+    
+    def test_logged_books_are_picked_up_without_rebuild(self):
+        get_recommender()
+        user = User.objects.create_user(username='reader', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Children of Dune', author='Frank Herbert', user=user)
+        record_books([Book(title='Dune', author='Frank Herbert', user_id=user.pk)])
+        
+        recommender = get_recommender()
+        self.assertIn('Children of Dune', [m['title'] for m in recommender.similar('children of dune')])
+        also = recommender.also_shelved(recommender.lookup('Dune', 'Frank Herbert'))
+        self.assertIn(('Children of Dune', 1), [(m['title'], m['readers']) for m in also])
+    
+    def test_refresh_replaces_the_recommender(self):
+        old = get_recommender()
+        record_books([Book(title='Children of Dune', author='Frank Herbert', user_id=2)])
+        record_books([Book(title='Emma', author='Jane Austen', user_id=3)], removed=True)
+        
+        new = get_recommender()
+        self.assertIsNot(new, old)
+        self.assertIsNotNone(new.lookup('Children of Dune', 'Frank Herbert'))
+        # Queries still running on the old one see the index as it was
+        self.assertIsNone(old.lookup('Children of Dune', 'Frank Herbert'))
+        self.assertEqual(old.n_docs, 4)
+        self.assertIn('Emma', [m['title'] for m in old.similar('emma jane austen')])
+        self.assertNotIn('Emma', [m['title'] for m in new.similar('emma jane austen')])
+        self.assertIs(get_recommender(), new)
+    
+    def test_removed_books_and_users_are_filtered_out(self):
+        get_recommender()
+        record_books([Book(title='Foundation', author='Isaac Asimov', user_id=2)], removed=True)
+        record_removed_users([3])
+        
+        recommender = get_recommender()
+        also = recommender.also_shelved(recommender.lookup('Dune', 'Frank Herbert'))
+        self.assertEqual([(m['title'], m['readers']) for m in also], [('Dune Messiah', 1), ('Foundation', 1)])
+        # Nobody shelves Emma any more
+        self.assertNotIn('Emma', [m['title'] for m in recommender.similar('emma jane austen')])
+        self.assertEqual(recommender.also_shelved(recommender.lookup('Emma', 'Jane Austen')), [])
+        
+        record_books([Book(title='Foundation', author='Isaac Asimov', user_id=2)])
+        also = get_recommender().also_shelved(recommender.lookup('Dune', 'Frank Herbert'))
+        self.assertEqual(also[0], {'title': 'Foundation', 'author': 'Isaac Asimov', 'readers': 2})
+    
+    def test_deleted_book_leaves_the_index(self):
+        user = User.objects.create_user(username='reader', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title='Children of Dune', author='Frank Herbert', user=user)
+        self.assertIn('Children of Dune', [m['title'] for m in get_recommender().similar('children of dune')])
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertNotIn('Children of Dune', [m['title'] for m in get_recommender().similar('children of dune')])
+    
+    def test_deleting_one_of_two_copies_keeps_the_work(self):
+        user = User.objects.create_user(username='reader', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Book.objects.create(title='Children of Dune', author='Frank Herbert', user=user)
+            second = Book.objects.create(title='children of dune', author='Frank Herbert', user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertIn('Children of Dune', [m['title'] for m in get_recommender().similar('children of dune')])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertNotIn('Children of Dune', [m['title'] for m in get_recommender().similar('children of dune')])
+    
+    def test_similar_endpoint_excludes_the_book_itself(self):
+        self.assertEqual(self.client.get('/ai/similar/', {'title': 'Dune'}).status_code, 302)
+        User.objects.create_user(username='reader', password='testpass123')
+        self.client.login(username='reader', password='testpass123')
+        response = self.client.get('/ai/similar/', {'title': 'Dune', 'author': 'Frank Herbert', 'k': 3})
+        data = response.json()
+        self.assertEqual(data['similar'][0]['title'], 'Dune Messiah')
+        self.assertEqual(data['also_shelved'][0]['title'], 'Foundation')
+        self.assertEqual(self.client.get('/ai/similar/').status_code, 400)
+    
+    @override_settings(OPENAI_API_KEY='test-key')
+    def test_recommend_falls_back_to_local_index_on_timeout(self):
+        with mock.patch('library.ai_client.requests.post', side_effect=requests.exceptions.Timeout):
+            response = self.client.post(
+                '/ai/recommend/', '{"topic": "dune"}', content_type='application/json',
+            )
+        data = response.json()
+        self.assertEqual(data['source'], 'local')
+        self.assertEqual(data['recommendations'][0]['title'], 'Dune')
+
+
+class AiOutputParserTest(TestCase):
+    schemas = {'recommendations': RECOMMENDATIONS, 'quiz': QUIZ}
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(Path(__file__).parent / 'testdata' / 'ai_outputs.json', encoding='utf-8') as f:
+            cls.corpus = json.load(f)
+    
+    def test_corpus(self):
+        for case in self.corpus:
+            with self.subTest(case['name']):
+                self.assertEqual(parse_items(case['output'], self.schemas[case['schema']]), case['expected'])
+    
+    def test_corpus_streamed(self):
+        for case in self.corpus:
+            for size in (1, 7, 64):
+                with self.subTest(case['name'], chunk_size=size):
+                    parser = ItemParser(self.schemas[case['schema']])
+                    output = case['output']
+                    items = []
+                    for i in range(0, len(output), size):
+                        items += parser.feed(output[i:i + size])
+                    self.assertEqual(items + parser.close(), case['expected'])
+    
+    def test_items_are_returned_as_soon_as_complete(self):
+        parser = ItemParser(QUIZ, limit=1)
+        self.assertEqual(parser.feed('[{"question": "Who?", "answer": "Me"}'), [{'question': 'Who?', 'answer': 'Me'}])
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.feed(', {"question": "Why?", "answer": "Because"}]') + parser.close(), [])
+    
+    @override_settings(OPENAI_API_KEY='test-key')
+    def test_quiz_view_parses_model_output(self):
+        content = '```json\n{"questions": [{"question": "Quien wrote it?", "answer": "Cervantes"}]}\n```'
+        api_response = mock.Mock(status_code=200)
+        api_response.json.return_value = {'choices': [{'message': {'content': content}}]}
+        with mock.patch('library.ai_client.requests.post', return_value=api_response) as post:
+            response = self.client.post('/ai/quiz/', json.dumps({
+                'title': 'Don Quixote', 'author': 'Miguel de Cervantes', 'difficulty': 'Easy',
+            }), content_type='application/json')
+        
+        self.assertEqual(post.call_args.kwargs['json']['response_format'], {'type': 'json_object'})
+        questions = response.json()['questions']
+        self.assertEqual(questions[0], {'question': 'Quien wrote it?', 'answer': 'Cervantes'})
+        self.assertEqual(len(questions), 5)
+
+
+@override_settings(
+    OPENAI_API_KEY='test-key', AI_TIMEOUT=0.5, AI_BREAKER_MIN_CALLS=3,
+    AI_BREAKER_COOLDOWN=30, AI_HEDGE_PERCENTILE=0,
+)
+class AIClientTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.upstream = FakeAIServer().start()
+        cls.addClassCleanup(cls.upstream.stop)
+    
+    def setUp(self):
+        self.upstream.reset(content='A short summary.')
+        cache.clear()
+        self.addCleanup(cache.clear)
+        settings_override = override_settings(OPENAI_API_BASE=self.upstream.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def summarize(self, text='Some text'):
+        return self.client.post('/ai/summarize/', json.dumps({'text': text}), content_type='application/json')
+    
+    def test_summarize_through_upstream(self):
+        response = self.summarize()
+        self.assertEqual(response.json()['summary'], 'A short summary.')
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['calls'], 1)
+    
+    def test_breaker_opens_and_fails_fast(self):
+        self.upstream.status = 500
+        for i in range(3):
+            self.assertEqual(self.summarize(f'text {i}').status_code, 503)
+        self.assertEqual(self.upstream.requests, 3)
+        
+        response = self.summarize('text 4')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.upstream.requests, 3)
+        status = self.client.get('/ai/status/').json()['breaker']
+        self.assertEqual((status['state'], status['failure_rate']), ('open', 1.0))
+    
+    @override_settings(AI_BREAKER_SLOW_CALL_SECONDS=0.05)
+    def test_slow_calls_open_the_breaker(self):
+        self.upstream.delay = 0.1
+        for i in range(3):
+            self.assertEqual(self.summarize(f'text {i}').status_code, 200)
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['state'], 'open')
+    
+    def test_cached_answer_served_while_open(self):
+        self.summarize('cached text')
+        self.upstream.status = 503
+        for i in range(3):
+            self.summarize(f'text {i}')
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['state'], 'open')
+        
+        requests_made = self.upstream.requests
+        response = self.summarize('cached text')
+        self.assertEqual(response.json()['summary'], 'A short summary.')
+        self.assertEqual(self.upstream.requests, requests_made)
+    
+    @override_settings(AI_BREAKER_COOLDOWN=0)
+    def test_half_open_probe_closes_breaker(self):
+        self.upstream.status = 500
+        for i in range(3):
+            self.summarize(f'text {i}')
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['state'], 'half-open')
+        
+        self.upstream.status = 200
+        self.assertEqual(self.summarize().status_code, 200)
+        status = self.client.get('/ai/status/').json()['breaker']
+        self.assertEqual((status['state'], status['calls']), ('closed', 0))
+    
+    @override_settings(AI_BREAKER_COOLDOWN=0)
+    def test_malformed_responses_count_as_failures(self):
+        bodies = [{}, {'choices': []}, {'choices': [{'message': {'content': None}}]}, ValueError('Not JSON')]
+        responses = [mock.Mock(status_code=200, json=mock.Mock(side_effect=[body])) for body in bodies]
+        with mock.patch('library.ai_client.requests.post', side_effect=responses):
+            for i in range(3):
+                self.assertEqual(self.summarize(f'text {i}').status_code, 503)
+            self.assertEqual(self.client.get('/ai/status/').json()['breaker']['state'], 'half-open')
+            # The failed probe reopens the breaker and lets the next probe through
+            self.assertEqual(self.summarize('probe').status_code, 503)
+        self.assertIsNone(cache.get(PROBE_KEY))
+        self.assertEqual(self.summarize().status_code, 200)
+    
+    def test_warns_when_breaker_is_per_process(self):
+        app_config = apps.get_app_config('library')
+        with override_settings(DEBUG=False, OPENAI_API_KEY='test-key'):
+            with self.assertLogs('library.apps', 'WARNING') as logs:
+                app_config.ready()
+        self.assertIn('Set REDIS_URL', logs.output[0])
+        with override_settings(DEBUG=True, OPENAI_API_KEY='test-key'), self.assertNoLogs('library.apps'):
+            app_config.ready()
+    
+    def test_timeout_opens_breaker(self):
+        self.upstream.delay = 1
+        for i in range(3):
+            self.assertEqual(self.summarize(f'text {i}').status_code, 503)
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['state'], 'open')
+    
+    @override_settings(AI_HEDGE_PERCENTILE=50, AI_TIMEOUT=5)
+    def test_slow_call_is_hedged(self):
+        for i in range(20):
+            self.summarize(f'warm {i}')
+        self.upstream.delays = [2]
+        
+        start = time.monotonic()
+        response = self.summarize('hedged')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(response.json()['summary'], 'A short summary.')
+        self.assertEqual(self.upstream.requests, 22)
+        self.assertEqual(self.client.get('/ai/status/').json()['breaker']['hedges'], 1)
+
+
+def fake_shelf_quiz(payload, skip=()):
+    """Fake upstream answer with five questions for every numbered book in the prompt."""
+    prompt = payload['messages'][-1]['content']
+    questions = [
+        {'book': int(number), 'question': f'Q{i} about {title}?', 'answer': f'A{i}'}
+        for number, title in re.findall(r'^(\d+)\. "(.+)" by ', prompt, re.MULTILINE)
+        if title not in skip
+        for i in range(5)
+    ]
+    return json.dumps({'questions': questions})
+
+
+@override_settings(OPENAI_API_KEY='test-key', AI_QUIZ_BATCH_TOKENS=1500, AI_QUIZ_CONCURRENCY=4)
+class ShelfQuizTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.upstream = FakeAIServer().start()
+        cls.addClassCleanup(cls.upstream.stop)
+    
+    def setUp(self):
+        self.upstream.reset(content=fake_shelf_quiz)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        settings_override = override_settings(OPENAI_API_BASE=self.upstream.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        Book.objects.bulk_create(
+            [Book(title=f'Book {i}', author=f'Author {i}', status='Reading', user=self.user) for i in range(30)]
+            + [Book(title='Book 0', author='Author 0', status='Reading', user=self.user),
+               Book(title='Done', author='Someone', status='Completed', user=self.user)]
+        )
+        self.client.login(username='testuser', password='testpass123')
+    
+    def shelf_quiz(self, **data):
+        data.setdefault('difficulty', 'Beginner')
+        return self.client.post('/ai/quiz/shelf/', json.dumps(data), content_type='application/json')
+    
+    def test_pack_batches_respects_budget(self):
+        books = [(f'Book {i}', 'Author') for i in range(30)]
+        batches = pack_batches(books, 'Beginner', budget=1500)
+        self.assertEqual([book for batch in batches for book in batch], books)
+        self.assertEqual(len(batches), 6)
+        self.assertEqual(pack_batches([('A' * 10000, 'B')], 'Beginner', budget=1500), [[('A' * 10000, 'B')]])
+    
+    def test_shelf_is_quizzed_in_batches_and_stored(self):
+        data = self.shelf_quiz(status='Reading').json()
+        
+        self.assertEqual(data['calls'], 6)
+        self.assertEqual(self.upstream.requests, 6)
+        self.assertEqual(len(data['quizzes']), 30)
+        quiz = next(q for q in data['quizzes'] if q['title'] == 'Book 7')
+        self.assertEqual(len(quiz['questions']), 5)
+        self.assertEqual(quiz['questions'][0], {'question': 'Q0 about Book 7?', 'answer': 'A0'})
+        self.assertEqual(BookQuiz.objects.filter(user=self.user, difficulty='Beginner').count(), 30)
+        
+        data = self.shelf_quiz(status='Reading').json()
+        self.assertEqual((data['calls'], self.upstream.requests), (0, 6))
+        self.assertTrue(all(quiz['stored'] for quiz in data['quizzes']))
+    
+    def test_refresh_replaces_stored_quizzes(self):
+        self.shelf_quiz(status='Completed')
+        self.upstream.content = lambda payload: fake_shelf_quiz(payload).replace('Q0', 'New Q0')
+        data = self.shelf_quiz(status='Completed', refresh=True).json()
+        
+        self.assertEqual(data['quizzes'][0]['questions'][0]['question'], 'New Q0 about Done?')
+        self.assertEqual(BookQuiz.objects.get(user=self.user).questions[0]['question'], 'New Q0 about Done?')
+    
+    def test_books_the_model_skips_are_retried_once(self):
+        self.upstream.content = lambda payload: fake_shelf_quiz(payload, skip={'Book 3'})
+        data = self.shelf_quiz(status='Reading').json()
+        
+        self.assertEqual(data['calls'], 7)
+        self.assertEqual(data['missing'], [{'title': 'Book 3', 'author': 'Author 3'}])
+        self.assertEqual(len(data['quizzes']), 29)
+    
+    def test_odd_book_numbers(self):
+        def chat(payload):
+            answer = json.loads(fake_shelf_quiz(payload))
+            # Book 1's questions, then Book 2's first
+            for question, book in zip(answer['questions'], ['1e999', 'x', '-1', '99999999', '²', 2.0]):
+                question['book'] = book
+            return json.dumps(answer)
+        
+        books = [(f'Book {i}', 'Author') for i in range(12)]
+        with mock.patch('library.quizzes.ai_client.chat', side_effect=chat):
+            quizzes, calls, error = generate_quizzes(books, 'Beginner')
+        
+        self.assertIsNone(error)
+        # The first book of every batch only got questions with numbers that
+        # name no book; retried, Book 0 is the first of a batch again
+        self.assertEqual(sorted(quizzes), sorted(books[1:]))
+        self.assertEqual({len(questions) for questions in quizzes.values()}, {5})
+        self.assertEqual(calls, 4)
+    
+    def test_unreadable_answers_leave_their_books_out(self):
+        replies = iter(['', 'Sorry, I can only answer questions about books.'])
+        
+        def chat(payload):
+            if 'Book 0' in payload['messages'][-1]['content']:
+                return next(replies)
+            return fake_shelf_quiz(payload)
+        
+        books = [(f'Book {i}', 'Author') for i in range(12)]
+        with mock.patch('library.quizzes.ai_client.chat', side_effect=chat):
+            quizzes, calls, error = generate_quizzes(books, 'Beginner')
+        
+        self.assertIsNone(error)
+        # Books 0-4 got no questions from either of their two tries
+        self.assertEqual(sorted(quizzes), sorted(books[5:]))
+        self.assertEqual(calls, 4)
+    
+    def test_upstream_failure(self):
+        self.upstream.status = 500
+        response = self.shelf_quiz(status='Reading')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(BookQuiz.objects.exists())
+        self.assertEqual(self.shelf_quiz(status='Unknown').status_code, 400)
+
+
+class ReadingTrendsTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+    
+    def rollup(self):
+        row = BookStatusDaily.objects.for_user(self.user).get()
+        return {column: getattr(row, column) for column in ('added', 'removed', 'reading', 'completed', 'planned')}
+    
+    def test_views_log_changes_and_update_rollup(self):
+        self.client.post('/add/', {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'Planned'})
+        book = Book.objects.for_user(self.user).get()
+        self.client.post(f'/update/{book.id}/', {'status': 'Reading'})
+        self.client.post(f'/update/{book.id}/', {'status': 'Completed'})
+        self.client.post(f'/delete/{book.id}/')
+        
+        events = BookStatusEvent.objects.for_user(self.user).order_by('id')
+        self.assertEqual(
+            list(events.values_list('book_id', 'old_status', 'new_status')),
+            [(book.id, '', 'Planned'), (book.id, 'Planned', 'Reading'),
+             (book.id, 'Reading', 'Completed'), (book.id, 'Completed', '')],
+        )
+        self.assertEqual(self.rollup(), {'added': 1, 'removed': 1, 'reading': 1, 'completed': 1, 'planned': 1})
+    
+    def test_unchanged_status_is_not_logged(self):
+        book = Book.objects.create(title='T', author='A', status='Reading', user=self.user)
+        book.title = 'Renamed'
+        book.save()
+        self.client.post(f'/update/{book.id}/', {'status': 'Reading'})
+        self.assertEqual(BookStatusEvent.objects.for_user(self.user).count(), 1)
+    
+    def test_import_logs_each_book_on_its_day(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('username,title,author,status,date_added\n')
+            f.write('testuser,A,X,Completed,2024-01-10T12:00:00\n')
+            f.write('testuser,B,X,Reading,2024-01-10T13:00:00\n')
+            f.write('testuser,C,X,Completed,2024-02-03T12:00:00\n')
+        self.addCleanup(Path(f.name).unlink)
+        call_command('import_books', f.name, batch_size=2, stdout=StringIO())
+        
+        self.assertEqual(BookStatusEvent.objects.for_user(self.user).count(), 3)
+        periods = reading_trends(self.user, days=60, group='month', today=timezone.datetime(2024, 2, 20).date())
+        self.assertEqual([p['period'] for p in periods], ['2023-12-01', '2024-01-01', '2024-02-01'])
+        self.assertEqual([(p['added'], p['completed'], p['reading']) for p in periods], [(0, 0, 0), (2, 1, 1), (1, 1, 0)])
+    
+    def test_backfill_seeds_books_without_events(self):
+        Book.objects.create(title='Logged', author='A', status='Reading', user=self.user)
+        day = timezone.datetime(2024, 1, 10, 12, tzinfo=timezone.utc)
+        # bulk_create logs nothing, like books from before the event log
+        Book.objects.bulk_create([
+            Book(title=f'Old {i}', author='A', status=status, date_added=day, user=self.user)
+            for i, status in enumerate(['Completed', 'Completed', 'Planned'])
+        ])
+        out = StringIO()
+        call_command('backfill_trends', batch_size=2, dry_run=True, stdout=out)
+        self.assertIn('Would seed trends from 3 books.', out.getvalue())
+        self.assertEqual(BookStatusEvent.objects.for_user(self.user).count(), 1)
+        
+        for _ in range(2):
+            call_command('backfill_trends', batch_size=2, stdout=StringIO())
+            self.assertEqual(BookStatusEvent.objects.for_user(self.user).count(), 4)
+        periods = reading_trends(self.user, days=31, group='month', today=timezone.datetime(2024, 1, 31).date())
+        self.assertEqual(
+            [(p['added'], p['completed'], p['planned']) for p in periods], [(3, 2, 1)],
+        )
+    
+    def test_trends_endpoint_reads_only_rollups(self):
+        for i in range(3):
+            Book.objects.create(title=f'Book {i}', author='A', status='Completed', user=self.user)
+        with self.assertNumQueries(3):
+            response = self.client.get('/trends/?group=week&days=14')
+        data = response.json()
+        self.assertEqual((data['group'], data['days']), ('week', 14))
+        self.assertEqual(sum(p['completed'] for p in data['periods']), 3)
+        self.assertEqual(data['periods'][-1]['added'], 3)
+        self.assertEqual(self.client.get('/trends/?group=year').status_code, 400)
+
+
+class LibraryAnalyticsTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        User.objects.create_user(username='idle', password='testpass123')
+        jan = timezone.datetime(2024, 1, 15, 12, tzinfo=timezone.utc)
+        feb = timezone.datetime(2024, 2, 1, 12, tzinfo=timezone.utc)
+        Book.objects.bulk_create([
+            Book(title='Dune', author='Frank Herbert', status='Reading', date_added=jan, user=self.reader),
+            Book(title='Emma', author='Jane Austen', status='Planned', date_added=jan, user=self.reader),
+            Book(title='DUNE!', author='frank herbert', status='Planned', date_added=feb, user=self.other),
+        ])
+        ArchivedBook.objects.create(title='Dune', author='Frank Herbert', date_added=jan, user=self.reader)
+    
+    def analytics(self, *args):
+        out = StringIO()
+        call_command('library_analytics', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+    
+    def test_json_report(self):
+        report = json.loads(self.analytics('--users-per-task', '1', '--top', '1'))
+        
+        self.assertEqual(report['books'], 4)
+        per_user = report['books_per_user']
+        self.assertEqual((per_user['users'], per_user['users_with_books']), (3, 2))
+        self.assertEqual((per_user['p50'], per_user['max'], per_user['mean']), (1, 3, 2.0))
+        self.assertEqual(report['statuses'], {'Planned': 2, 'Reading': 1, 'Completed': 1})
+        self.assertEqual(report['added'], [{'period': '2024-01-01', 'books': 3}, {'period': '2024-02-01', 'books': 1}])
+        self.assertEqual(report['top_works'], [{'work': 'dune|frank herbert', 'books': 3}])
+        self.assertEqual(report['top_authors'], [{'author': 'frank herbert', 'books': 3}])
+    
+    def test_csv_report(self):
+        rows = self.analytics('--format', 'csv', '--period', 'week').splitlines()
+        self.assertEqual(rows[0], 'section,key,value')
+        self.assertIn('added,2024-01-15,3', rows)
+        self.assertIn('added,2024-01-29,1', rows)
+        self.assertIn('books_per_user_histogram,2-3,1', rows)
+    
+    def test_top_counter_bounds_memory_and_error(self):
+        counter = TopCounter(capacity=4)
+        counter.update(['a'] * 10 + ['b'] * 5)
+        counter.update(['c', 'd', 'e'])
+        self.assertLessEqual(len(counter.counts), 4)
+        self.assertEqual(counter.most_common(2), [('a', 10), ('b', 5)])
+        self.assertEqual(counter.error, 1)
+
+
+class BookAdminTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.login(username='admin', password='testpass123')
+    
+    def add_books(self, count, start=0, every_year=False):
+        for i in range(start, start + count):
+            user = User.objects.create_user(username=f'reader{i}')
+            years = range(2020, 2023) if every_year else [2020 + i % 3]
+            Book.objects.bulk_create([
+                Book(title=f'Book {i}', author='A', date_added=timezone.datetime(year, 1 + i % 12, 1, tzinfo=timezone.utc), user=user)
+                for year in years
+            ])
+    
+    def shard_params(self, alias):
+        return {'shard': alias} if is_sharded() else {}
+    
+    def changelists(self, path='/admin/library/book/', **params):
+        """The changelist of each book database, picked with the shard filter."""
+        return {alias: self.client.get(path, {**params, **self.shard_params(alias)}) for alias in settings.BOOK_SHARDS}
+    
+    def changelist_queries(self):
+        captured = {}
+        for alias in settings.BOOK_SHARDS:
+            with CaptureQueriesContext(connections[alias]) as queries:
+                response = self.client.get('/admin/library/book/', self.shard_params(alias))
+            captured[alias] = (response, queries.captured_queries)
+        return captured
+    
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        # Every reader has a book in each year, so a shard with any books
+        # shows the same years (and probes) however many it holds
+        self.add_books(3, every_year=True)
+        few = self.changelist_queries()
+        self.add_books(20, start=3, every_year=True)
+        many = self.changelist_queries()
+        for alias, (response, queries) in many.items():
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([q for q in queries if 'datetime_trunc' in q['sql'] or 'DISTINCT' in q['sql']])
+            if few[alias][0].context['cl'].result_list:
+                self.assertEqual(len(few[alias][1]), len(queries))
+                self.assertContains(response, '?date_added__year=2020')
+                self.assertContains(response, '?date_added__year=2022')
+    
+    def test_changelists_cover_every_shard(self):
+        self.add_books(12)
+        responses = self.changelists()
+        titles = sorted(book.title for response in responses.values() for book in response.context['cl'].result_list)
+        self.assertEqual(titles, sorted(f'Book {i}' for i in range(12)))
+        for alias, response in responses.items():
+            usernames = {book.user.username for book in response.context['cl'].result_list}
+            self.assertEqual(usernames, {
+                user.username for user in User.objects.filter(username__startswith='reader')
+                if shard_for_user(user.pk) == alias
+            })
+    
+    def test_date_hierarchy_drills_down_by_probing(self):
+        self.add_books(12)
+        responses = self.changelists(date_added__year=2021).values()
+        self.assertTrue(any('date_added__month=2&amp;date_added__year=2021' in r.content.decode() for r in responses))
+        for response in responses:
+            self.assertNotContains(response, 'date_added__month=3&amp;date_added__year=2021')
+        self.assertEqual(sum(len(r.context['cl'].result_list) for r in responses), 4)
+    
+    def test_change_and_delete_on_the_books_shard(self):
+        self.add_books(2)
+        for user in User.objects.filter(username__startswith='reader'):
+            alias = shard_for_user(user.pk)
+            book = Book.objects.for_user(user).get()
+            preserved = {'_changelist_filters': urlencode(self.shard_params(alias))}
+            url = f'/admin/library/book/{book.pk}/change/?{urlencode(preserved)}'
+            response = self.client.post(url, {
+                'title': 'Renamed', 'author': 'A', 'status': book.status, 'user': user.pk,
+                'date_added_0': '2021-01-01', 'date_added_1': '00:00:00',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Book.objects.for_user(user).get().title, 'Renamed')
+            
+            response = self.client.post(f'/admin/library/book/?{urlencode(self.shard_params(alias))}', {
+                'action': 'delete_selected', '_selected_action': [book.pk], 'post': 'yes',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertFalse(Book.objects.for_user(user).exists())
+            event = BookStatusEvent.objects.using(alias).filter(user_id=user.pk, book_id=book.pk).latest('id')
+            self.assertEqual((event.old_status, event.new_status), (book.status, ''))
+    
+    def test_prefix_search(self):
+        user = User.objects.create_user(username='reader')
+        for title, author in [('Dune', 'Frank Herbert'), ('The Dune Road', 'X'), ('Émile', 'Rousseau')]:
+            Book.objects.create(title=title, author=author, user=user)
+        
+        def titles(term):
+            responses = self.changelists(q=term).values()
+            return sorted(book.title for response in responses for book in response.context['cl'].result_list)
+        
+        self.assertEqual(titles('dun'), ['Dune'])
+        self.assertEqual(titles('FRANK'), ['Dune'])
+        self.assertEqual(titles('Émi'), ['Émile'])
+        response = self.client.get('/admin/library/profile/', {'q': 'read'})
+        self.assertEqual([p.user.username for p in response.context['cl'].result_list], ['reader'])
+    
+    def test_estimated_count_paginator(self):
+        user = User.objects.create_user(username='reader')
+        Book.objects.bulk_create([Book(title=f'Book {i}', author='A', user=user) for i in range(5)])
+        books = Book.objects.using(shard_for_user(user.pk)).order_by('pk')
+        with mock.patch('library.paginators.estimated_row_count', return_value=250000):
+            self.assertEqual(EstimatedCountPaginator(books, 100).count, 250000)
+            self.assertEqual(EstimatedCountPaginator(books.filter(author='A'), 100).count, 5)
+        with mock.patch('library.paginators.estimated_row_count', return_value=None):
+            self.assertEqual(EstimatedCountPaginator(books, 100).count, 5)
+        with mock.patch.object(EstimatedCountPaginator, 'count_limit', 3):
+            self.assertEqual(EstimatedCountPaginator(books.filter(author='A'), 2).num_pages, 2)
+
+
+class BookFingerprintTest(TestCase):
+    databases = BOOK_DATABASES
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.dune = Book.objects.create(title='Dune', author='Frank Herbert', status='Reading', user=self.user)
+    
+    def test_fingerprint_is_kept_on_every_write(self):
+        self.assertEqual(book_fingerprint('  DUNE!', 'frank   herbert'), self.dune.fingerprint)
+        self.assertNotEqual(book_fingerprint('Dune Messiah', 'Frank Herbert'), self.dune.fingerprint)
+        
+        self.dune.title = 'Emma'
+        self.dune.save(update_fields=['title'])
+        self.dune.refresh_from_db()
+        self.assertEqual(self.dune.fingerprint, book_fingerprint('Emma', 'Frank Herbert'))
+        
+        [book] = Book.objects.bulk_create([Book(title='Émile', author='Rousseau', user=self.user)])
+        self.assertEqual(Book.objects.get(pk=book.pk).fingerprint, book_fingerprint('emile', 'ROUSSEAU'))
+    
+    def test_add_book_warns_about_duplicates(self):
+        with self.assertNumQueries(3):
+            response = self.client.post('/add/', {'title': 'dune', 'author': 'Frank Herbert.', 'status': 'Planned'})
+        self.assertContains(response, 'Already on your shelf')
+        self.assertEqual(Book.objects.count(), 1)
+        
+        # Confirming one book doesn't confirm another
+        self.client.post('/add/', {'title': 'dune', 'author': 'Frank Herbert', 'status': 'Planned',
+                                   'confirm_duplicate': book_fingerprint('Emma', 'Jane Austen')})
+        self.assertEqual(Book.objects.count(), 1)
+        
+        response = self.client.post('/add/', {'title': 'dune', 'author': 'Frank Herbert', 'status': 'Planned',
+                                              'confirm_duplicate': self.dune.fingerprint})
+        self.assertRedirects(response, '/dashboard/')
+        self.assertEqual(Book.objects.count(), 2)
+    
+    def test_import_warns_about_and_can_skip_duplicates(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('username,title,author\n')
+            f.write('testuser,DUNE,frank herbert\n')
+            f.write('testuser,Emma,Jane Austen\n')
+            f.write('testuser,emma,jane austen\n')
+        self.addCleanup(Path(f.name).unlink)
+        
+        err = StringIO()
+        call_command('import_books', f.name, '--skip-duplicates', stdout=StringIO(), stderr=err)
+        self.assertIn('Line 2: "DUNE" by frank herbert is already on the shelf', err.getvalue())
+        self.assertIn('Line 4:', err.getvalue())
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Dune', 'Emma'])
+        
+        call_command('import_books', f.name, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Book.objects.count(), 5)
+    
+    def test_dedupe_merges_into_earliest_copy(self):
+        other = User.objects.create_user(username='other')
+        later = timezone.now() + timedelta(days=1)
+        Book.objects.bulk_create([
+            Book(title='DUNE', author='Frank Herbert', status='Completed', date_added=later, user=self.user),
+            Book(title='Dune.', author='frank herbert', status='Planned', date_added=later, user=self.user),
+            Book(title='Dune', author='Frank Herbert', status='Planned', user=other),
+        ])
+        
+        out = StringIO()
+        call_command('dedupe_books', '--dry-run', stdout=out)
+        self.assertIn('Would remove 2 duplicate books.', out.getvalue())
+        self.assertEqual(Book.objects.count(), 4)
+        
+        call_command('dedupe_books', users_per_batch=1, stdout=StringIO())
+        kept = Book.objects.get(user=self.user)
+        self.assertEqual((kept.pk, kept.title, kept.status), (self.dune.pk, 'Dune', 'Completed'))
+        self.assertTrue(Book.objects.filter(user=other).exists())
+        self.assertEqual(
+            sorted(BookStatusEvent.objects.filter(user=self.user, book_id=self.dune.pk).values_list('new_status', flat=True)),
+            ['Completed', 'Reading'],
+        )
+        self.assertEqual(BookStatusEvent.objects.filter(user=self.user, new_status='').count(), 2)
+
+
+
+class LiveUpdatesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+    
+    def test_book_writes_publish_after_commit(self):
+        broker = mock.Mock()
+        with mock.patch('library.live.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks() as callbacks:
+                book = Book.objects.create(title='Dune', author='Frank Herbert', user=self.user)
+            broker.publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                book.status = 'Reading'
+                book.save()
+                book.delete()
+        
+        events = [call.args for call in broker.publish.call_args_list]
+        self.assertEqual([(user_id, event['type']) for user_id, event in events],
+                         [(self.user.pk, 'book.added'), (self.user.pk, 'book.updated'), (self.user.pk, 'book.deleted')])
+        self.assertEqual(events[0][1]['book']['title'], 'Dune')
+        self.assertEqual((events[1][1]['old_status'], events[1][1]['book']['status']), ('Planned', 'Reading'))
+        self.assertEqual(events[2][1]['book'], {'id': events[0][1]['book']['id'], 'status': 'Reading'})
+    
+    async def test_in_process_broker(self):
+        broker = InProcessBroker()
+        async with broker.subscribe(self.user.pk) as subscription:
+            # Published from a worker thread, as sync views do
+            await sync_to_async(broker.publish, thread_sensitive=False)(self.user.pk, {'type': 'mine'})
+            broker.publish(0, {'type': 'theirs'})
+            self.assertEqual(await subscription.get(1), (1, {'type': 'mine'}))
+            self.assertTrue(subscription.queue.empty())
+        
+        self.assertEqual(await broker.replay(self.user.pk, 0), [(1, {'type': 'mine'})])
+        self.assertEqual(await broker.replay(0, 1), [(2, {'type': 'theirs'})])
+        self.assertEqual(broker.parse_id(broker.format_id(2)), 2)
+        # Ids from another process (or before a restart) can't be replayed
+        self.assertIsNone(broker.parse_id('0badf00d-2'))
+    
+    @override_settings(LIVE_UPDATES_POLL_SECONDS=0.01)
+    async def test_database_broker_relays_through_table(self):
+        broker = DatabaseBroker()
+        await sync_to_async(broker.publish)(self.user.pk, {'type': 'before'})
+        async with broker.subscribe(self.user.pk) as subscription:
+            await sync_to_async(broker.publish)(self.user.pk, {'type': 'after'})
+            seq, event = await subscription.get(2)
+            self.assertEqual(event, {'type': 'after'})
+        await asyncio.wait_for(broker._poller, 1)
+        
+        first = seq - 1
+        self.assertEqual(await broker.replay(self.user.pk, first), [(seq, {'type': 'after'})])
+        self.assertEqual(broker.cursor, seq)
+    
+    @override_settings(LIVE_UPDATES_RETENTION=0)
+    def test_database_broker_prunes_old_events(self):
+        broker = DatabaseBroker()
+        for n in range(3):
+            broker.publish(self.user.pk, {'type': 'book.added', 'n': n})
+        # The newest event always stays
+        self.assertEqual(list(LiveEvent.objects.values_list('payload__n', flat=True)), [2])
+        first = LiveEvent.objects.get().pk - 2
+        # Events after ``first`` were pruned, so the dashboard has to reload
+        self.assertIsNone(async_to_sync(broker.replay)(self.user.pk, first))
+    
+    async def test_event_stream(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        broker = get_broker()
+        broker.publish(self.user.pk, {'type': 'missed', 'n': 1})
+        broker.publish(self.user.pk, {'type': 'missed', 'n': 2})
+        missed_from = broker.format_id(broker.cursor - 1)
+        
+        response = await self.async_client.get('/events/', headers={'Last-Event-ID': missed_from})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        chunks = response.streaming_content
+        try:
+            self.assertEqual(await anext(chunks), b'retry: 2000\n\n')
+            self.assertEqual(await anext(chunks),
+                             f'id: {broker.format_id(broker.cursor)}\ndata: {{"type": "missed", "n": 2}}\n\n'.encode())
+            
+            # Live events arrive once the stream is waiting
+            pending = asyncio.ensure_future(anext(chunks))
+            await asyncio.sleep(0.05)
+            broker.publish(self.user.pk, {'type': 'live'})
+            self.assertIn(b'data: {"type": "live"}', await asyncio.wait_for(pending, 1))
+        finally:
+            await chunks.aclose()
+        
+        # An id from before a restart: the resync carries the current one,
+        # which the dashboard hasn't seen
+        response = await self.async_client.get('/events/', headers={'Last-Event-ID': '0badf00d-1'})
+        chunks = response.streaming_content
+        self.assertEqual([chunk async for chunk in chunks][1:],
+                         [f'id: {broker.format_id(broker.cursor)}\ndata: {{"type": "resync"}}\n\n'.encode()])
+    
+    async def test_event_stream_resyncs_after_overflow(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        broker = get_broker()
+        broker.publish(self.user.pk, {'type': 'seen'})
+        seen = broker.format_id(broker.cursor)
+        
+        with mock.patch.object(broker, 'queue_size', 2):
+            response = await self.async_client.get('/events/', headers={'Last-Event-ID': seen})
+            chunks = response.streaming_content
+            try:
+                self.assertEqual(await anext(chunks), b'retry: 2000\n\n')
+                pending = asyncio.ensure_future(anext(chunks))
+                await asyncio.sleep(0.05)
+                # More than the stream's queue holds before it gets to run
+                for n in range(3):
+                    broker.publish(self.user.pk, {'type': 'live', 'n': n})
+                resync = await asyncio.wait_for(pending, 1)
+            finally:
+                await chunks.aclose()
+        self.assertEqual(resync, f'id: {broker.format_id(broker.cursor)}\ndata: {{"type": "resync"}}\n\n'.encode())
+        self.assertNotEqual(broker.format_id(broker.cursor), seen)
+    
+    async def test_event_stream_requires_login(self):
+        response = await self.async_client.get('/events/')
+        self.assertEqual(response.status_code, 401)
+    
+    def test_event_stream_needs_asgi(self):
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get('/events/')
+        self.assertEqual(response.status_code, 204)
+    
+    def test_dashboard_renders_live_hooks(self):
+        self.client.login(username='testuser', password='testpass123')
+        Book.objects.create(title='Dune', author='Frank Herbert', user=self.user)
+        response = self.client.get('/dashboard/?status=Reading')
+        self.assertContains(response, 'data-events-url="/events/"')
+        self.assertContains(response, 'data-status-filter="Reading"')
+        self.assertContains(response, '<h3 class="card-title" data-stat="total">1</h3>', html=True)
+        self.assertContains(response, 'id="book-card-template"')
+
+
+class StartupWarmupTest(TestCase):
+    # open_connections() connects to every alias, replicas included
+    databases = '__all__'
+    
+    def test_warm_templates_fills_the_cached_loader(self):
+        names = dict(project_templates())
+        engine = next(iter(names))
+        self.assertIn('library/dashboard.html', names[engine])
+        self.assertIn('admin/library/book/change_list.html', names[engine])
+        # Only this project's templates, not Django's own admin ones
+        self.assertNotIn('admin/base.html', names[engine])
+        
+        loader = engine.engine.template_loaders[0]
+        loader.reset()
+        self.assertEqual(warm_templates(), len(names[engine]))
+        self.assertIn('library/dashboard.html', loader.get_template_cache)
+    
+    def test_open_connections(self):
+        self.assertEqual(open_connections(), list(settings.DATABASES))
+    
+    def test_only_wsgi_workers_open_connections(self):
+        env = {**os.environ, 'STARTUP_WARMUP': 'True', 'DJANGO_SETTINGS_MODULE': 'BookShelf.settings'}
+        script = ('import importlib, sys, django; django.setup(); from django.db import connection; '
+                  'setup = connection.connection is not None; importlib.import_module(sys.argv[1]); '
+                  'print(setup, connection.connection is not None)')
+        opened = {}
+        for module in ('BookShelf.wsgi', 'BookShelf.asgi'):
+            result = subprocess.run([sys.executable, '-c', script, module], cwd=settings.BASE_DIR, env=env,
+                                    capture_output=True, text=True, check=True)
+            opened[module] = result.stdout.strip()
+        # Management commands only set up Django, and don't connect for it
+        self.assertEqual(opened, {'BookShelf.wsgi': 'False True', 'BookShelf.asgi': 'False False'})
+    
+    def test_views_defer_ai_dependencies(self):
+        script = ('import sys, django; django.setup(); import BookShelf.urls; '
+                  'print(sorted({"requests", "library.ai_client", "library.quizzes"} & set(sys.modules)))')
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+
+# Virtual users run in their own threads, which only see committed data
+class LoadtestTest(TransactionTestCase):
+    def _slo_file(self, slos):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(slos, f)
+        self.addCleanup(Path(f.name).unlink)
+        return f.name
+    
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('dashboard=3, add_book=1.5'), {'dashboard': 3, 'add_book': 1.5})
+        for bad in ('browse=1', 'dashboard=x', 'dashboard=-1', 'dashboard=0'):
+            with self.assertRaises(ValueError):
+                parse_mix(bad)
+    
+    def test_check_slos(self):
+        report = {
+            'overall': {'requests': 10, 'error_rate': 0.1, 'rps': 5},
+            'endpoints': {'GET /dashboard/': {'requests': 10, 'p95_ms': 80, 'rps': 5}},
+        }
+        slos = {
+            'overall': {'error_rate': 0.01, 'min_rps': 2},
+            'endpoints': {'GET /dashboard/': {'p95_ms': 100}, 'POST /add/': {'p95_ms': 100}},
+        }
+        self.assertEqual(check_slos(report, slos), [
+            ('overall', 'error_rate', 0.1, 0.01, False),
+            ('overall', 'min_rps', 5, 2, True),
+            ('GET /dashboard/', 'p95_ms', 80, 100, True),
+        ])
+    
+    def test_loadtest_runs_mixed_workload(self):
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        output = Path(output_dir.name) / 'report.json'
+        index_dir = Path(output_dir.name) / 'recommender'
+        out = StringIO()
+        with override_settings(RECOMMENDER_INDEX_DIR=index_dir):
+            call_command('loadtest', users=1, duration=1, think=0.02, ai_delay=0, books=3, output=str(output),
+                         slo=self._slo_file({'overall': {'error_rate': 0}}), stdout=out)
+        
+        report = json.loads(output.read_text())
+        self.assertGreater(report['overall']['requests'], 0)
+        self.assertEqual(report['overall']['errors'], 0)
+        self.assertEqual(report['endpoints']['POST /auth/login/']['errors'], 0)
+        self.assertIn('PASS overall error_rate', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='loadtest-user-').exists())
+        self.assertFalse(Book.objects.exists())
+        # The books it added went to a throwaway index
+        self.assertFalse(index_dir.exists())
+    
+    def test_loadtest_fails_on_missed_slo(self):
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 of 1 SLO checks failed.'):
+            call_command('loadtest', users=1, duration=0.5, think=0, mix='dashboard=1', books=1,
+                         slo=self._slo_file({'endpoints': {'GET /dashboard/': {'p50_ms': 0}}}), stdout=out)
+        self.assertIn('FAIL GET /dashboard/ p50_ms', out.getvalue())
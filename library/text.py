@@ -0,0 +1,22 @@
+import hashlib
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """Case-fold ``text``, strip accents and collapse punctuation/whitespace to single spaces."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def work_key(title, author):
+    """The same string for the same book however its title and author are typed."""
+    return f'{normalize_text(title)}|{normalize_text(author)}'
+
+
+def book_fingerprint(title, author):
+    """Short, fixed-size hash of ``work_key``, stored on each book for indexed lookups."""
+    return hashlib.blake2b(work_key(title, author).encode('utf-8'), digest_size=8).hexdigest()
@@ -0,0 +1,141 @@
+"""
+Reading trends from the shelf-change log.
+
+Every shelf change is appended to ``BookStatusEvent`` and added to the
+user's ``BookStatusDaily`` row for that day in the same transaction, so
+trends read at most one row per day of their range however many books the
+user has, and nothing is ever recomputed from the books. Books shelved
+before the log existed are seeded once with ``manage.py backfill_trends``.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .sharding import shard_for_user
+
+STATUS_COLUMNS = {'Reading': 'reading', 'Completed': 'completed', 'Planned': 'planned'}
+TREND_COLUMNS = ('added', 'removed', 'reading', 'completed', 'planned')
+GROUPS = ('day', 'week', 'month')
+MAX_TREND_DAYS = 730
+
+
+def _day(when):
+    return timezone.localdate(when) if timezone.is_aware(when) else when.date()
+
+
+def record_status_changes(changes, using=None):
+    """
+    Log ``(user_id, book_id, old_status, new_status, when)`` changes and add
+    them to the daily rollups. ``old_status`` is None for a new book,
+    ``new_status`` None for a deleted one and ``when`` None for now. Without
+    ``using``, each user's changes go to the shard holding their books.
+    """
+    from .models import BookStatusEvent
+
+    now = timezone.now()
+    by_alias = {}
+    for change in changes:
+        by_alias.setdefault(using or shard_for_user(change[0]), []).append(change)
+
+    for alias, alias_changes in by_alias.items():
+        events = []
+        deltas = {}
+        for user_id, book_id, old_status, new_status, when in alias_changes:
+            when = when or now
+            events.append(BookStatusEvent(
+                user_id=user_id, book_id=book_id, created_at=when,
+                old_status=old_status or '', new_status=new_status or '',
+            ))
+            counts = deltas.setdefault((user_id, _day(when)), Counter())
+            if old_status is None:
+                counts['added'] += 1
+            if new_status is None:
+                counts['removed'] += 1
+            elif new_status in STATUS_COLUMNS:
+                counts[STATUS_COLUMNS[new_status]] += 1
+
+        with transaction.atomic(using=alias):
+            BookStatusEvent.objects.using(alias).bulk_create(events)
+            if len(deltas) == 1:
+                [((user_id, day), counts)] = deltas.items()
+                _increment(alias, user_id, day, counts)
+            else:
+                _increment_many(alias, deltas)
+
+
+def _increment_many(alias, deltas):
+    """Apply many ``(user_id, day) -> counts`` deltas with one read and two bulk writes."""
+    from .models import BookStatusDaily
+
+    days = [day for _, day in deltas]
+    rows = BookStatusDaily.objects.using(alias).select_for_update().filter(
+        user_id__in={user_id for user_id, _ in deltas}, day__gte=min(days), day__lte=max(days),
+    )
+    existing = {(row.user_id, row.day): row for row in rows}
+    updated, created = [], []
+    for key, counts in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(BookStatusDaily(user_id=key[0], day=key[1], **counts))
+            continue
+        for column, n in counts.items():
+            setattr(row, column, getattr(row, column) + n)
+        updated.append(row)
+
+    BookStatusDaily.objects.using(alias).bulk_update(updated, TREND_COLUMNS, batch_size=500)
+    try:
+        with transaction.atomic(using=alias):
+            BookStatusDaily.objects.using(alias).bulk_create(created, batch_size=500)
+    except IntegrityError:
+        # Some rows were created concurrently; fall back to one upsert each
+        for row in created:
+            _increment(alias, row.user_id, row.day, {column: getattr(row, column) for column in TREND_COLUMNS})
+
+
+def _increment(alias, user_id, day, counts):
+    from .models import BookStatusDaily
+
+    rows = BookStatusDaily.objects.using(alias).filter(user_id=user_id, day=day)
+    increments = {column: F(column) + n for column, n in counts.items()}
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic(using=alias):
+            BookStatusDaily.objects.using(alias).create(user_id=user_id, day=day, **counts)
+    except IntegrityError:
+        # A concurrent writer created the row after our update
+        rows.update(**increments)
+
+
+def _period(day, group):
+    if group == 'week':
+        return day - timedelta(days=day.weekday())
+    if group == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def reading_trends(user, days=365, group='month', today=None):
+    """
+    The user's rollups over the last ``days`` days summed per ``group``
+    period, oldest first, with empty periods included.
+    """
+    from .models import BookStatusDaily
+
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    totals = {}
+    day = start
+    while day <= today:
+        totals.setdefault(_period(day, group), dict.fromkeys(TREND_COLUMNS, 0))
+        day += timedelta(days=1)
+
+    rows = BookStatusDaily.objects.for_user(user).filter(day__gte=start, day__lte=today)
+    for day, *values in rows.values_list('day', *TREND_COLUMNS):
+        period = totals[_period(day, group)]
+        for column, value in zip(TREND_COLUMNS, values):
+            period[column] += value
+    return [{'period': period.isoformat(), **values} for period, values in totals.items()]
@@ -7,6 +7,8 @@ urlpatterns = [
     path('add/', views.add_book, name='add_book'),
     path('update/<int:book_id>/', views.update_book, name='update_book'),
     path('delete/<int:book_id>/', views.delete_book, name='delete_book'),
+    path('events/', views.book_events, name='book_events'),
+    path('trends/', views.reading_trends_view, name='reading_trends'),
     path('auth/register/', views.register_view, name='register'),
     path('auth/login/', views.login_view, name='login'),
     path('auth/logout/', views.logout_view, name='logout'),
@@ -17,5 +19,8 @@ urlpatterns = [
     path('ai/summarize/', views.ai_summarize, name='ai_summarize'),
     path('ai/recommend/', views.ai_recommend, name='ai_recommend'),
     path('ai/quiz/', views.ai_quiz, name='ai_quiz'),
+    path('ai/quiz/shelf/', views.ai_shelf_quiz, name='ai_shelf_quiz'),
+    path('ai/similar/', views.ai_similar, name='ai_similar'),
+    path('ai/status/', views.ai_status, name='ai_status'),
 ]
 
@@ -1,16 +1,22 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib import messages
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from .models import Book, Profile
+from django.db.models import Count, Q
+from django.utils import timezone
+from . import live
+from .models import ArchivedBook, Book, BookQuiz, Profile
+from .text import book_fingerprint
+from .trends import GROUPS, MAX_TREND_DAYS, reading_trends
 from .forms import BookForm, RegisterForm, ProfileForm
 import json
-import requests
 
 
 def index(request):
@@ -22,17 +28,31 @@ def index(request):
 def dashboard(request):
     """Dashboard view showing user's books with statistics."""
     status_filter = request.GET.get('status', None)
+    show_archived = request.GET.get('archived') == '1'
     
-    if status_filter:
-        books = Book.objects.filter(user=request.user, status=status_filter)
+    user_books = Book.objects.for_user(request.user)
+    archived = ArchivedBook.objects.for_user(request.user)
+    
+    # Archived books are only read when asked for
+    if show_archived:
+        books = archived
+    elif status_filter:
+        books = user_books.filter(status=status_filter)
     else:
-        books = Book.objects.filter(user=request.user)
+        books = user_books
     
-    # Calculate statistics
-    total_books = Book.objects.filter(user=request.user).count()
-    completed_books = Book.objects.filter(user=request.user, status='Completed').count()
-    reading_books = Book.objects.filter(user=request.user, status='Reading').count()
-    planned_books = Book.objects.filter(user=request.user, status='Planned').count()
+    # Calculate statistics over both tiers; archived books are all Completed
+    stats = user_books.aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='Completed')),
+        reading=Count('id', filter=Q(status='Reading')),
+        planned=Count('id', filter=Q(status='Planned')),
+    )
+    archived_books = archived.count()
+    total_books = stats['total'] + archived_books
+    completed_books = stats['completed'] + archived_books
+    reading_books = stats['reading']
+    planned_books = stats['planned']
     
     # Calculate completion percentage
     completion_percentage = (completed_books / total_books * 100) if total_books > 0 else 0
@@ -44,7 +64,9 @@ def dashboard(request):
         'reading_books': reading_books,
         'planned_books': planned_books,
         'completion_percentage': round(completion_percentage, 1),
+        'archived_books': archived_books,
         'status_filter': status_filter,
+        'show_archived': show_archived,
     }
     
     return render(request, 'library/dashboard.html', context)
@@ -52,26 +74,31 @@ def dashboard(request):
 
 @login_required
 def add_book(request):
-    """Add a new book view."""
+    """Add a new book view. Asks for confirmation before shelving a book twice."""
+    duplicates = []
     if request.method == 'POST':
         form = BookForm(request.POST)
         if form.is_valid():
             book = form.save(commit=False)
             book.user = request.user
-            book.save()
-            messages.success(request, f'Book "{book.title}" added successfully!')
-            return redirect('dashboard')
+            # Confirmation only covers the book it was given for
+            if request.POST.get('confirm_duplicate') != book_fingerprint(book.title, book.author):
+                duplicates = list(Book.duplicates_of(request.user, book.title, book.author)[:3])
+            if not duplicates:
+                book.save()
+                messages.success(request, f'Book "{book.title}" added successfully!')
+                return redirect('dashboard')
     else:
         form = BookForm()
     
-    return render(request, 'library/add.html', {'form': form})
+    return render(request, 'library/add.html', {'form': form, 'duplicates': duplicates})
 
 
 @login_required
 @require_http_methods(["POST"])
 def update_book(request, book_id):
     """Update book status via AJAX."""
-    book = get_object_or_404(Book, id=book_id, user=request.user)
+    book = get_object_or_404(Book.objects.for_user(request.user), id=book_id)
     
     new_status = request.POST.get('status')
     if new_status in ['Reading', 'Completed', 'Planned']:
@@ -93,7 +120,7 @@ def update_book(request, book_id):
 @require_http_methods(["POST"])
 def delete_book(request, book_id):
     """Delete a book via AJAX."""
-    book = get_object_or_404(Book, id=book_id, user=request.user)
+    book = get_object_or_404(Book.objects.for_user(request.user), id=book_id)
     book_title = book.title
     book.delete()
     
@@ -103,6 +130,63 @@ def delete_book(request, book_id):
     })
 
 
+def _authenticated_user_id(request):
+    return request.user.pk if request.user.is_authenticated else None
+
+
+async def book_events(request):
+    """
+    Server-sent event stream of the user's shelf changes, applied in place
+    by the dashboard. Only served over ASGI: under WSGI every open stream
+    would hold a worker, so it answers 204 and the browser stops asking.
+    """
+    # login_required and require_http_methods can't wrap async views in Django 4.2
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user_id = await sync_to_async(_authenticated_user_id)(request)
+    if user_id is None:
+        return HttpResponse(status=401)
+    
+    response = StreamingHttpResponse(
+        live.stream(user_id, request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_http_methods(["GET"])
+def reading_trends_view(request):
+    """
+    Reading trends via AJAX.
+    Returns books added, removed and moved to each status per day, week or
+    month, read from the daily rollups rather than the books themselves.
+    """
+    group = request.GET.get('group', 'month')
+    if group not in GROUPS:
+        return JsonResponse({
+            'success': False,
+            'message': f'group must be one of {", ".join(GROUPS)}'
+        }, status=400)
+    
+    try:
+        days = min(max(int(request.GET.get('days', 365)), 1), MAX_TREND_DAYS)
+    except ValueError:
+        days = 365
+    
+    return JsonResponse({
+        'success': True,
+        'group': group,
+        'days': days,
+        'periods': reading_trends(request.user, days, group),
+    })
+
+
 def register_view(request):
     """User registration view."""
     if request.user.is_authenticated:
@@ -129,15 +213,12 @@ def login_view(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.info(request, f'Welcome back, {username}!')
-                return redirect('dashboard')
-            else:
-                messages.error(request, 'Invalid username or password.')
+            # The form already authenticated the user; calling authenticate()
+            # again would repeat the password hash and the user lookup.
+            user = form.get_user()
+            login(request, user)
+            messages.info(request, f'Welcome back, {user.get_username()}!')
+            return redirect('dashboard')
         else:
             messages.error(request, 'Invalid username or password.')
     else:
@@ -181,6 +262,9 @@ def ai_summarize(request):
     AI Book Summarizer endpoint.
     Accepts text and returns a concise AI-generated summary.
     """
+    # AI clients (and requests) load with the first AI call, not at boot
+    from . import ai_client
+    
     try:
         # Parse JSON request body
         data = json.loads(request.body)
@@ -199,12 +283,6 @@ def ai_summarize(request):
                 'error': 'OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.'
             }, status=500)
         
-        # Call OpenAI API using direct HTTP requests
-        headers = {
-            'Authorization': f'Bearer {settings.OPENAI_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             'model': 'gpt-3.5-turbo',
             'messages': [
@@ -221,40 +299,31 @@ def ai_summarize(request):
             'temperature': 0.7
         }
         
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+        summary = ai_client.chat(payload)
         
-        if response.status_code == 200:
-            result = response.json()
-            summary = result['choices'][0]['message']['content'].strip()
-            
-            return JsonResponse({
-                'success': True,
-                'summary': summary
-            })
-        else:
-            error_msg = response.json().get('error', {}).get('message', 'Unknown error')
-            return JsonResponse({
-                'success': False,
-                'error': f'OpenAI API error: {error_msg}'
-            }, status=500)
+        return JsonResponse({
+            'success': True,
+            'summary': summary
+        })
     
-    except json.JSONDecodeError:
+    except ai_client.AIUnavailable as e:
         return JsonResponse({
             'success': False,
-            'error': 'Invalid JSON data.'
-        }, status=400)
+            'error': str(e)
+        }, status=503)
     
-    except requests.exceptions.Timeout:
+    except ai_client.AIError as e:
         return JsonResponse({
             'success': False,
-            'error': 'Request timeout. Please try again.'
+            'error': f'OpenAI API error: {e}'
         }, status=500)
     
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data.'
+        }, status=400)
+    
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -268,6 +337,9 @@ def ai_recommend(request):
     AI Book Recommender endpoint.
     Accepts a topic and returns AI-generated book recommendations.
     """
+    from . import ai_client
+    from .ai_output import RECOMMENDATIONS, parse_items
+    
     try:
         # Parse JSON request body
         data = json.loads(request.body)
@@ -286,112 +358,41 @@ def ai_recommend(request):
                 'error': 'OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.'
             }, status=500)
         
-        # Call OpenAI API using direct HTTP requests
-        headers = {
-            'Authorization': f'Bearer {settings.OPENAI_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             'model': 'gpt-3.5-turbo',
             'messages': [
                 {
                     'role': 'system',
-                    'content': 'You are a knowledgeable book recommendation assistant. Provide exactly 5 book recommendations. For each book, provide: 1) Title, 2) Author, 3) Brief description (2-3 sentences). Format each book on separate lines like this:\n\n1. [Title] by [Author]\n[Description]\n\n2. [Title] by [Author]\n[Description]'
+                    'content': 'You are a knowledgeable book recommendation assistant. Provide exactly 5 book recommendations, each with a title, author and brief description (2-3 sentences). ' + RECOMMENDATIONS.prompt
                 },
                 {
                     'role': 'user',
-                    'content': f'Recommend 5 books about: {topic}. Please format each recommendation clearly with title, author, and description.'
+                    'content': f'Recommend 5 books about: {topic}.'
                 }
             ],
+            'response_format': {'type': 'json_object'},
             'max_tokens': 1000,
             'temperature': 0.8
         }
         
-        api_response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if api_response.status_code != 200:
-            error_msg = api_response.json().get('error', {}).get('message', 'Unknown error')
+        # Answer from the local recommender when OpenAI is slow or down
+        try:
+            ai_response = ai_client.chat(payload, timeout=settings.AI_RECOMMEND_TIMEOUT)
+        except ai_client.AIUnavailable as e:
+            local_response = _local_recommendations(topic)
+            if local_response is not None:
+                return local_response
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=503)
+        except ai_client.AIError as e:
             return JsonResponse({
                 'success': False,
-                'error': f'OpenAI API error: {error_msg}'
+                'error': f'OpenAI API error: {e}'
             }, status=500)
         
-        # Parse the AI response
-        result = api_response.json()
-        ai_response = result['choices'][0]['message']['content'].strip()
-        
-        # Parse text response into structured data
-        recommendations = []
-        lines = ai_response.split('\n')
-        current_book = {}
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if it's a new book entry (starts with number)
-            if line and line[0].isdigit() and ('. ' in line or ') ' in line):
-                # Save previous book if exists
-                if current_book and 'title' in current_book and 'author' in current_book:
-                    recommendations.append(current_book)
-                
-                # Start new book
-                current_book = {}
-                
-                # Extract title and author from line like "1. Title by Author"
-                # Remove the number prefix
-                text = line.split('.', 1)[1].strip() if '.' in line else line.split(')', 1)[1].strip()
-                
-                if ' by ' in text.lower():
-                    # Split by "by" (case insensitive)
-                    parts = text.lower().split(' by ')
-                    title_part = text[:text.lower().index(' by ')].strip()
-                    author_part = text[text.lower().index(' by ') + 4:].strip()
-                    
-                    # Remove any trailing dashes or special chars
-                    title_part = title_part.rstrip(' -–—')
-                    author_part = author_part.split('\n')[0].strip()  # Only first line
-                    
-                    current_book['title'] = title_part
-                    current_book['author'] = author_part
-                    current_book['description'] = ''
-                else:
-                    # No author found in title line
-                    current_book['title'] = text
-                    current_book['author'] = 'Various Authors'
-                    current_book['description'] = ''
-            elif current_book and 'title' in current_book:
-                # Add to description
-                if line.lower().startswith('by '):
-                    # Found author on separate line
-                    if not current_book.get('author') or current_book['author'] == 'Various Authors':
-                        current_book['author'] = line[3:].strip()
-                else:
-                    # Add to description
-                    if current_book['description']:
-                        current_book['description'] += ' ' + line
-                    else:
-                        current_book['description'] = line
-        
-        # Don't forget the last book
-        if current_book and 'title' in current_book and 'author' in current_book:
-            recommendations.append(current_book)
-        
-        # Ensure all books have proper fields
-        for book in recommendations:
-            if not book.get('author'):
-                book['author'] = 'Various Authors'
-            if not book.get('description'):
-                book['description'] = 'A highly recommended book in this genre.'
-            # Clean up descriptions
-            book['description'] = book['description'].strip()
+        recommendations = parse_items(ai_response, RECOMMENDATIONS, limit=5)
         
         # Ensure we have at least some recommendations
         if not recommendations:
@@ -401,9 +402,6 @@ def ai_recommend(request):
                 {'title': f'Classic {topic} Literature', 'author': 'Various Authors', 'description': 'Timeless works that have shaped this genre.'}
             ]
         
-        # Limit to 5 recommendations
-        recommendations = recommendations[:5]
-        
         return JsonResponse({
             'success': True,
             'recommendations': recommendations
@@ -422,12 +420,68 @@ def ai_recommend(request):
         }, status=500)
 
 
+def _local_recommendations(topic, k=5):
+    """Recommendations for ``topic`` from the local index, or None if it has nothing."""
+    from .recommender import get_recommender
+    
+    matches = get_recommender().similar(topic, k)
+    if not matches:
+        return None
+    return JsonResponse({
+        'success': True,
+        'source': 'local',
+        'recommendations': [
+            {
+                'title': match['title'],
+                'author': match['author'],
+                'description': 'Shelved by readers on BookShelf with similar interests.',
+            }
+            for match in matches
+        ]
+    })
+
+
+@login_required
+@require_http_methods(["GET"])
+def ai_similar(request):
+    """
+    Local "similar books" endpoint, served from the recommender index.
+    Accepts title (and optionally author) query parameters and returns books
+    with similar titles/authors plus books shelved by the same readers.
+    """
+    from .recommender import get_recommender
+    
+    title = request.GET.get('title', '').strip()
+    author = request.GET.get('author', '').strip()
+    if not title:
+        return JsonResponse({
+            'success': False,
+            'error': 'Please provide a book title.'
+        }, status=400)
+    
+    try:
+        k = min(max(int(request.GET.get('k', 10)), 1), 50)
+    except ValueError:
+        k = 10
+    
+    recommender = get_recommender()
+    doc = recommender.lookup(title, author)
+    return JsonResponse({
+        'success': True,
+        'similar': recommender.similar(f'{title} {author}', k, exclude=doc),
+        'also_shelved': recommender.also_shelved(doc, k) if doc is not None else [],
+    })
+
+
 @require_http_methods(["POST"])
 def ai_quiz(request):
     """
     AI Quiz Generator endpoint.
     Accepts book title, author, and difficulty level, returns AI-generated quiz questions.
     """
+    from . import ai_client
+    from .ai_output import QUIZ, parse_items
+    
     try:
         # Parse JSON request body
         data = json.loads(request.body)
@@ -448,79 +502,37 @@ def ai_quiz(request):
                 'error': 'OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.'
             }, status=500)
         
-        # Call OpenAI API using direct HTTP requests
-        headers = {
-            'Authorization': f'Bearer {settings.OPENAI_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             'model': 'gpt-3.5-turbo',
             'messages': [
                 {
                     'role': 'system',
-                    'content': f'You are a quiz generator. Create {difficulty.lower()} level quiz questions about books. Provide exactly 5 questions with their answers. Format your response as a JSON array with objects containing "question" and "answer" fields.'
+                    'content': f'You are a quiz generator. Create {difficulty.lower()} level quiz questions about books. Provide exactly 5 questions with their answers. ' + QUIZ.prompt
                 },
                 {
                     'role': 'user',
                     'content': f'Generate 5 {difficulty.lower()} level quiz questions about the book "{title}" by {author}. Include the answers.'
                 }
             ],
+            'response_format': {'type': 'json_object'},
             'max_tokens': 1000,
             'temperature': 0.7
         }
         
-        api_response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if api_response.status_code != 200:
-            error_msg = api_response.json().get('error', {}).get('message', 'Unknown error')
+        try:
+            ai_response = ai_client.chat(payload)
+        except ai_client.AIUnavailable as e:
             return JsonResponse({
                 'success': False,
-                'error': f'OpenAI API error: {error_msg}'
+                'error': str(e)
+            }, status=503)
+        except ai_client.AIError as e:
+            return JsonResponse({
+                'success': False,
+                'error': f'OpenAI API error: {e}'
             }, status=500)
         
-        # Parse the AI response
-        result = api_response.json()
-        ai_response = result['choices'][0]['message']['content'].strip()
-        
-        # Try to parse as JSON, if it fails, create a structured response
-        try:
-            questions = json.loads(ai_response)
-        except:
-            # Fallback: parse text response into structured data
-            questions = []
-            lines = ai_response.split('\n')
-            current_question = {}
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith(('Q', '1.', '2.', '3.', '4.', '5.', 'Question')):
-                    if current_question and 'question' in current_question:
-                        questions.append(current_question)
-                    current_question = {}
-                    # Extract question
-                    q_text = line.lstrip('Q0123456789.:Question ').strip()
-                    current_question['question'] = q_text
-                elif line.startswith(('A', 'Answer')) and current_question:
-                    # Extract answer
-                    a_text = line.lstrip('A:Answer ').strip()
-                    current_question['answer'] = a_text
-            
-            if current_question and 'question' in current_question:
-                questions.append(current_question)
-            
-            # Ensure all questions have answers
-            for q in questions:
-                if 'answer' not in q:
-                    q['answer'] = 'Answer not provided.'
-        
-        # Ensure exactly 5 questions
-        questions = questions[:5]
+        questions = parse_items(ai_response, QUIZ, limit=5)
         
         # Pad with generic questions if less than 5
         while len(questions) < 5:
@@ -546,3 +558,116 @@ def ai_quiz(request):
             'error': f'An error occurred: {str(e)}'
         }, status=500)
 
+
+
+# Most books quizzed per shelf request
+SHELF_QUIZ_MAX_BOOKS = 100
+
+
+@login_required
+@require_http_methods(["POST"])
+def ai_shelf_quiz(request):
+    """
+    Shelf Quiz endpoint.
+    Accepts a shelf status and difficulty level and returns quiz questions for
+    every book on that shelf. Books are quizzed in a few batched AI calls and
+    the questions are stored per book, so repeat requests are served from the
+    database unless refresh is set.
+    """
+    from . import ai_client
+    from .quizzes import generate_quizzes
+    
+    try:
+        data = json.loads(request.body)
+        status = data.get('status', 'Reading').strip()
+        difficulty = data.get('difficulty', '').strip()
+        refresh = bool(data.get('refresh'))
+        
+        if status not in dict(Book.STATUS_CHOICES) or not difficulty or len(difficulty) > 20:
+            return JsonResponse({
+                'success': False,
+                'error': 'Please provide a shelf (Reading, Completed or Planned) and a difficulty level.'
+            }, status=400)
+        
+        if not settings.OPENAI_API_KEY:
+            return JsonResponse({
+                'success': False,
+                'error': 'OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.'
+            }, status=500)
+        
+        books = list(
+            Book.objects.for_user(request.user).filter(status=status)
+            .order_by('title', 'author').values_list('title', 'author').distinct()[:SHELF_QUIZ_MAX_BOOKS]
+        )
+        stored = {}
+        if not refresh:
+            quizzes = BookQuiz.objects.for_user(request.user).filter(
+                difficulty=difficulty, title__in={title for title, _ in books},
+            )
+            stored = {(quiz.title, quiz.author): quiz.questions for quiz in quizzes}
+        
+        generated, calls, error = generate_quizzes(
+            [book for book in books if book not in stored], difficulty,
+        )
+        if error is not None and not generated and not stored:
+            return JsonResponse({
+                'success': False,
+                'error': str(error)
+            }, status=503 if isinstance(error, ai_client.AIUnavailable) else 500)
+        
+        now = timezone.now()
+        BookQuiz.objects.bulk_create(
+            [
+                BookQuiz(user=request.user, title=title, author=author, difficulty=difficulty,
+                         questions=questions, created_at=now)
+                for (title, author), questions in generated.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'title', 'author', 'difficulty'],
+            update_fields=['questions', 'created_at'],
+        )
+        
+        quizzes, missing = [], []
+        for title, author in books:
+            questions = generated.get((title, author)) or stored.get((title, author))
+            if questions:
+                quizzes.append({
+                    'title': title,
+                    'author': author,
+                    'questions': questions,
+                    'stored': (title, author) not in generated,
+                })
+            else:
+                missing.append({'title': title, 'author': author})
+        
+        return JsonResponse({
+            'success': True,
+            'quizzes': quizzes,
+            'missing': missing,
+            'calls': calls,
+        })
+    
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data.'
+        }, status=400)
+    
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'An error occurred: {str(e)}'
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def ai_status(request):
+    """
+    AI provider health endpoint.
+    Returns the circuit breaker state and the recent call statistics behind it.
+    """
+    from . import ai_client
+    return JsonResponse({
+        'success': True,
+        'breaker': ai_client.breaker.status(),
+    })